@@ -0,0 +1,70 @@
+"""
+Peak memory of assembling one podcast episode from synthesized segments.
+
+    python -m benchmarks.bench_audio --segments 300 --seconds 6
+"""
+
+import argparse
+import base64
+import io
+import time
+import tracemalloc
+
+from src.audio import Audio, WAV_HEADER_SIZE, write_header
+
+
+def make_segment(seconds: float, sample_rate: int = 24000) -> bytes:
+    data_size = int(seconds * sample_rate) * 2
+    buffer = bytearray(WAV_HEADER_SIZE + data_size)
+    write_header(buffer, data_size, sample_rate)
+    return bytes(buffer)
+
+
+def legacy_job(responses: list[bytes]) -> int:
+    # io.BytesIO -> getvalue() -> pydantic Audio(wav=bytes) -> base64 for /connect_waves
+    segments = [io.BytesIO(response).getvalue() for response in responses]
+    encoded = [base64.b64encode(segment).decode("utf-8") for segment in segments]
+    # the engine returns the joined wav, read back into memory the same way
+    joined = io.BytesIO(
+        b"".join(base64.b64decode(data)[WAV_HEADER_SIZE:] for data in encoded)
+    ).getvalue()
+    return len(joined)
+
+
+def buffer_job(responses: list[bytes]) -> int:
+    segments = [Audio(response) for response in responses]
+    joined = Audio.concat(segments)
+    return len(joined)
+
+
+def measure(name: str, job, responses: list[bytes]):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = job(responses)
+    elapsed = time.perf_counter() - start
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{name:>8}: output {size / 1024**2:8.1f} MiB, "
+        f"peak {peak / 1024**2:8.1f} MiB, {elapsed * 1000:8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--segments", type=int, default=300)
+    parser.add_argument("--seconds", type=float, default=6.0)
+    args = parser.parse_args()
+
+    # the http responses are held by the client in both cases and are not counted
+    responses = [make_segment(args.seconds) for _ in range(args.segments)]
+    total = sum(len(response) for response in responses)
+    print(f"{args.segments} segments, {total / 1024**2:.1f} MiB synthesized")
+
+    measure("legacy", legacy_job, responses)
+    measure("buffer", buffer_job, responses)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+"""
+Concurrent users driving the web UI handlers (previews, generations, re-recordings and
+speaker changes) against local mock engine, LLM and content servers, to see where the
+server tips over as the number of users grows.
+
+    python -m benchmarks.bench_load --users 1,5,10,20 --output load.json
+    python -m benchmarks.bench_load --users 1,5,10,20 --compare load.json
+    python -m benchmarks.bench_load --users 1,5,10,20 --mode fast --compare load.json
+
+The handlers run in this process and the jobs in worker processes, as with `webui.py`.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import orjson
+from aiohttp import web
+
+from tests.mock_engine import create_engine
+
+SAMPLE_DIR = Path(__file__).parent.parent / "sample"
+DOCUMENT_ID = re.compile(r"資料番号 (\d+)")
+# the web UI handlers and the share of sessions that call them after generating
+FOLLOW_UPS = [("rerecord", 0.5), ("change_speaker", 0.3)]
+STYLES = tuple(range(1, 9))
+
+
+def create_llm(latency: float) -> web.Application:
+    """
+    OpenAI compatible chat completions returning the sample blog and dialogue, with the
+    document number of the request in every line so concurrent jobs do not share work.
+    """
+
+    blog = (SAMPLE_DIR / "rashoumon_blog.md").read_text(encoding="utf-8")
+    dialogue = (SAMPLE_DIR / "rashoumon_dialogue.md").read_text(encoding="utf-8")
+    conversation = (SAMPLE_DIR / "rashoumon_conversation.json").read_text(
+        encoding="utf-8"
+    )
+
+    async def completions(request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(latency)
+        prompt = "\n".join(str(message["content"]) for message in body["messages"])
+        match = DOCUMENT_ID.search(prompt)
+        document = match.group(1) if match else "0"
+
+        if "response_format" in body:
+            content = conversation
+        elif "解説記事をもとに" in prompt:
+            content = re.sub(
+                r"^(\*\*[SA]:\*\* )",
+                rf"\g<1>第{document}回。",
+                dialogue,
+                flags=re.MULTILINE,
+            )
+        else:
+            content = f"{blog}\n\n資料番号 {document}"
+        return web.json_response(
+            {
+                "id": f"chatcmpl-{document}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": len(prompt) // 3,
+                    "completion_tokens": len(content) // 3,
+                    "total_tokens": (len(prompt) + len(content)) // 3,
+                },
+            }
+        )
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    return app
+
+
+def create_content() -> web.Application:
+    async def document(request: web.Request) -> web.Response:
+        number = request.match_info["number"]
+        paragraphs = "".join(
+            f"<p>羅生門の第 {i} 節についての解説です。資料番号 {number}</p>"
+            for i in range(20)
+        )
+        return web.Response(
+            text=f"<html><body><h1>資料 {number}</h1>{paragraphs}</body></html>",
+            content_type="text/html",
+        )
+
+    app = web.Application()
+    app.router.add_get("/documents/{number}", document)
+    return app
+
+
+async def serve(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def rss_bytes() -> int:
+    """
+    Resident memory of this process and its worker processes.
+    """
+
+    pids = [os.getpid()] + [p.pid for p in multiprocessing.active_children()]
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            if pid == os.getpid():
+                # no procfs: the peak of this process only, in KiB on Linux
+                total += resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return total
+
+
+class LoadTest:
+    def __init__(self, webui, engine: str, content: str, seed: int, mode: str):
+        self.webui = webui
+        self.engine = engine
+        self.content = content
+        self.mode = mode
+        self.rng = random.Random(seed)
+        self.speakers: list[str] = []
+        self.speaker2id: dict[str, int] = {}
+        self.documents = 0
+        # (operation, seconds, error)
+        self.samples: list[tuple[str, float, str | None]] = []
+        # seconds until each generation's audio was shown, maybe before its blog
+        self.time_to_audio: list[float] = []
+
+    async def setup(self):
+        self.speakers, self.speaker2id = await self.webui.get_speakers(self.engine)
+
+    async def timed(self, operation: str, coro):
+        start = time.perf_counter()
+        error = None
+        try:
+            return await coro
+        except Exception as e:
+            error = repr(e)
+            return None
+        finally:
+            self.samples.append((operation, time.perf_counter() - start, error))
+
+    async def generate(self, *args):
+        """
+        Runs `generate_podcast` to the end and returns its last outputs.
+        """
+
+        start = time.perf_counter()
+        shown: float | None = None
+        outputs = None
+        async for outputs in self.webui.generate_podcast(*args):
+            # the first outputs have the audio
+            if shown is None:
+                shown = time.perf_counter() - start
+        if shown is not None:
+            self.time_to_audio.append(shown)
+        return outputs
+
+    async def session(self, user: int):
+        webui = self.webui
+        request = webui.gr.Request(session_hash=f"user-{user}")
+        progress = webui.gr.Progress()
+        speaker, supporter = self.rng.sample(self.speakers, 2)
+
+        # picking the voices plays their previews
+        for name, is_main_speaker in ((speaker, True), (supporter, False)):
+            await self.timed(
+                "preview",
+                webui.on_change_speaker(
+                    self.engine,
+                    name,
+                    self.speaker2id,
+                    is_main_speaker,
+                    request,
+                    progress,
+                ),
+            )
+
+        self.documents += 1
+        result = await self.timed(
+            "generate",
+            self.generate(
+                self.engine,
+                webui.GEMINI_API_KEY,
+                f"{self.content}/documents/{self.documents}",
+                speaker,
+                supporter,
+                self.mode,
+                self.speaker2id,
+                request,
+                progress,
+            ),
+        )
+        if result is None:
+            return
+        _audio, _blog, rows, conversation, _elapsed, _, _, job_id = result
+
+        draw = self.rng.random()
+        for operation, share in FOLLOW_UPS:
+            if draw < share:
+                break
+            draw -= share
+        else:
+            return
+
+        if operation == "rerecord":
+            i = self.rng.randrange(len(rows))
+            rows[i][1] = rows[i][1] + "（言い直し）"
+            await self.timed(
+                "rerecord",
+                webui.rerecord_edited_lines(
+                    self.engine,
+                    speaker,
+                    supporter,
+                    self.speaker2id,
+                    conversation,
+                    rows,
+                    job_id,
+                    request,
+                    progress,
+                ),
+            )
+        else:
+            speaker = self.rng.choice([s for s in self.speakers if s != supporter])
+            await self.timed(
+                "change_speaker",
+                webui.change_speaker(
+                    self.engine,
+                    speaker,
+                    supporter,
+                    self.speaker2id,
+                    conversation,
+                    request,
+                    progress,
+                ),
+            )
+
+    async def run(self, users: int, sessions: int) -> dict:
+        self.samples = []
+        self.time_to_audio = []
+        peak_rss = rss_bytes()
+
+        async def _watch_memory():
+            nonlocal peak_rss
+            while True:
+                await asyncio.sleep(0.2)
+                peak_rss = max(peak_rss, rss_bytes())
+
+        async def _user(user: int):
+            for _ in range(sessions):
+                await self.session(user)
+
+        watcher = asyncio.create_task(_watch_memory())
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(_user(user) for user in range(users)))
+        finally:
+            watcher.cancel()
+        duration = time.perf_counter() - start
+
+        operations = {}
+        for operation in sorted({sample[0] for sample in self.samples}):
+            samples = [s for s in self.samples if s[0] == operation]
+            operations[operation] = latency_stats(
+                [seconds for _, seconds, error in samples if not error],
+                errors=sum(1 for _, _, error in samples if error),
+            )
+        if self.time_to_audio:
+            # not an operation of its own, left out of the throughput
+            operations["time_to_audio"] = latency_stats(self.time_to_audio)
+        errors = [error for _, _, error in self.samples if error]
+        return {
+            "users": users,
+            "sessions": users * sessions,
+            "duration": duration,
+            "throughput": len(self.samples) / duration,
+            "error_rate": len(errors) / max(len(self.samples), 1),
+            "errors": sorted(set(errors))[:5],
+            "peak_rss_mb": peak_rss / 1024**2,
+            "operations": operations,
+        }
+
+
+def latency_stats(latencies: list[float], errors: int = 0) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies) + errors,
+        "errors": errors,
+        "mean": statistics.fmean(latencies) if latencies else None,
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+def report(level: dict, baseline: dict | None = None):
+    def _delta(value: float | None, base: float | None) -> str:
+        if value is None or base is None or base == 0:
+            return ""
+        return f" ({(value - base) / base * 100:+.0f}%)"
+
+    print(
+        f"{level['users']:>3} users: {level['throughput']:6.2f} ops/s"
+        f"{_delta(level['throughput'], baseline and baseline['throughput'])}, "
+        f"errors {level['error_rate'] * 100:5.1f}%, "
+        f"peak RSS {level['peak_rss_mb']:7.1f} MiB"
+        f"{_delta(level['peak_rss_mb'], baseline and baseline['peak_rss_mb'])}"
+    )
+    for operation, stats in level["operations"].items():
+        base = (baseline or {}).get("operations", {}).get(operation, {})
+        latencies = ", ".join(
+            f"{p} {stats[p]:6.2f}s{_delta(stats[p], base.get(p))}"
+            if stats[p] is not None
+            else f"{p}      -"
+            for p in ("p50", "p90", "p99")
+        )
+        print(
+            f"    {operation:>14}: {stats['count']:4} calls, "
+            f"{stats['errors']:3} errors, {latencies}"
+        )
+    for error in level["errors"]:
+        print(f"    error: {error}")
+
+
+async def run(args: argparse.Namespace):
+    engine_app, _calls = create_engine(styles=STYLES, latency=args.engine_latency)
+    servers = [
+        await serve(engine_app),
+        await serve(create_llm(args.llm_latency)),
+        await serve(create_content()),
+    ]
+    engine, llm, content = (url for _, url in servers)
+
+    # everything the web UI reads at import time
+    root = tempfile.mkdtemp(prefix="podcastvox-load-")
+    os.environ.update(
+        {
+            "PODCASTVOX_QUEUE_PATH": os.path.join(root, "jobs.db"),
+            "PODCASTVOX_AUDIO_DIR": os.path.join(root, "audio"),
+            "PODCASTVOX_LOCAL_WORKERS": "0",
+            "GEMINI_API_KEY": "mock",
+            # inherited by the worker processes
+            "OPENAI_BASE_URL": f"{llm}/v1",
+            "OPENAI_API_BASE": f"{llm}/v1",
+            "LITELLM_LOCAL_MODEL_COST_MAP": "True",
+        }
+    )
+    webui = importlib.import_module("webui")
+    from src.routing import ModelRoute, RoutingConfig
+    from src.worker import WorkerPool
+
+    route = [ModelRoute(model="openai/mock", max_tokens=4096)]
+    pool = WorkerPool(
+        num_workers=args.workers,
+        queue_path=webui.QUEUE_PATH,
+        audio_dir=webui.AUDIO_DIR,
+        api_key=webui.GEMINI_API_KEY,
+        voicevox_endpoint=engine,
+        engine_concurrency=webui.ENGINE_CONCURRENCY,
+        llm_concurrency=webui.LLM_CONCURRENCY,
+        journal_mode=webui.QUEUE_JOURNAL_MODE,
+        jobs_per_worker=args.jobs_per_worker,
+        studio_options={"synthesis_batch_size": webui.SYNTHESIS_BATCH_SIZE},
+        routing=RoutingConfig(
+            routes={
+                name: route
+                for name in (
+                    "blogger",
+                    "writer",
+                    "outline",
+                    "section_writer",
+                    "structure",
+                )
+            }
+        ),
+    )
+    pool.start()
+    webui.startup_state = webui.StartupState(
+        endpoint=engine,
+        main_speaker_name=webui.MAIN_SPEAKER_NAME,
+        supporter_speaker_name=webui.SUPPORTER_SPEAKER_NAME,
+    )
+
+    baseline = {}
+    if args.compare:
+        baseline = {
+            level["users"]: level
+            for level in json.loads(Path(args.compare).read_text())["levels"]
+        }
+
+    test = LoadTest(
+        webui, engine=engine, content=content, seed=args.seed, mode=args.mode
+    )
+    levels = []
+    try:
+        await test.setup()
+        # not counted: the worker processes start and the previews get cached
+        await test.run(1, 1)
+        for users in args.users:
+            level = await test.run(users, args.sessions)
+            levels.append(level)
+            report(level, baseline.get(users))
+    finally:
+        pool.stop()
+        for runner, _url in servers:
+            await runner.cleanup()
+
+    if args.output:
+        Path(args.output).write_bytes(
+            orjson.dumps(
+                {"args": vars(args), "levels": levels}, option=orjson.OPT_INDENT_2
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--users",
+        type=lambda text: [int(n) for n in text.split(",")],
+        default=[1, 5, 10, 20],
+        help="concurrent users of each level, comma separated",
+    )
+    parser.add_argument(
+        "--sessions", type=int, default=1, help="sessions per user and level"
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--jobs-per-worker", type=int, default=4)
+    parser.add_argument(
+        "--llm-latency", type=float, default=1.0, help="seconds per LLM call"
+    )
+    parser.add_argument(
+        "--engine-latency",
+        type=float,
+        default=0.02,
+        help="seconds per audio query and synthesized line",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["quality", "fast"],
+        default="quality",
+        help="generation mode, fast writes the script without waiting for the blog",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
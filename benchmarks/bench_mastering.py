@@ -0,0 +1,58 @@
+"""
+Time to master a long episode from synthesized segments.
+
+    python -m benchmarks.bench_mastering --minutes 60
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from src.audio import Audio
+from src.mastering import MasteringConfig, Segment, master
+
+SAMPLE_RATE = 24000
+
+
+def make_segment(seconds: float, amplitude: float, rng: np.random.Generator) -> Audio:
+    num_frames = int(seconds * SAMPLE_RATE)
+    samples = rng.normal(0.0, amplitude, num_frames)
+    # engine-style leading and trailing silence
+    samples[: SAMPLE_RATE // 10] = 0
+    samples[-SAMPLE_RATE // 10 :] = 0
+    pcm = np.clip(samples * 32767, -32768, 32767).astype("<i2")
+    return Audio.from_pcm(pcm.tobytes(), sample_rate=SAMPLE_RATE)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=60.0)
+    parser.add_argument("--seconds-per-line", type=float, default=6.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    num_lines = int(args.minutes * 60 / args.seconds_per_line)
+    segments = [
+        Segment(
+            role="speaker" if i % 2 == 0 else "supporter",
+            text="そうですね。"
+            if i % 5 == 1
+            else "今日はこの論文について詳しく解説していきます。",
+            audio=make_segment(args.seconds_per_line, 0.3 if i % 2 == 0 else 0.05, rng),
+        )
+        for i in range(num_lines)
+    ]
+
+    start = time.perf_counter()
+    podcast = master(segments, MasteringConfig())
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{num_lines} lines, {podcast.duration / 60:.1f} min mastered "
+        f"in {elapsed * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+from pathlib import Path
+
+import dotenv
+
+from src.examples import EXAMPLES, ExampleBundle, RenderedExample
+from src.fetcher import AutoFetcher
+from src.podcast import PodcastStudio
+from src.routing import Router, RoutingConfig
+from src.voicevox import VoiceVoxClient
+
+dotenv.load_dotenv()
+
+
+class KeepingFetcher(AutoFetcher):
+    """
+    Keeps what it fetched, to store the source text with each example.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.fetched: dict[tuple[str, ...], str] = {}
+
+    async def fetch_all(self, urls: list[str], *args, **kwargs) -> str:
+        text = await super().fetch_all(urls, *args, **kwargs)
+        self.fetched[tuple(urls)] = text
+        return text
+
+
+async def find_speaker(client: VoiceVoxClient, name: str) -> int:
+    for speaker in await client.get_speakers():
+        for style in speaker.styles:
+            if f"{speaker.name} ({style.name})" == name:
+                return style.id
+    raise ValueError(f"Speaker {name!r} not found on {client.endpoint}")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+async def build(args: argparse.Namespace):
+    output = Path(args.output)
+    bundle = ExampleBundle.load(output) or ExampleBundle()
+    bundle.revision = git_revision()
+
+    fetcher = KeepingFetcher()
+    studio = PodcastStudio(
+        api_key=os.getenv("GEMINI_API_KEY", ""),
+        synthesis_batch_size=args.synthesis_batch_size,
+        router=Router(RoutingConfig.load(args.routing) if args.routing else None),
+        fetcher=fetcher,
+    )
+    client = VoiceVoxClient(args.endpoint)
+    speaker_id = await find_speaker(client, args.speaker)
+    supporter_id = await find_speaker(client, args.supporter)
+
+    (output / "audio").mkdir(parents=True, exist_ok=True)
+    for i, (title, url) in enumerate(EXAMPLES):
+        if args.only and not any(word in url for word in args.only):
+            continue
+        logging.info(f"Rendering {title} ({url})...")
+        blog, dialogue, conversation = await studio.create_conversation(url)
+        podcast = await studio.record_podcast(
+            conversation=conversation,
+            voicevox_client=client,
+            speaker_id=speaker_id,
+            supporter_id=supporter_id,
+        )
+        audio = f"audio/{i:02}.wav"
+        (output / audio).write_bytes(podcast.wav)
+
+        examples = [example for example in bundle.examples if example.url != url]
+        examples.append(
+            RenderedExample(
+                title=title,
+                url=url,
+                source=fetcher.fetched[(url,)],
+                blog=blog,
+                dialogue=dialogue,
+                conversation=conversation,
+                speaker_name=args.speaker,
+                supporter_name=args.supporter,
+                speaker_id=speaker_id,
+                supporter_id=supporter_id,
+                audio=audio,
+            )
+        )
+        bundle.examples = examples
+        # saved after every example, so an interrupted build keeps what it rendered
+        bundle.save(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-render the web UI's examples with the default voices."
+    )
+    parser.add_argument(
+        "--output",
+        default=os.getenv("PODCASTVOX_EXAMPLES_DIR", "examples"),
+        help="bundle directory, loaded by the web UI at startup",
+    )
+    parser.add_argument(
+        "--endpoint",
+        default=os.getenv("PODCASTVOX_VOICEVOX_ENDPOINT", "http://127.0.0.1:10101"),
+        help="VOICEVOX compatible engine endpoint",
+    )
+    parser.add_argument("--speaker", default="Anneli (テンション高め)")
+    parser.add_argument("--supporter", default="まい (ノーマル)")
+    parser.add_argument(
+        "--only",
+        nargs="*",
+        help="render only the examples whose URL contains one of these",
+    )
+    parser.add_argument(
+        "--synthesis-batch-size",
+        type=int,
+        default=int(os.getenv("PODCASTVOX_SYNTHESIS_BATCH_SIZE", "1")),
+    )
+    parser.add_argument(
+        "--routing",
+        default=os.getenv("PODCASTVOX_ROUTING"),
+        help="JSON file with the models to use per agent (see routing.example.json)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(build(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,25 @@
+import asyncio
 import json
+import logging
+import re
+import time
 from typing import Literal
 from pydantic import BaseModel
 
 import litellm
 from litellm.types.utils import ModelResponse
 
+from .context_cache import (
+    MIN_CACHE_TOKENS,
+    PromptUsage,
+    condense,
+    mark_cached,
+    record_prompt,
+    supports_caching,
+)
+from .ratelimit import estimate_tokens
+from .routing import ModelRoute, Router
+
 SAFETY_SETTINGS = [
     {
         "category": "HARM_CATEGORY_HARASSMENT",
@@ -25,7 +40,216 @@ SAFETY_SETTINGS = [
 ]
 
 
-class BloggerAgent:
+def document_message(information: str) -> dict:
+    """
+    The fetched document, sent first and identically by every agent that reads it, so the
+    provider can reuse its processing across their calls.
+    """
+
+    return {"role": "user", "content": f"# 情報\n{information}"}
+
+
+class Agent:
+    """
+    Base of the agents. The model, thinking budget and max tokens of each call come from
+    the `Router` when it has routes for the agent, and from the class attributes otherwise.
+    If a model fails, the next route is tried.
+    """
+
+    name: str
+    model: str
+    temperature: float
+    max_tokens: int
+    # None: not sent, 0: thinking disabled
+    thinking_budget: int | None
+    api_key: str
+
+    def __init__(self, api_key: str, router: Router | None = None):
+        self.api_key = api_key
+        self.router = router
+        self.logger = logging.getLogger(__name__)
+
+    def default_route(self, name: str) -> ModelRoute:
+        return ModelRoute(
+            model=self.model,
+            max_tokens=self.max_tokens,
+            thinking_budget=self.thinking_budget,
+        )
+
+    def prepare(
+        self,
+        messages: list[dict],
+        model_route: ModelRoute,
+        shared_prefix: int,
+        condense_prefix: bool = False,
+    ) -> tuple[list[dict], int]:
+        """
+        The messages to send to `model_route`, with the first `shared_prefix` messages
+        marked for caching (or condensed if `condense_prefix`), and the tokens condensing
+        saved.
+        """
+
+        if shared_prefix == 0:
+            return messages, 0
+        caching = model_route.context_caching
+        if caching is None:
+            caching = supports_caching(model_route.model)
+        prefix = messages[:shared_prefix]
+        if caching and estimate_tokens(prefix) >= MIN_CACHE_TOKENS:
+            return mark_cached(messages, shared_prefix), 0
+        if not condense_prefix:
+            return messages, 0
+
+        condensed = [
+            {**message, "content": condense(message["content"])} for message in prefix
+        ]
+        saved = estimate_tokens(prefix) - estimate_tokens(condensed)
+        return condensed + messages[shared_prefix:], saved
+
+    def routes(self, name: str, messages: list[dict]) -> list[ModelRoute]:
+        """
+        The routes to try in order: the healthy ones, or all of them if none is healthy.
+        """
+
+        if self.router is None:
+            return [self.default_route(name)]
+        input_chars = sum(len(message["content"]) for message in messages)
+        routes = self.router.choose(name, input_chars)
+        healthy = [route for route in routes if self.router.is_healthy(route)]
+        return healthy or routes or [self.default_route(name)]
+
+    async def complete(
+        self,
+        messages: list[dict],
+        route: str | None = None,
+        shared_prefix: int = 0,
+        condense_prefix: bool = False,
+        **kwargs,
+    ) -> ModelResponse:
+        """
+        `shared_prefix`: number of leading messages other agents send identically.
+        `condense_prefix`: send them condensed when they cannot be cached, for prompts that
+        also have the blog written from the document.
+
+        When every route is rate limited, waits for the first one to cool down and tries
+        again, for up to `max_rate_limit_wait` seconds of the routing config in total.
+        """
+
+        waited = 0.0
+        while True:
+            try:
+                return await self._complete(
+                    messages, route, shared_prefix, condense_prefix, **kwargs
+                )
+            except litellm.RateLimitError:
+                if self.router is None:
+                    raise
+                wait = min(
+                    self.router.cooldown(model_route.model)
+                    for model_route in self.routes(route or self.name, messages)
+                )
+                if wait <= 0 or waited + wait > self.router.config.max_rate_limit_wait:
+                    raise
+                self.logger.info(f"Every model is rate limited, waiting {wait:.0f}s.")
+                await asyncio.sleep(wait)
+                waited += wait
+
+    async def _complete(
+        self,
+        messages: list[dict],
+        route: str | None,
+        shared_prefix: int,
+        condense_prefix: bool,
+        **kwargs,
+    ) -> ModelResponse:
+        """
+        Tries each route once, in order.
+        """
+
+        error: Exception | None = None
+        for model_route in self.routes(route or self.name, messages):
+            call_messages, condensed_tokens = self.prepare(
+                messages, model_route, shared_prefix, condense_prefix
+            )
+            options = dict(kwargs)
+            if model_route.thinking_budget == 0:
+                options["thinking"] = {"type": "disabled"}
+            elif model_route.thinking_budget is not None:
+                options["thinking"] = {
+                    "type": "enabled",
+                    "budget_tokens": model_route.thinking_budget,
+                }
+            if model_route.model.startswith(("gemini/", "vertex_ai/")):
+                options["safety_settings"] = SAFETY_SETTINGS
+            if model_route.timeout is not None:
+                options["timeout"] = model_route.timeout
+
+            reservation = None
+            if self.router is not None:
+                reservation = await self.router.limiter.acquire(
+                    self.api_key,
+                    model_route.model,
+                    estimate_tokens(call_messages) + model_route.max_tokens,
+                )
+
+            start = time.monotonic()
+            # tokens actually used, unknown if the call is cancelled: the estimate is kept
+            used: int | None = None
+            try:
+                res = await litellm.acompletion(
+                    api_key=self.api_key,
+                    model=model_route.model,
+                    messages=call_messages,
+                    temperature=self.temperature,
+                    max_completion_tokens=model_route.max_tokens,
+                    **options,
+                )
+            except litellm.AuthenticationError:
+                # the key is wrong, not the model: not counted against the route
+                used = 0
+                raise
+            except Exception as e:
+                used = 0
+                if self.router is not None:
+                    self.router.record(
+                        model_route.model,
+                        time.monotonic() - start,
+                        error=e,
+                        rate_limited=isinstance(e, litellm.RateLimitError),
+                    )
+                self.logger.warning(f"{model_route.model} failed: {e!r}")
+                error = e
+                continue
+            else:
+                usage = getattr(res, "usage", None)
+                used = None if usage is None else usage.total_tokens
+            finally:
+                if reservation is not None:
+                    reservation.settle(used)
+
+            latency = time.monotonic() - start
+            if self.router is not None:
+                self.router.record(model_route.model, latency)
+            assert isinstance(res, ModelResponse)
+            details = getattr(usage, "prompt_tokens_details", None)
+            record_prompt(
+                PromptUsage(
+                    agent=route or self.name,
+                    model=model_route.model,
+                    latency=latency,
+                    prompt_tokens=getattr(usage, "prompt_tokens", None) or 0,
+                    cached_tokens=getattr(details, "cached_tokens", None) or 0,
+                    condensed_tokens=condensed_tokens,
+                )
+            )
+            return res
+
+        assert error is not None
+        raise error
+
+
+class BloggerAgent(Agent):
+    name = "blogger"
     instructions = [
         {
             "role": "user",
@@ -36,25 +260,11 @@ class BloggerAgent:
     temperature: float = 1.0
     max_tokens: int = 4096
     thinking_budget: int = 1024
-    api_key: str
-
-    def __init__(self, api_key: str):
-        self.api_key = api_key
 
     async def task(self, information: str) -> str:
-        messages = self.instructions.copy()
-        messages.append({"role": "user", "content": information})
+        messages = [document_message(information), *self.instructions]
 
-        res = await litellm.acompletion(
-            api_key=self.api_key,
-            model=self.model,
-            messages=messages,
-            temperature=self.temperature,
-            max_completion_tokens=self.max_tokens,
-            thinking={"type": "enabled", "budget_tokens": self.thinking_budget},
-            safety_settings=SAFETY_SETTINGS,
-        )
-        assert isinstance(res, ModelResponse)
+        res = await self.complete(messages, shared_prefix=1)
 
         blog = res.choices[0].message.content
         assert isinstance(blog, str)
@@ -62,7 +272,8 @@ class BloggerAgent:
         return blog
 
 
-class WriterAgent:
+class WriterAgent(Agent):
+    name = "writer"
     instructions = [
         {
             "role": "user",
@@ -87,27 +298,19 @@ Podcast では、二人の人物が交互に会話をします。
     temperature: float = 1.0
     max_tokens: int = 4096
     thinking_budget: int = 1024
-    api_key: str
 
-    def __init__(self, api_key: str):
-        self.api_key = api_key
+    async def task(self, information: str, blog: str | None = None) -> str:
+        """
+        Without `blog` (fast mode), the script is written from the document alone.
+        """
 
-    async def task(self, information: str, blog: str) -> str:
-        messages = self.instructions.copy()
-        messages.append(
-            {"role": "user", "content": f"# 情報\n{information}\n\n# 解説\n{blog}"}
-        )
+        messages = [document_message(information), *self.instructions]
+        if blog is not None:
+            messages.append({"role": "user", "content": f"# 解説\n{blog}"})
 
-        res = await litellm.acompletion(
-            api_key=self.api_key,
-            model=self.model,
-            messages=messages,
-            temperature=self.temperature,
-            max_completion_tokens=self.max_tokens,
-            thinking={"type": "enabled", "budget_tokens": self.thinking_budget},
-            safety_settings=SAFETY_SETTINGS,
+        res = await self.complete(
+            messages, shared_prefix=1, condense_prefix=blog is not None
         )
-        assert isinstance(res, ModelResponse)
 
         dialogue = res.choices[0].message.content
         assert isinstance(dialogue, str)
@@ -115,6 +318,175 @@ Podcast では、二人の人物が交互に会話をします。
         return dialogue
 
 
+class OutlineSection(BaseModel):
+    title: str
+    points: list[str]
+
+
+class Outline(BaseModel):
+    intro: str
+    sections: list[OutlineSection]
+    outro: str
+
+    @property
+    def parts(self) -> list[str]:
+        return (
+            ["イントロ"] + [section.title for section in self.sections] + ["アウトロ"]
+        )
+
+    def describe(self) -> str:
+        lines = [f"1. イントロ: {self.intro}"]
+        for i, section in enumerate(self.sections):
+            lines.append(f"{i + 2}. {section.title}")
+            lines.extend(f"    - {point}" for point in section.points)
+        lines.append(f"{len(self.sections) + 2}. アウトロ: {self.outro}")
+        return "\n".join(lines)
+
+
+# a line of the script, e.g. `**S:** こんにちは` or `サポーター: なるほど`
+DIALOGUE_LINE = re.compile(r"^\W*(S|A|スピーカー|サポーター)\W*[:：]")
+
+
+class SectionWriterAgent(Agent):
+    """
+    Writes the script part by part: a short outline first, then the intro, every section
+    and the outro concurrently, each knowing the whole outline.
+    """
+
+    name = "section_writer"
+    outline_instructions = [
+        {
+            "role": "user",
+            "content": """与えられる情報ソースとその解説記事をもとに、コンテンツを紹介する Podcast の構成案を作成してください。
+Podcast では、スピーカー (解説をリードする人) とサポーター (相槌や質問で理解を助ける人) の二人が会話をします。
+
+- intro: イントロで何について話すか (1 文)
+- sections: 解説パートの各セクションのタイトルと、そこで話すポイント。前提知識の確認から始め、3〜6 セクション程度にしてください
+- outro: アウトロで触れる今後の展望 (1 文)
+""".strip(),
+        },
+    ]
+    section_instructions = """あなたは Podcast の脚本家チームの一員です。以下の構成案のうち「{part}」のパートだけを担当します。
+他のパートは別の担当者が同時に書くので、担当パートの内容だけを書いてください。
+
+# 登場人物
+- スピーカー: コンテンツ紹介をリードする人で、主にこの人物が解説を行う
+- サポーター: スピーカーの説明を聞き、うなづいたり、さらに質問を投げかけることで、理解を助ける。
+
+# 構成案
+{outline}
+
+# ルール
+- 各行を `S: ` (スピーカー) または `A: ` (サポーター) で始め、二人が交互に話す
+- {position}
+- 他のパートで話す内容を先取りしない
+- 見出しや前置きは書かず、会話だけを出力する"""
+
+    model: str = "gemini/gemini-2.5-flash-preview-05-20"
+    temperature: float = 1.0
+    outline_max_tokens: int = 2048
+    max_tokens: int = 4096
+    thinking_budget: int = 512
+
+    def default_route(self, name: str) -> ModelRoute:
+        route = super().default_route(name)
+        if name == "outline":
+            route.max_tokens = self.outline_max_tokens
+        return route
+
+    async def outline(self, information: str, blog: str | None = None) -> Outline:
+        messages = [document_message(information), *self.outline_instructions]
+        if blog is not None:
+            messages.append({"role": "user", "content": f"# 解説\n{blog}"})
+
+        res = await self.complete(
+            messages,
+            route="outline",
+            shared_prefix=1,
+            condense_prefix=blog is not None,
+            response_format=Outline,
+        )
+
+        return Outline.model_validate(json.loads(res.choices[0].message.content))
+
+    async def section(
+        self, information: str, blog: str | None, outline: Outline, index: int
+    ) -> str:
+        parts = outline.parts
+        if index == 0:
+            position = "これは冒頭のパートなので、挨拶から始め、今回のテーマを紹介する。自己紹介は省略する"
+        elif index == len(parts) - 1:
+            position = f"直前のパート「{parts[index - 1]}」の話を受けて始め、今後の展望を交えながら締めくくる"
+        else:
+            position = (
+                f"直前のパート「{parts[index - 1]}」の話を受けて自然に始め、"
+                f"次のパート「{parts[index + 1]}」へつながるように終える。挨拶や締めくくりはしない"
+            )
+
+        messages = [document_message(information)]
+        if blog is not None:
+            messages.append({"role": "user", "content": f"# 解説\n{blog}"})
+        messages.append(
+            {
+                "role": "user",
+                "content": self.section_instructions.format(
+                    part=parts[index],
+                    outline=outline.describe(),
+                    position=position,
+                ),
+            }
+        )
+
+        res = await self.complete(
+            messages, shared_prefix=1, condense_prefix=blog is not None
+        )
+
+        text = res.choices[0].message.content
+        assert isinstance(text, str)
+
+        return text
+
+    @staticmethod
+    def dialogue_lines(text: str) -> list[str]:
+        """
+        The lines of the script, without preambles, headings and blank lines.
+        """
+
+        return [line.strip() for line in text.splitlines() if DIALOGUE_LINE.match(line)]
+
+    @classmethod
+    def check(cls, text: str) -> bool:
+        """
+        Whether a part is usable: a few lines, and not only one speaker talking.
+        """
+
+        lines = cls.dialogue_lines(text)
+        speakers = {
+            "S" if match.group(1) in ("S", "スピーカー") else "A"
+            for match in map(DIALOGUE_LINE.match, lines)
+            if match is not None
+        }
+        return len(lines) >= 2 and len(speakers) == 2
+
+    @classmethod
+    def stitch(cls, outline: Outline, parts: list[str]) -> str:
+        """
+        Joins the parts under their headings, dropping lines repeated across a boundary.
+        """
+
+        blocks = []
+        previous: list[str] = []
+        for i, (title, text) in enumerate(zip(outline.parts, parts)):
+            lines = cls.dialogue_lines(text)
+            # a part may repeat the last lines of the previous one as a lead-in
+            while len(lines) > 0 and lines[0] in previous[-3:]:
+                lines.pop(0)
+            blocks.append(f"### {i + 1}. {title}\n\n" + "\n\n".join(lines))
+            previous = lines
+
+        return "\n\n".join(blocks)
+
+
 class Dialogue(BaseModel):
     role: Literal["speaker", "supporter"]
     content: str
@@ -124,7 +496,8 @@ class Conversation(BaseModel):
     conversation: list[Dialogue]
 
 
-class StructureAgent:
+class StructureAgent(Agent):
+    name = "structure"
     instructions = [
         {
             "role": "user",
@@ -135,25 +508,12 @@ class StructureAgent:
     temperature: float = 0.1
     max_tokens: int = 12_288
     thinking_budget: int = 0
-    api_key: str
-
-    def __init__(self, api_key: str):
-        self.api_key = api_key
 
     async def task(self, dialogue: str) -> Conversation:
         messages = self.instructions.copy()
         messages.append({"role": "user", "content": dialogue})
 
-        res = await litellm.acompletion(
-            api_key=self.api_key,
-            model=self.model,
-            messages=messages,
-            temperature=self.temperature,
-            max_completion_tokens=self.max_tokens,
-            thinking={"type": "disabled"},
-            response_format=Conversation,
-            safety_settings=SAFETY_SETTINGS,
-        )
+        res = await self.complete(messages, response_format=Conversation)
 
         conversation = Conversation.model_validate(
             json.loads(res.choices[0].message.content)
@@ -0,0 +1,99 @@
+import json
+from typing import AsyncIterator
+
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from .jobs import ARTIFACTS, Job, JobManager, JobRequest
+
+
+def create_router(manager: JobManager) -> APIRouter:
+    """
+    REST API around `JobManager`:
+
+    - `POST /jobs` submits a job and returns it immediately
+    - `GET /jobs/{id}` returns its status and stage progress
+    - `GET /jobs/{id}/events` streams progress as server-sent events
+    - `GET /jobs/{id}/segments/{index}` downloads a line as soon as it is synthesized
+    - `GET /jobs/{id}/variants/{index}` downloads the episode with the `index`th voices
+    - `GET /jobs/{id}/artifacts/{name}` downloads the blog, dialogue, conversation or audio
+    - `DELETE /jobs/{id}` cancels the job
+    """
+
+    router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+    async def _get_job(job_id: str) -> Job:
+        job = await manager.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+
+    @router.post("", status_code=202)
+    async def submit_job(request: JobRequest) -> Job:
+        return await manager.submit(request)
+
+    @router.get("/{job_id}")
+    async def get_job(job_id: str) -> Job:
+        return await _get_job(job_id)
+
+    @router.delete("/{job_id}")
+    async def cancel_job(job_id: str) -> Job:
+        await _get_job(job_id)
+        job = await manager.cancel(job_id)
+        assert job is not None
+        return job
+
+    @router.get("/{job_id}/events")
+    async def stream_events(
+        job_id: str,
+        last_event_id: int = Header(default=-1),
+    ) -> StreamingResponse:
+        await _get_job(job_id)
+
+        async def _stream() -> AsyncIterator[str]:
+            async for event in manager.events(job_id, after=last_event_id):
+                yield (
+                    f"id: {event.id}\n"
+                    f"event: {event.type}\n"
+                    f"data: {json.dumps(event.data, ensure_ascii=False)}\n\n"
+                )
+
+        return StreamingResponse(
+            _stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    @router.get("/{job_id}/segments/{index}")
+    async def get_segment(job_id: str, index: int) -> FileResponse:
+        await _get_job(job_id)
+        path = await manager.segment_path(job_id, index)
+        if path is None:
+            raise HTTPException(status_code=404, detail="Segment not ready")
+        return FileResponse(path, media_type="audio/wav")
+
+    @router.get("/{job_id}/variants/{index}")
+    async def get_variant(job_id: str, index: int) -> FileResponse:
+        await _get_job(job_id)
+        path = await manager.variant_path(job_id, index)
+        if path is None:
+            raise HTTPException(status_code=404, detail="Variant not ready")
+        return FileResponse(path, media_type="audio/wav")
+
+    @router.get("/{job_id}/artifacts/{name}")
+    async def get_artifact(job_id: str, name: str) -> Response:
+        await _get_job(job_id)
+        if name not in ARTIFACTS:
+            raise HTTPException(status_code=404, detail="Unknown artifact")
+
+        path = await manager.artifact_path(job_id, name)
+        if path is not None:
+            return FileResponse(path, media_type=ARTIFACTS[name], filename=name)
+
+        text = await manager.artifact(job_id, name)
+        if text is not None:
+            return Response(content=text, media_type=ARTIFACTS[name])
+
+        raise HTTPException(status_code=404, detail="Artifact not ready")
+
+    return router
@@ -0,0 +1,213 @@
+import mmap
+import struct
+from pathlib import Path
+
+Buffer = bytes | bytearray | memoryview | mmap.mmap
+
+WAVE_FORMAT_PCM = 1
+WAV_HEADER_SIZE = 44
+
+
+class Audio:
+    """
+    WAV audio backed by a single buffer.
+
+    The RIFF header is parsed once, and `wav` / `pcm` are memoryviews into the same buffer,
+    so passing audio around never copies the payload. The buffer can be `bytes`, a `bytearray`
+    or a read-only mmap of a file on disk (see `Audio.from_file`).
+    """
+
+    __slots__ = (
+        "_buffer",
+        "_mmap",
+        "format_tag",
+        "channels",
+        "sample_rate",
+        "bits_per_sample",
+        "data_offset",
+        "data_size",
+    )
+
+    def __init__(self, buffer: Buffer, _mmap: mmap.mmap | None = None):
+        self._buffer = memoryview(buffer)
+        self._mmap = _mmap
+
+        if self._buffer.nbytes < 12 or self._buffer[0:4] != b"RIFF":
+            raise ValueError("Not a RIFF file")
+        if self._buffer[8:12] != b"WAVE":
+            raise ValueError("Not a WAVE file")
+
+        self.format_tag = 0
+        self.channels = 0
+        self.sample_rate = 0
+        self.bits_per_sample = 0
+        self.data_offset = 0
+        self.data_size = 0
+
+        offset = 12
+        while offset + 8 <= self._buffer.nbytes:
+            chunk_id = self._buffer[offset : offset + 4].tobytes()
+            (chunk_size,) = struct.unpack_from("<I", self._buffer, offset + 4)
+            body = offset + 8
+
+            if chunk_id == b"fmt ":
+                (
+                    self.format_tag,
+                    self.channels,
+                    self.sample_rate,
+                    _byte_rate,
+                    _block_align,
+                    self.bits_per_sample,
+                ) = struct.unpack_from("<HHIIHH", self._buffer, body)
+            elif chunk_id == b"data":
+                self.data_offset = body
+                # streamed WAVs may carry a placeholder size
+                self.data_size = min(chunk_size, self._buffer.nbytes - body)
+                break
+
+            offset = body + chunk_size + (chunk_size & 1)
+
+        if self.channels == 0:
+            raise ValueError("WAVE file has no fmt chunk")
+        if self.data_offset == 0:
+            raise ValueError("WAVE file has no data chunk")
+
+    @classmethod
+    def from_file(cls, path: str | Path) -> "Audio":
+        """
+        Memory-maps a WAV file instead of reading it into memory.
+        """
+
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped, _mmap=mapped)
+
+    @classmethod
+    def from_pcm(
+        cls,
+        pcm: Buffer,
+        sample_rate: int,
+        channels: int = 1,
+        bits_per_sample: int = 16,
+    ) -> "Audio":
+        pcm = memoryview(pcm).cast("B")
+        buffer = bytearray(WAV_HEADER_SIZE + pcm.nbytes)
+        write_header(buffer, pcm.nbytes, sample_rate, channels, bits_per_sample)
+        buffer[WAV_HEADER_SIZE:] = pcm
+        return cls(buffer)
+
+    @classmethod
+    def concat(cls, audios: "list[Audio]") -> "Audio":
+        """
+        Joins the PCM of `audios` into a new WAV with a single copy of each payload.
+        """
+
+        if len(audios) == 0:
+            raise ValueError("No audio to concatenate")
+
+        first = audios[0]
+        for audio in audios[1:]:
+            if not first.same_format(audio):
+                raise ValueError(
+                    f"Cannot concatenate audio with different formats: "
+                    f"{first.describe()} and {audio.describe()}"
+                )
+
+        data_size = sum(audio.data_size for audio in audios)
+        buffer = bytearray(WAV_HEADER_SIZE + data_size)
+        write_header(
+            buffer,
+            data_size,
+            first.sample_rate,
+            first.channels,
+            first.bits_per_sample,
+        )
+
+        offset = WAV_HEADER_SIZE
+        for audio in audios:
+            buffer[offset : offset + audio.data_size] = audio.pcm
+            offset += audio.data_size
+
+        return cls(buffer)
+
+    @property
+    def wav(self) -> memoryview:
+        """The whole WAV file, header included."""
+        return self._buffer
+
+    @property
+    def pcm(self) -> memoryview:
+        """The raw samples of the data chunk."""
+        return self._buffer[self.data_offset : self.data_offset + self.data_size]
+
+    @property
+    def block_align(self) -> int:
+        return self.channels * self.bits_per_sample // 8
+
+    @property
+    def num_frames(self) -> int:
+        return self.data_size // self.block_align
+
+    @property
+    def duration(self) -> float:
+        return self.num_frames / self.sample_rate
+
+    def same_format(self, other: "Audio") -> bool:
+        return (
+            self.format_tag == other.format_tag
+            and self.channels == other.channels
+            and self.sample_rate == other.sample_rate
+            and self.bits_per_sample == other.bits_per_sample
+        )
+
+    def describe(self) -> str:
+        return f"{self.sample_rate}Hz/{self.channels}ch/{self.bits_per_sample}bit"
+
+    def __len__(self) -> int:
+        return self._buffer.nbytes
+
+    def __repr__(self) -> str:
+        return f"Audio({self.describe()}, {self.duration:.2f}s)"
+
+    def close(self):
+        self._buffer.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def __enter__(self) -> "Audio":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_header(
+    buffer: bytearray | memoryview,
+    data_size: int,
+    sample_rate: int,
+    channels: int = 1,
+    bits_per_sample: int = 16,
+):
+    """
+    Writes a canonical 44-byte PCM WAV header at the start of `buffer`.
+    """
+
+    block_align = channels * bits_per_sample // 8
+    struct.pack_into(
+        "<4sI4s4sIHHIIHH4sI",
+        buffer,
+        0,
+        b"RIFF",
+        WAV_HEADER_SIZE - 8 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        WAVE_FORMAT_PCM,
+        channels,
+        sample_rate,
+        sample_rate * block_align,
+        block_align,
+        bits_per_sample,
+        b"data",
+        data_size,
+    )
@@ -0,0 +1,131 @@
+import contextlib
+import contextvars
+import re
+from collections import Counter
+from typing import Iterator
+
+from pydantic import BaseModel
+
+# providers whose cache litellm drives from `cache_control`: Gemini cached contents,
+# Anthropic prompt caching
+CACHING_PROVIDERS = ("gemini/", "vertex_ai/", "anthropic/")
+# smaller prefixes are rejected by Gemini (the minimum depends on the model)
+MIN_CACHE_TOKENS = 4096
+# size of the document sent instead when it cannot be cached
+CONDENSED_CHARS = 40_000
+
+REFERENCES_HEADING = re.compile(
+    r"^\W*(references|bibliography|参考文献|引用文献)\W*$", re.IGNORECASE
+)
+
+
+class PromptUsage(BaseModel):
+    agent: str
+    model: str
+    # seconds until the whole response was received
+    latency: float
+    prompt_tokens: int = 0
+    # read from the provider's cache instead of being processed again
+    cached_tokens: int = 0
+    # not sent at all, the document was condensed
+    condensed_tokens: int = 0
+
+
+class PromptStats:
+    """
+    LLM calls made while collecting, see `collect_prompt_stats`.
+    """
+
+    def __init__(self):
+        self.calls: list[PromptUsage] = []
+
+    def summary(self) -> dict:
+        return {
+            "calls": [call.model_dump() for call in self.calls],
+            "prompt_seconds": sum(call.latency for call in self.calls),
+            "prompt_tokens": sum(call.prompt_tokens for call in self.calls),
+            "tokens_saved": sum(
+                call.cached_tokens + call.condensed_tokens for call in self.calls
+            ),
+        }
+
+
+_current_stats: contextvars.ContextVar[PromptStats | None] = contextvars.ContextVar(
+    "prompt_stats", default=None
+)
+
+
+@contextlib.contextmanager
+def collect_prompt_stats() -> Iterator[PromptStats]:
+    """
+    Collects the LLM calls made inside this block, e.g. by one job.
+    """
+
+    stats = PromptStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def record_prompt(usage: PromptUsage):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.calls.append(usage)
+
+
+def supports_caching(model: str) -> bool:
+    return model.startswith(CACHING_PROVIDERS)
+
+
+def mark_cached(messages: list[dict], count: int) -> list[dict]:
+    """
+    Marks the first `count` messages as a prefix for the provider to cache.
+    """
+
+    marked = []
+    for i, message in enumerate(messages):
+        if i == count - 1:
+            message = {
+                **message,
+                "content": [
+                    {
+                        "type": "text",
+                        "text": message["content"],
+                        "cache_control": {"type": "ephemeral"},
+                    }
+                ],
+            }
+        marked.append(message)
+    return marked
+
+
+def condense(text: str, max_chars: int = CONDENSED_CHARS) -> str:
+    """
+    A shorter version of a fetched document for prompts that also get its summary: without
+    the reference list, lines repeated on every page (headers, footers) and blank runs,
+    then cut to `max_chars`.
+    """
+
+    lines = text.splitlines()
+    # the last references heading past the first quarter, appendices after it go too
+    for i in range(len(lines) - 1, len(lines) // 4, -1):
+        if REFERENCES_HEADING.match(lines[i]):
+            lines = lines[:i]
+            break
+
+    counts = Counter(line.strip() for line in lines)
+    kept: list[str] = []
+    for line in lines:
+        stripped = line.strip()
+        if stripped and counts[stripped] >= 3 and len(stripped) < 80:
+            continue
+        if not stripped and (not kept or not kept[-1].strip()):
+            continue
+        kept.append(line.rstrip())
+
+    condensed = "\n".join(kept).strip()
+    if len(condensed) > max_chars:
+        condensed = condensed[:max_chars].rstrip() + "\n\n(以下省略)"
+    return condensed
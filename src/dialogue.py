@@ -0,0 +1,93 @@
+import re
+
+from .agent import Conversation, Dialogue
+
+# `**S:** text`, `S: text`, `**スピーカー**: text`, `- サポーター： text`, ...
+LABELED_LINE = re.compile(
+    r"^[\s>*_\-]*(?P<label>S|A|スピーカー|サポーター)[\s*_]*[:：][\s*_]*(?P<content>.*)$"
+)
+ROLES = {
+    "S": "speaker",
+    "スピーカー": "speaker",
+    "A": "supporter",
+    "サポーター": "supporter",
+}
+
+# a label the parser does not know, e.g. `太郎: ...` or `**太郎**：...`, but not an URL or
+# a colon inside the words (`ポイント：ここ`)
+OTHER_LABEL = re.compile(
+    r"^[\s>_\-]*(\*\s+)?(\*\*[^\s*:：/]{1,10}\*\*[\s_]*[:：]|[^\s*:：/]{1,10}[:：](\s|$))"
+)
+# headings, horizontal rules and blank lines between the lines
+LAYOUT_LINE = re.compile(r"^\s*(#.*|[-*_=]{3,}|)\s*$")
+# a line that is only a direction, e.g. `（BGM）`, `*(笑)*`, `[間]`
+DIRECTION_LINE = re.compile(r"^[\s*_]*[（(\[【].*[）)\]】][\s*_]*$")
+# a direction leading the words of a line, e.g. `S: （笑いながら）そうですね`
+LEADING_DIRECTION = re.compile(r"^[（(\[【][^）)\]】]*[）)\]】]\s*")
+EMPHASIS = re.compile(r"\*+|__")
+
+# below these, the script is handed to `StructureAgent` instead
+MIN_LINES = 4
+MAX_UNKNOWN_RATIO = 0.1
+
+
+def clean(content: str) -> str:
+    """
+    The words to read out: markdown emphasis and leading directions removed.
+    """
+
+    content = EMPHASIS.sub("", content).strip()
+    content = LEADING_DIRECTION.sub("", content)
+    return content.strip()
+
+
+def _join(words: list[str]) -> str:
+    content = words[0]
+    for word in words[1:]:
+        # Japanese runs on, words of other scripts need a space
+        separator = " " if content[-1].isascii() and word[0].isascii() else ""
+        content += separator + word
+    return content
+
+
+def parse_dialogue(text: str) -> Conversation | None:
+    """
+    Reads the script the writer agents produce into a `Conversation` without an LLM call.
+
+    Text before the first line (preambles, the cast list) is skipped, and unlabeled text
+    after a line continues it. Returns None if the script does not look like the expected
+    format: too few lines, a single role, or too many lines with labels it does not know.
+    """
+
+    # role and words of each line, the words may continue over several text lines
+    turns: list[tuple[str, list[str]]] = []
+    unknown = 0
+    for line in text.splitlines():
+        match = LABELED_LINE.match(line)
+        if match is not None:
+            turns.append((ROLES[match.group("label")], []))
+            line = match.group("content")
+        elif len(turns) == 0:
+            continue
+        elif LAYOUT_LINE.match(line) or DIRECTION_LINE.match(line):
+            continue
+        elif OTHER_LABEL.match(line):
+            unknown += 1
+            continue
+        content = clean(line)
+        if content != "":
+            turns[-1][1].append(content)
+
+    dialogues = [
+        Dialogue(role=role, content=_join(words))
+        for role, words in turns
+        if len(words) > 0
+    ]
+    if len(dialogues) < MIN_LINES:
+        return None
+    if len({dialogue.role for dialogue in dialogues}) < 2:
+        return None
+    if unknown > len(dialogues) * MAX_UNKNOWN_RATIO:
+        return None
+
+    return Conversation(conversation=dialogues)
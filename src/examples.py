@@ -0,0 +1,127 @@
+import json
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+from .agent import Conversation
+
+# the examples listed under the web UI's form: (title, url)
+EXAMPLES: list[tuple[str, str]] = [
+    (
+        "LoRA: Low-Rank Adaptation of Large Language Models",
+        "https://arxiv.org/pdf/2106.09685",
+    ),
+    (
+        "Cosmos World Foundation Model Platform for Physical AI",
+        "https://arxiv.org/pdf/2501.03575",
+    ),
+    (
+        "Inductive Moment Matching (IMM)",
+        "https://arxiv.org/pdf/2503.07565",
+    ),
+    (
+        "Sigmoid Loss for Language Image Pre-Training (SigLIP)",
+        "https://arxiv.org/pdf/2303.15343",
+    ),
+    (
+        "Scalable Diffusion Models with Transformers (DiT)",
+        "https://arxiv.org/pdf/2212.09748",
+    ),
+    (
+        "TAID: Temporally Adaptive Interpolated Distillation for Efficient Knowledge Transfer in Language Models",
+        "https://arxiv.org/pdf/2501.16937",
+    ),
+    (
+        "Contrastive Representation Learning",
+        "https://lilianweng.github.io/posts/2021-05-31-contrastive/",
+    ),
+    (
+        "羅生門 | 青空文庫",
+        "https://www.aozora.gr.jp/cards/000879/files/127_15260.html",
+    ),
+    (
+        "双曲空間でのMachine Learningの最近の進展",
+        "https://tech-blog.abeja.asia/entry/hyperbolic_ml_2019",
+    ),
+    (
+        "Asagi VLM: 合成データセットを活用した大規模日本語 VLM",
+        "https://uehara-mech.github.io/assets/nlp2025-asagi-vlm.pdf",
+    ),
+]
+
+# bumped when the layout of the bundle changes, older bundles are ignored
+BUNDLE_VERSION = 1
+BUNDLE_FILE = "bundle.json"
+
+
+class RenderedExample(BaseModel):
+    title: str
+    url: str
+    # the fetched text the blog and the dialogue were written from
+    source: str
+    blog: str
+    dialogue: str
+    conversation: Conversation
+    # the voices `audio` was rendered with
+    speaker_name: str
+    supporter_name: str
+    speaker_id: int
+    supporter_id: int
+    # file name of the episode, relative to the bundle
+    audio: str
+
+
+class ExampleBundle(BaseModel):
+    """
+    Examples rendered ahead of time by `build_examples.py`, so clicking one does not run
+    the LLM stages again. Stored as `bundle.json` next to the audio files.
+    """
+
+    version: int = BUNDLE_VERSION
+    # e.g. the git revision of the prompts it was built with
+    revision: str = ""
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    examples: list[RenderedExample] = []
+
+    def find(self, url: str) -> RenderedExample | None:
+        for example in self.examples:
+            if example.url == url:
+                return example
+        return None
+
+    def save(self, directory: str | Path):
+        path = Path(directory) / BUNDLE_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_text(self.model_dump_json(indent=2), encoding="utf-8")
+        temp_path.replace(path)
+
+    @classmethod
+    def load(cls, directory: str | Path) -> "ExampleBundle | None":
+        """
+        The bundle in `directory`, or None if there is none or it has another version.
+        """
+
+        logger = logging.getLogger(__name__)
+        path = Path(directory) / BUNDLE_FILE
+        if not path.exists():
+            return None
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if data.get("version") != BUNDLE_VERSION:
+            logger.warning(
+                f"Ignoring example bundle {path}: version {data.get('version')}, "
+                f"expected {BUNDLE_VERSION}."
+            )
+            return None
+        bundle = cls.model_validate(data)
+        missing = [
+            example.url
+            for example in bundle.examples
+            if not (Path(directory) / example.audio).exists()
+        ]
+        if missing:
+            logger.warning(f"Example bundle {path} is missing audio for {missing}.")
+            bundle.examples = [e for e in bundle.examples if e.url not in missing]
+        return bundle
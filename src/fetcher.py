@@ -1,7 +1,31 @@
 import aiohttp
+import asyncio
 import io
+import logging
+from typing import Callable
 from markitdown import MarkItDown
 
+from .singleflight import SingleFlight, digest
+
+# characters of a combined multi-source document passed to the agents
+MAX_SOURCES_CHARS = 200_000
+
+
+def allocate(lengths: list[int], budget: int) -> list[int]:
+    """
+    Splits `budget` characters between sources: short sources are kept whole and what they
+    leave over is shared equally by the longer ones.
+    """
+
+    allocation = [0] * len(lengths)
+    remaining = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    while len(remaining) > 0:
+        share = budget // len(remaining)
+        i = remaining.pop(0)
+        allocation[i] = min(lengths[i], share)
+        budget -= allocation[i]
+    return allocation
+
 
 class PDFFetcher:
     def __init__(self):
@@ -52,13 +76,86 @@ class HTMLFetcher:
 
 
 class AutoFetcher:
-    def __init__(self):
+    def __init__(self, flights: SingleFlight | None = None, max_concurrency: int = 4):
         self.pdf_fetcher = PDFFetcher()
         self.html_fetcher = HTMLFetcher()
 
         self.md = MarkItDown(enable_plugins=True)
+        self.logger = logging.getLogger(__name__)
+
+        # concurrent requests for the same URL (or the same document) share one download and conversion
+        self.flights = flights or SingleFlight()
+        # downloads and conversions running at once, over all jobs using this fetcher
+        self._limit = asyncio.Semaphore(max_concurrency)
 
     async def fetch(self, url: str) -> str:
+        return await self.flights.do(("fetch", url), lambda: self._fetch(url))
+
+    async def fetch_all(
+        self,
+        urls: list[str],
+        max_chars: int = MAX_SOURCES_CHARS,
+        on_fetched: Callable[[str, int], None] | None = None,
+    ) -> str:
+        """
+        Fetches all sources concurrently and combines them into one document, each under a
+        heading with its URL. Duplicate URLs and sources with the same content are read once,
+        and long sources are cut so the whole fits in `max_chars`.
+
+        A source that fails is left out, unless all of them fail; if none fails but all are
+        empty, `ValueError` is raised. A single source is returned as is. `on_fetched` is
+        called with the URL and the length of its text as each source arrives.
+        """
+
+        async def _fetch(url: str) -> str:
+            text = await self.fetch(url)
+            if on_fetched is not None:
+                on_fetched(url, len(text))
+            return text
+
+        urls = list(dict.fromkeys(urls))
+        if len(urls) == 1:
+            return await _fetch(urls[0])
+
+        results = await asyncio.gather(
+            *(_fetch(url) for url in urls), return_exceptions=True
+        )
+        sources: list[tuple[str, str]] = []
+        seen = set()
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException):
+                if isinstance(result, asyncio.CancelledError):
+                    raise result
+                self.logger.warning(f"Failed to fetch {url}: {result!r}")
+                continue
+            key = digest(" ".join(result.split()))
+            if result.strip() == "" or key in seen:
+                self.logger.info(
+                    f"Skipping {url}, its content is empty or a duplicate."
+                )
+                continue
+            seen.add(key)
+            sources.append((url, result.strip()))
+
+        if len(sources) == 0:
+            error = next((r for r in results if isinstance(r, BaseException)), None)
+            if error is not None:
+                raise error
+            raise ValueError("No usable content in the sources")
+
+        allocation = allocate([len(text) for _url, text in sources], max_chars)
+        blocks = []
+        for i, ((url, text), size) in enumerate(zip(sources, allocation)):
+            if size < len(text):
+                text = text[:size] + "\n\n(以下省略)"
+            blocks.append(f"# 情報源 {i + 1}: {url}\n\n{text}")
+        return "\n\n---\n\n".join(blocks)
+
+    async def _fetch(self, url: str) -> str:
+        async with self._limit:
+            return await self._download_and_convert(url)
+
+    async def _download_and_convert(self, url: str) -> str:
         async with aiohttp.ClientSession() as session:
             async with session.get(url) as res:
                 if res.status != 200:
@@ -70,6 +167,13 @@ class AutoFetcher:
                     res.headers.get("content-type", "text/plain"),
                 )
 
+        return await self.flights.do(
+            ("convert", digest(content_type, data)),
+            # conversion is CPU bound, keep it off the event loop
+            lambda: asyncio.to_thread(self.convert, data, content_type),
+        )
+
+    def convert(self, data: bytes, content_type: str) -> str:
         if "application/pdf" in content_type:
             return self.pdf_fetcher.postprocess(
                 self.md.convert_stream(io.BytesIO(data)).text_content
@@ -0,0 +1,543 @@
+import json
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Literal
+from pydantic import BaseModel, Field
+
+from .agent import Conversation
+from .scheduler import Priority
+from .voicevox import SpeakerId
+
+JobKind = Literal["generate", "record"]
+# `fast` writes the script from the sources while the blog is written alongside
+GenerateMode = Literal["quality", "fast"]
+JobStatus = Literal["queued", "running", "succeeded", "failed", "cancelled"]
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class JobRequest(BaseModel):
+    # `generate` runs the whole pipeline from `url` (or `urls`), `record` only re-synthesizes `conversation`
+    kind: JobKind = "generate"
+    url: str | None = None
+    # several sources for one episode, e.g. a paper, its project page and a blog post
+    urls: list[str] = []
+    mode: GenerateMode = "quality"
+    conversation: Conversation | None = None
+    # `record` only the lines of `conversation` that differ from this job's, if possible
+    base_job: str | None = None
+    speaker_id: SpeakerId
+    supporter_id: SpeakerId
+    # more (speaker, supporter) pairs to render the episode with, saved as `variants/{n}`
+    voices: list[tuple[SpeakerId, SpeakerId]] = []
+    voicevox_endpoint: str | None = None
+    # save CPU profiles and event loop stalls of the job as `profile.*` artifacts
+    profile: bool = False
+
+    @property
+    def priority(self) -> Priority:
+        return Priority.GENERATE if self.kind == "generate" else Priority.RERECORD
+
+    @property
+    def sources(self) -> list[str]:
+        return ([self.url] if self.url else []) + self.urls
+
+
+class Job(BaseModel):
+    id: str
+    request: JobRequest
+    status: JobStatus = "queued"
+    stage: str | None = None
+    lines_done: int = 0
+    lines_total: int = 0
+    attempts: int = 0
+    worker: str | None = None
+    created_at: float
+    updated_at: float
+    error: str | None = None
+    artifacts: list[str] = []
+    # only set on the job returned by `claim`, never stored or serialized
+    api_key: str | None = Field(default=None, exclude=True, repr=False)
+
+
+class JobEvent(BaseModel):
+    id: int
+    type: str
+    data: dict
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    request TEXT NOT NULL,
+    api_key TEXT,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    lines_done INTEGER NOT NULL DEFAULT 0,
+    lines_total INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority, created_at);
+
+CREATE TABLE IF NOT EXISTS events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+
+CREATE TABLE IF NOT EXISTS artifacts (
+    job_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    text TEXT,
+    path TEXT,
+    PRIMARY KEY (job_id, name)
+);
+"""
+
+
+class LeaseLost(Exception):
+    """
+    The worker no longer owns the job (lease expired, or the job was cancelled).
+    """
+
+
+class JobQueue:
+    """
+    Durable job queue in a single SQLite file, no broker needed.
+
+    Workers claim jobs with a time-limited lease and keep it alive with `heartbeat`.
+    A job whose lease expires (the worker died) is handed to the next worker, up to
+    `max_attempts` times. Every method opens its own connection, so the queue can be used
+    from any thread or process, and by several machines sharing the file over a network
+    mount (use `journal_mode="DELETE"` there, WAL needs shared memory).
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_attempts: int = 3,
+        journal_mode: str = "WAL",
+    ):
+        self.path = str(path)
+        self.max_attempts = max_attempts
+        self.journal_mode = journal_mode
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connect() as conn:
+            # take the write lock up front so two workers cannot claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _add_event(self, conn: sqlite3.Connection, job_id: str, type: str, data: dict):
+        conn.execute(
+            "INSERT INTO events (job_id, seq, type, data) VALUES "
+            "(?, (SELECT COALESCE(MAX(seq), -1) + 1 FROM events WHERE job_id = ?), ?, ?)",
+            (job_id, job_id, type, json.dumps(data, ensure_ascii=False)),
+        )
+
+    def _to_job(self, conn: sqlite3.Connection, row: sqlite3.Row) -> Job:
+        artifacts = [
+            name
+            for (name,) in conn.execute(
+                "SELECT name FROM artifacts WHERE job_id = ? AND name NOT LIKE 'segments/%' "
+                "ORDER BY rowid",
+                (row["id"],),
+            )
+        ]
+        return Job(
+            id=row["id"],
+            request=JobRequest.model_validate_json(row["request"]),
+            status=row["status"],
+            stage=row["stage"],
+            lines_done=row["lines_done"],
+            lines_total=row["lines_total"],
+            attempts=row["attempts"],
+            worker=row["worker"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+            error=row["error"],
+            artifacts=artifacts,
+        )
+
+    # --- producers ---
+
+    def enqueue(self, request: JobRequest, api_key: str | None = None) -> Job:
+        """
+        Adds a job. `api_key` overrides the workers' LLM key for this job; it is kept out of
+        the job's public fields and erased from the file as soon as a worker claims the job.
+        """
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, request, api_key, priority, status, max_attempts, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (
+                    job_id,
+                    request.model_dump_json(),
+                    api_key or None,
+                    int(request.priority),
+                    self.max_attempts,
+                    now,
+                    now,
+                ),
+            )
+            self._add_event(conn, job_id, "status", {"status": "queued"})
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._to_job(conn, row)
+
+    def get(self, job_id: str) -> Job | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._to_job(conn, row) if row is not None else None
+
+    def position(self, job_id: str) -> int | None:
+        """
+        1-based position among queued jobs, or None if the job is not waiting.
+        """
+
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT status, priority, created_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None or row["status"] != "queued":
+                return None
+            (ahead,) = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND "
+                "(priority < ? OR (priority = ? AND created_at < ?))",
+                (row["priority"], row["priority"], row["created_at"]),
+            ).fetchone()
+            return ahead + 1
+
+    def cancel(self, job_id: str) -> Job | None:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT status FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row["status"] not in FINISHED_STATUSES:
+                conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', lease_until = NULL, api_key = NULL, "
+                    "updated_at = ? WHERE id = ?",
+                    (time.time(), job_id),
+                )
+                self._add_event(conn, job_id, "status", {"status": "cancelled"})
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._to_job(conn, row)
+
+    def discard_artifacts(self, job_id: str) -> list[str]:
+        """
+        Deletes the artifacts of a job and returns the files no other job refers to.
+        """
+
+        with self._transaction() as conn:
+            paths = [
+                row["path"]
+                for row in conn.execute(
+                    "SELECT path FROM artifacts WHERE job_id = ? AND path IS NOT NULL",
+                    (job_id,),
+                )
+            ]
+            conn.execute("DELETE FROM artifacts WHERE job_id = ?", (job_id,))
+            return self._unreferenced(conn, paths)
+
+    def unreferenced(self, paths: list[str]) -> list[str]:
+        """
+        The paths no artifact refers to (identical audio is shared between jobs).
+        """
+
+        with self._connect() as conn:
+            return self._unreferenced(conn, paths)
+
+    def _unreferenced(self, conn: sqlite3.Connection, paths: list[str]) -> list[str]:
+        return [
+            path
+            for path in dict.fromkeys(paths)
+            if conn.execute(
+                "SELECT 1 FROM artifacts WHERE path = ? LIMIT 1", (path,)
+            ).fetchone()
+            is None
+        ]
+
+    def prune(
+        self, max_age: float | None = None, max_jobs: int | None = None
+    ) -> list[str]:
+        """
+        Deletes finished jobs older than `max_age` seconds, and the oldest ones beyond
+        `max_jobs`, with their events and artifacts. Returns the files no remaining job
+        refers to. Queued and running jobs are never pruned.
+        """
+
+        finished = ", ".join(f"'{status}'" for status in FINISHED_STATUSES)
+        with self._transaction() as conn:
+            job_ids: set[str] = set()
+            if max_age is not None:
+                job_ids.update(
+                    row["id"]
+                    for row in conn.execute(
+                        f"SELECT id FROM jobs WHERE status IN ({finished}) AND updated_at < ?",
+                        (time.time() - max_age,),
+                    )
+                )
+            if max_jobs is not None:
+                job_ids.update(
+                    row["id"]
+                    for row in conn.execute(
+                        f"SELECT id FROM jobs WHERE status IN ({finished}) "
+                        "ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+                        (max_jobs,),
+                    )
+                )
+
+            paths: list[str] = []
+            for job_id in job_ids:
+                paths += [
+                    row["path"]
+                    for row in conn.execute(
+                        "SELECT path FROM artifacts WHERE job_id = ? AND path IS NOT NULL",
+                        (job_id,),
+                    )
+                ]
+                conn.execute("DELETE FROM artifacts WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM events WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return self._unreferenced(conn, paths)
+
+    def artifact_files(self) -> set[str]:
+        """
+        Names of the audio files artifacts refer to, kept by `AudioStore` until their jobs
+        are pruned.
+        """
+
+        with self._connect() as conn:
+            return {
+                Path(row["path"]).name
+                for row in conn.execute(
+                    "SELECT DISTINCT path FROM artifacts WHERE path IS NOT NULL"
+                )
+            }
+
+    def events(self, job_id: str, after: int = -1) -> list[JobEvent]:
+        with self._connect() as conn:
+            return [
+                JobEvent(id=row["seq"], type=row["type"], data=json.loads(row["data"]))
+                for row in conn.execute(
+                    "SELECT seq, type, data FROM events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                    (job_id, after),
+                )
+            ]
+
+    def artifact(
+        self, job_id: str, name: str
+    ) -> tuple[str | bytes | None, str | None] | None:
+        """
+        Returns (text, path) of an artifact, or None if it does not exist. The text of
+        binary artifacts, e.g. `profile.pstats`, is bytes.
+        """
+
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT text, path FROM artifacts WHERE job_id = ? AND name = ?",
+                (job_id, name),
+            ).fetchone()
+            return (row["text"], row["path"]) if row is not None else None
+
+    # --- workers ---
+
+    def claim(self, worker: str, lease: float) -> Job | None:
+        """
+        Takes the next queued job, or one whose worker stopped heartbeating.
+
+        The job's API key is moved from the file to the returned `Job.api_key`. A job whose
+        worker died holding the key cannot be retried with it and fails instead.
+        """
+
+        now = time.time()
+        with self._transaction() as conn:
+            while True:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'running' AND lease_until < ?) "
+                    "ORDER BY priority, created_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    return None
+
+                if row["status"] == "running":
+                    self._add_event(conn, row["id"], "retry", {"worker": row["worker"]})
+                error = None
+                if row["attempts"] >= row["max_attempts"]:
+                    error = "Too many attempts"
+                elif row["api_key"] == "":
+                    # claimed with a key that went away with its worker
+                    error = "The API key of the job is gone, submit it again"
+                if error is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, lease_until = NULL, "
+                        "api_key = NULL, updated_at = ? WHERE id = ?",
+                        (error, now, row["id"]),
+                    )
+                    self._add_event(
+                        conn,
+                        row["id"],
+                        "status",
+                        {"status": "failed", "error": error},
+                    )
+                    continue
+
+                # '' marks a job that had a key, NULL one that never did
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, "
+                    "attempts = attempts + 1, lines_done = 0, "
+                    "api_key = CASE WHEN api_key IS NULL THEN NULL ELSE '' END, "
+                    "updated_at = ? WHERE id = ?",
+                    (worker, now + lease, now, row["id"]),
+                )
+                self._add_event(
+                    conn, row["id"], "status", {"status": "running", "worker": worker}
+                )
+                api_key = row["api_key"]
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE id = ?", (row["id"],)
+                ).fetchone()
+                job = self._to_job(conn, row)
+                job.api_key = api_key
+                return job
+
+    def _check_owner(self, conn: sqlite3.Connection, job_id: str, worker: str):
+        row = conn.execute(
+            "SELECT status, worker FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None or row["status"] != "running" or row["worker"] != worker:
+            raise LeaseLost(job_id)
+
+    def check(self, job_id: str, worker: str):
+        """
+        Raises `LeaseLost` if the worker no longer owns the job. Read only, cheaper than
+        `heartbeat`.
+        """
+
+        with self._connect() as conn:
+            self._check_owner(conn, job_id, worker)
+
+    def heartbeat(self, job_id: str, worker: str, lease: float):
+        with self._transaction() as conn:
+            self._check_owner(conn, job_id, worker)
+            conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ?",
+                (time.time() + lease, job_id),
+            )
+
+    def update(
+        self,
+        job_id: str,
+        worker: str,
+        event: str,
+        data: dict,
+        stage: str | None = None,
+        lines_done: int | None = None,
+        lines_total: int | None = None,
+    ):
+        with self._transaction() as conn:
+            self._check_owner(conn, job_id, worker)
+            conn.execute(
+                "UPDATE jobs SET stage = COALESCE(?, stage), "
+                "lines_done = COALESCE(?, lines_done), lines_total = COALESCE(?, lines_total), "
+                "updated_at = ? WHERE id = ?",
+                (stage, lines_done, lines_total, time.time(), job_id),
+            )
+            self._add_event(conn, job_id, event, data)
+
+    def put_artifact(
+        self,
+        job_id: str,
+        worker: str,
+        name: str,
+        text: str | bytes | None = None,
+        path: str | None = None,
+        event: str = "artifact",
+        event_data: dict | None = None,
+        lines_done: int | None = None,
+    ):
+        with self._transaction() as conn:
+            self._check_owner(conn, job_id, worker)
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (job_id, name, text, path) VALUES (?, ?, ?, ?)",
+                (job_id, name, text, path),
+            )
+            if lines_done is not None:
+                # segments may be recorded out of order
+                conn.execute(
+                    "UPDATE jobs SET lines_done = MAX(lines_done, ?), updated_at = ? WHERE id = ?",
+                    (lines_done, time.time(), job_id),
+                )
+            self._add_event(conn, job_id, event, {"name": name, **(event_data or {})})
+
+    def finish(
+        self,
+        job_id: str,
+        worker: str,
+        status: JobStatus,
+        error: str | None = None,
+    ):
+        with self._transaction() as conn:
+            self._check_owner(conn, job_id, worker)
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, api_key = NULL, "
+                "updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+            data: dict = {"status": status}
+            if error is not None:
+                data["error"] = error
+            self._add_event(conn, job_id, "status", data)
+
+    def release(self, job_id: str, worker: str, api_key: str | None = None):
+        """
+        Gives the job back to the queue, e.g. when the worker shuts down, with the API key
+        `claim` handed out.
+        """
+
+        with self._transaction() as conn:
+            self._check_owner(conn, job_id, worker)
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL, "
+                "api_key = COALESCE(?, api_key), updated_at = ? WHERE id = ?",
+                (api_key or None, time.time(), job_id),
+            )
+            self._add_event(conn, job_id, "status", {"status": "queued"})
@@ -0,0 +1,149 @@
+import asyncio
+from typing import AsyncIterator
+
+from .jobqueue import (
+    FINISHED_STATUSES,
+    Job,
+    JobEvent,
+    JobQueue,
+    JobRequest,
+    JobStatus,
+)
+from .storage import AudioStore
+
+__all__ = [
+    "ARTIFACTS",
+    "Job",
+    "JobEvent",
+    "JobManager",
+    "JobRequest",
+    "JobStatus",
+]
+
+ARTIFACTS = {
+    "blog.md": "text/markdown; charset=utf-8",
+    "dialogue.md": "text/markdown; charset=utf-8",
+    "conversation.json": "application/json",
+    "podcast.wav": "audio/wav",
+    "podcast.index.json": "application/json",
+    # LLM calls of the job, with the tokens served from the cache or condensed away
+    "prompts.json": "application/json",
+    # jobs submitted with `profile`
+    "profile.json": "application/json",
+    "profile.collapsed": "text/plain; charset=utf-8",
+    "profile.pstats": "application/octet-stream",
+}
+
+
+class JobManager:
+    """
+    Async front of the `JobQueue` for the web server: submits jobs and watches them.
+
+    The jobs themselves run in worker processes (see `src/worker.py`), so the server only
+    enqueues and polls; audio artifacts are read from the shared `AudioStore`. Finished
+    jobs older than `job_ttl` seconds or beyond the newest `max_jobs` are pruned with
+    their audio on every submit.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        audio_store: AudioStore,
+        poll_interval: float = 0.5,
+        job_ttl: float | None = None,
+        max_jobs: int | None = None,
+    ):
+        self.queue = queue
+        self.audio_store = audio_store
+        self.poll_interval = poll_interval
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+
+    async def submit(self, request: JobRequest, api_key: str | None = None) -> Job:
+        await self.prune()
+        return await asyncio.to_thread(self.queue.enqueue, request, api_key)
+
+    async def prune(self):
+        if self.job_ttl is None and self.max_jobs is None:
+            return
+        paths = await asyncio.to_thread(self.queue.prune, self.job_ttl, self.max_jobs)
+        for path in paths:
+            self.audio_store.remove(path)
+
+    async def get(self, job_id: str) -> Job | None:
+        return await asyncio.to_thread(self.queue.get, job_id)
+
+    async def position(self, job_id: str) -> int | None:
+        return await asyncio.to_thread(self.queue.position, job_id)
+
+    async def cancel(self, job_id: str) -> Job | None:
+        """
+        Cancels the job and deletes what it has produced so far. The worker running it
+        notices within a second and stops.
+        """
+
+        job = await asyncio.to_thread(self.queue.cancel, job_id)
+        if job is not None and job.status == "cancelled":
+            for path in await asyncio.to_thread(self.queue.discard_artifacts, job_id):
+                self.audio_store.remove(path)
+            job.artifacts = []
+        return job
+
+    async def events(self, job_id: str, after: int = -1) -> AsyncIterator[JobEvent]:
+        """
+        Yields the job's events with an id greater than `after` until the job finishes.
+        """
+
+        while True:
+            events = await asyncio.to_thread(self.queue.events, job_id, after)
+            for event in events:
+                yield event
+                after = event.id
+
+            if len(events) == 0:
+                job = await self.get(job_id)
+                if job is None or job.status in FINISHED_STATUSES:
+                    return
+                await asyncio.sleep(self.poll_interval)
+
+    async def wait(self, job_id: str) -> Job:
+        """
+        Waits until the job finishes and returns it.
+        """
+
+        async for _event in self.events(job_id):
+            pass
+        job = await self.get(job_id)
+        assert job is not None
+        return job
+
+    async def artifact(self, job_id: str, name: str) -> str | bytes | None:
+        """
+        Returns the content of an artifact kept in the queue (text, or bytes for binary
+        ones), or None if it does not exist (yet).
+        """
+
+        artifact = await asyncio.to_thread(self.queue.artifact, job_id, name)
+        if artifact is None:
+            return None
+        text, _path = artifact
+        return text
+
+    async def artifact_path(self, job_id: str, name: str) -> str | None:
+        artifact = await asyncio.to_thread(self.queue.artifact, job_id, name)
+        if artifact is None:
+            return None
+        _text, path = artifact
+        if path is None:
+            return None
+        return self.audio_store.get(path)
+
+    async def segment_path(self, job_id: str, index: int) -> str | None:
+        return await self.artifact_path(job_id, f"segments/{index}")
+
+    async def variant_path(self, job_id: str, index: int) -> str | None:
+        """
+        The episode rendered with the job's `voices[index]`.
+        """
+
+        return await self.artifact_path(job_id, f"variants/{index}")
@@ -0,0 +1,384 @@
+from typing import Literal
+from pydantic import BaseModel
+
+import numpy as np
+
+from .audio import Audio, WAV_HEADER_SIZE, write_header
+
+Role = Literal["speaker", "supporter"]
+
+
+class MasteringConfig(BaseModel):
+    enabled: bool = True
+
+    # silence trimming
+    silence_threshold_db: float = -45.0
+    trim_padding: float = 0.03  # seconds kept before and after the voiced part
+
+    # per-speaker loudness normalization (RMS of the voiced part, dBFS)
+    target_loudness_db: float = -20.0
+    max_gain_db: float = 12.0
+
+    # pauses inserted between segments (seconds)
+    turn_gap: float = 0.35
+    same_role_gap: float = 0.2
+    backchannel_gap: float = 0.12
+    backchannel_max_chars: int = 12
+
+    # peak limiter
+    ceiling_db: float = -1.0
+    limiter_window: float = 0.005  # seconds
+    limiter_release: int = 8  # windows the gain reduction is held after a peak
+
+
+class Segment:
+    """
+    One synthesized line and the role that spoke it.
+    """
+
+    __slots__ = ("role", "text", "audio")
+
+    def __init__(self, role: Role, text: str, audio: Audio):
+        self.role = role
+        self.text = text
+        self.audio = audio
+
+
+def db_to_amplitude(db: float) -> float:
+    return float(10.0 ** (db / 20.0))
+
+
+def _samples(audio: Audio) -> np.ndarray:
+    if audio.bits_per_sample != 16:
+        raise ValueError(f"Only 16-bit PCM is supported, got {audio.describe()}")
+    # zero-copy view of the data chunk, one row per frame
+    return np.frombuffer(audio.pcm, dtype="<i2").reshape(-1, audio.channels)
+
+
+def _first_voiced(voiced_mask_of, num_frames: int, reverse: bool, chunk: int) -> int:
+    # silence only sits at the edges, so scan inward chunk by chunk instead of the whole segment
+    for offset in range(0, num_frames, chunk):
+        if reverse:
+            lo, hi = max(num_frames - offset - chunk, 0), num_frames - offset
+        else:
+            lo, hi = offset, min(offset + chunk, num_frames)
+        mask = voiced_mask_of(lo, hi)
+        if mask.any():
+            if reverse:
+                return hi - 1 - int(np.argmax(mask[::-1]))
+            return lo + int(np.argmax(mask))
+    return -1
+
+
+def trim_silence(
+    samples: np.ndarray,
+    threshold: float,
+    padding: int,
+    chunk: int = 4096,
+) -> tuple[int, int]:
+    """
+    Returns the frame range of `samples` that is louder than `threshold`, widened by `padding` frames.
+    """
+
+    limit = int(threshold * 32768)
+
+    def voiced_mask_of(lo: int, hi: int) -> np.ndarray:
+        return (np.abs(samples[lo:hi].astype(np.int32)) > limit).any(axis=1)
+
+    first = _first_voiced(voiced_mask_of, len(samples), reverse=False, chunk=chunk)
+    if first < 0:
+        return 0, 0
+    last = _first_voiced(voiced_mask_of, len(samples), reverse=True, chunk=chunk)
+
+    return max(first - padding, 0), min(last + 1 + padding, len(samples))
+
+
+def gap_before(
+    previous: Segment,
+    current: Segment,
+    config: MasteringConfig,
+) -> float:
+    return _gap_seconds(previous.role, current.role, current.text, config)
+
+
+def _gap_seconds(
+    previous_role: Role, role: Role, text: str, config: MasteringConfig
+) -> float:
+    if previous_role == role:
+        return config.same_role_gap
+    if len(text.strip()) <= config.backchannel_max_chars:
+        return config.backchannel_gap
+    return config.turn_gap
+
+
+def limit_peaks(
+    samples: np.ndarray,
+    ceiling: float,
+    window: int,
+    release: int,
+):
+    """
+    Brick-wall limiter applied in place on a flat float32 array.
+
+    The gain is computed per window from the window peak, held for `release` windows
+    around each peak so it does not pump, and finally hard-clipped to the ceiling.
+    """
+
+    num_windows = len(samples) // window
+    if num_windows > 0:
+        blocks = samples[: num_windows * window].reshape(num_windows, window)
+        peaks = np.maximum(blocks.max(axis=1), -blocks.min(axis=1))
+        gain = np.minimum(1.0, ceiling / np.maximum(peaks, 1e-9)).astype(np.float32)
+
+        # hold the smallest gain around each peak (attack before and release after)
+        held = gain.copy()
+        for shift in range(1, min(release, num_windows - 1) + 1):
+            np.minimum(held[shift:], gain[:-shift], out=held[shift:])
+            np.minimum(held[:-shift], gain[shift:], out=held[:-shift])
+
+        rows = np.flatnonzero(held < 1.0)
+        blocks[rows] *= held[rows, None]
+
+    np.clip(samples, -ceiling, ceiling, out=samples)
+
+
+class PodcastIndex(BaseModel):
+    """
+    Where each line sits in a rendered episode and the gain applied per role, so single
+    lines can be replaced later (see `splice`) without rendering the episode again.
+    """
+
+    sample_rate: int
+    channels: int
+    gains: dict[str, float] = {}
+    # (first frame, number of frames) of each line, in line order
+    segments: list[tuple[int, int]]
+
+    @classmethod
+    def of_concat(cls, audios: list[Audio]) -> "PodcastIndex":
+        """
+        Index of `Audio.concat(audios)`, for episodes rendered without mastering.
+        """
+
+        segments = []
+        position = 0
+        for audio in audios:
+            segments.append((position, audio.num_frames))
+            position += audio.num_frames
+        return cls(
+            sample_rate=audios[0].sample_rate,
+            channels=audios[0].channels,
+            segments=segments,
+        )
+
+
+def _level(
+    s: np.ndarray,
+    start: int,
+    end: int,
+    gain: float,
+    ceiling: float,
+    window: int,
+    config: MasteringConfig,
+) -> np.ndarray:
+    leveled = np.multiply(s[start:end], np.float32(gain))
+    flat = leveled.reshape(-1)
+    if max(flat.max(), -flat.min()) > ceiling:
+        limit_peaks(flat, ceiling, window, config.limiter_release)
+    return leveled
+
+
+def master(segments: list[Segment], config: MasteringConfig) -> Audio:
+    """
+    Trims, levels and joins synthesized segments into one episode.
+
+    Each segment is handled with whole-array operations, and the result is quantized
+    straight into the output WAV buffer, so no episode-length float copy is ever made.
+    """
+
+    podcast, _index = master_indexed(segments, config)
+    return podcast
+
+
+def master_indexed(
+    segments: list[Segment], config: MasteringConfig
+) -> tuple[Audio, PodcastIndex]:
+    """
+    `master`, also returning where each segment ended up.
+    """
+
+    if len(segments) == 0:
+        raise ValueError("No segments to master")
+
+    first = segments[0].audio
+    for segment in segments[1:]:
+        if not first.same_format(segment.audio):
+            raise ValueError(
+                f"Cannot master audio with different formats: "
+                f"{first.describe()} and {segment.audio.describe()}"
+            )
+    sample_rate = first.sample_rate
+    channels = first.channels
+
+    threshold = db_to_amplitude(config.silence_threshold_db)
+    padding = int(config.trim_padding * sample_rate)
+
+    # 1. trim leading / trailing silence and measure loudness per role
+    samples = [_samples(segment.audio) for segment in segments]
+    ranges = [trim_silence(s, threshold, padding) for s in samples]
+
+    energy: dict[str, float] = {}
+    count: dict[str, int] = {}
+    for segment, s, (start, end) in zip(segments, samples, ranges):
+        # every 4th frame is plenty for a loudness estimate
+        voiced = s[start:end:4].astype(np.float32).ravel()
+        energy[segment.role] = energy.get(segment.role, 0.0) + float(
+            np.dot(voiced, voiced)
+        )
+        count[segment.role] = count.get(segment.role, 0) + voiced.size
+
+    target = db_to_amplitude(config.target_loudness_db)
+    max_gain = db_to_amplitude(config.max_gain_db)
+    gains: dict[str, float] = {}
+    for role in energy:
+        rms = np.sqrt(energy[role] / max(count[role], 1)) / 32768.0
+        gains[role] = min(target / rms, max_gain) if rms > 0 else 1.0
+
+    # 2. lay out segments with gaps between them
+    offsets = []
+    position = 0
+    previous: Segment | None = None
+    for segment, (start, end) in zip(segments, ranges):
+        if end <= start:
+            # silent, takes no room
+            offsets.append(position)
+            continue
+        if previous is not None:
+            position += int(gap_before(previous, segment, config) * sample_rate)
+        offsets.append(position)
+        position += end - start
+        previous = segment
+    num_frames = position
+
+    data_size = num_frames * channels * 2
+    buffer = bytearray(WAV_HEADER_SIZE + data_size)
+    write_header(buffer, data_size, sample_rate, channels, 16)
+    output = np.frombuffer(buffer, dtype="<i2", offset=WAV_HEADER_SIZE).reshape(
+        -1, channels
+    )
+
+    # 3. apply gains, limit peaks and quantize into the output buffer
+    ceiling = db_to_amplitude(config.ceiling_db) * 32767.0
+    window = max(int(config.limiter_window * sample_rate), 1) * channels
+    for segment, s, (start, end), offset in zip(segments, samples, ranges, offsets):
+        if end <= start:
+            continue
+        output[offset : offset + end - start] = _level(
+            s, start, end, gains[segment.role], ceiling, window, config
+        )
+
+    index = PodcastIndex(
+        sample_rate=sample_rate,
+        channels=channels,
+        gains=gains,
+        segments=[
+            (offset, max(end - start, 0))
+            for offset, (start, end) in zip(offsets, ranges)
+        ],
+    )
+    return Audio(buffer), index
+
+
+def splice(
+    podcast: Audio,
+    index: PodcastIndex,
+    replacements: dict[int, Segment],
+    config: MasteringConfig,
+    lines: list[tuple[Role, str]] | None = None,
+) -> tuple[Audio, PodcastIndex]:
+    """
+    Replaces the lines in `replacements` (line index -> newly synthesized segment) in an
+    episode rendered by `master_indexed` (or `Audio.concat` when mastering is disabled).
+
+    Only the new lines are trimmed and leveled, with the episode's gains; the other lines
+    and the pauses between them are copied over as is, which still copies the whole
+    episode once. `lines` (role and text of every line after the edit) lay out the pauses
+    next to edited lines, e.g. around a line that was silent before; without them the
+    old pause is kept where there was one, and `turn_gap` is used elsewhere.
+    """
+
+    for segment in replacements.values():
+        if not podcast.same_format(segment.audio):
+            raise ValueError(
+                f"Cannot splice audio with different formats: "
+                f"{podcast.describe()} and {segment.audio.describe()}"
+            )
+
+    threshold = db_to_amplitude(config.silence_threshold_db)
+    padding = int(config.trim_padding * index.sample_rate)
+    ceiling = db_to_amplitude(config.ceiling_db) * 32767.0
+    window = max(int(config.limiter_window * index.sample_rate), 1) * index.channels
+
+    rendered: dict[int, np.ndarray] = {}
+    for i, segment in replacements.items():
+        s = _samples(segment.audio)
+        if not config.enabled:
+            rendered[i] = s
+            continue
+        start, end = trim_silence(s, threshold, padding)
+        if end <= start:
+            rendered[i] = s[:0]
+            continue
+        gain = index.gains.get(segment.role, 1.0)
+        rendered[i] = _level(s, start, end, gain, ceiling, window, config)
+
+    def _gap(previous: int, current: int, old_gap: int | None) -> int:
+        if not config.enabled:
+            return 0
+        edited = previous in rendered or current in rendered
+        if old_gap is not None and (not edited or lines is None):
+            return old_gap
+        if lines is None:
+            return int(config.turn_gap * index.sample_rate)
+        (previous_role, _), (role, text) = lines[previous], lines[current]
+        return int(_gap_seconds(previous_role, role, text, config) * index.sample_rate)
+
+    # lay the lines out again, keeping the pauses between lines that were already next to
+    # each other
+    segments = []
+    position = 0
+    previous = None  # last voiced line after the edit
+    old_previous = None  # and before it
+    for i, (offset, frames) in enumerate(index.segments):
+        new_frames = len(rendered[i]) if i in rendered else frames
+        if new_frames > 0 and previous is not None:
+            old_gap = None
+            if frames > 0 and old_previous == previous:
+                old_offset, old_frames = index.segments[previous]
+                old_gap = offset - (old_offset + old_frames)
+            position += _gap(previous, i, old_gap)
+        segments.append((position, new_frames))
+        position += new_frames
+        if new_frames > 0:
+            previous = i
+        if frames > 0:
+            old_previous = i
+
+    old = _samples(podcast)
+    data_size = position * index.channels * 2
+    buffer = bytearray(WAV_HEADER_SIZE + data_size)
+    write_header(buffer, data_size, index.sample_rate, index.channels, 16)
+    output = np.frombuffer(buffer, dtype="<i2", offset=WAV_HEADER_SIZE).reshape(
+        -1, index.channels
+    )
+
+    # the pauses are already silent
+    for i, ((offset, frames), (target, new_frames)) in enumerate(
+        zip(index.segments, segments)
+    ):
+        if i in rendered:
+            output[target : target + new_frames] = rendered[i]
+        else:
+            output[target : target + new_frames] = old[offset : offset + frames]
+
+    return Audio(buffer), index.model_copy(update={"segments": segments})
@@ -1,107 +1,635 @@
-from tqdm import tqdm
+import asyncio
+import contextlib
 import logging
+from typing import Callable
 
-from .agent import BloggerAgent, WriterAgent, StructureAgent, Conversation
+from pydantic import BaseModel
+
+from .agent import (
+    BloggerAgent,
+    WriterAgent,
+    SectionWriterAgent,
+    StructureAgent,
+    Conversation,
+)
+from .dialogue import parse_dialogue
 from .fetcher import AutoFetcher
-from .voicevox import VoiceVoxClient, SpeakerId, Audio
+from .voicevox import (
+    AudioQuery,
+    EngineCapabilities,
+    VoiceVoxClient,
+    SpeakerId,
+    UnsupportedEndpoint,
+)
+from .audio import Audio
+from .mastering import (
+    MasteringConfig,
+    PodcastIndex,
+    Segment,
+    master_indexed,
+    splice,
+)
+from .progress import ProgressCallback, ProgressReporter
+from .routing import Router
+from .scheduler import Scheduler
+from .singleflight import SingleFlight, digest
+
+try:
+    from tqdm import tqdm
+except ImportError:  # optional, only draws a progress bar in the terminal
+    tqdm = None
+
+# rough size of synthesized audio per character of text (24kHz, 16bit, ~0.15s/char)
+AUDIO_BYTES_PER_CHAR = 7_200
+
+# upper bound of text per /multi_synthesis request, keeps the zip and the slot memory small
+MAX_BATCH_CHARS = 1_000
+
+# called with (line index, audio) as soon as each line is synthesized
+SegmentCallback = Callable[[int, Audio], None]
+# the same for `record_variants`, with the index of the voice pair first
+VariantSegmentCallback = Callable[[int, int, Audio], None]
+
+# (line index, speaker, text)
+Line = tuple[int, SpeakerId, str]
+
+
+def set_speed(
+    audio_query: AudioQuery, scale: float, tempo_dynamics: bool | None = None
+):
+    """
+    Speeds up speech with `tempoDynamicsScale` on AivisSpeech and `speedScale` on VOICEVOX.
+    `tempo_dynamics` comes from the engine's capabilities, if it has been probed.
+    """
+
+    if tempo_dynamics is None:
+        tempo_dynamics = audio_query.tempoDynamicsScale is not None
+    if tempo_dynamics:
+        audio_query.tempoDynamicsScale = scale
+    else:
+        audio_query.speedScale = scale
+
+
+def tempo_dynamics(voicevox_client: VoiceVoxClient) -> bool | None:
+    capabilities = voicevox_client.capabilities
+    return None if capabilities is None else capabilities.tempo_dynamics
+
+
+def make_batches(lines: list[Line], max_lines: int, max_chars: int) -> list[list[Line]]:
+    """
+    Groups lines by speaker into batches of at most `max_lines` lines and `max_chars`
+    characters, keeping the order of lines within each speaker.
+    """
+
+    batches: list[list[Line]] = []
+    open_batches: dict[SpeakerId, tuple[list[Line], int]] = {}
+    for line in lines:
+        _index, speaker_id, text = line
+        batch, chars = open_batches.get(speaker_id, ([], 0))
+        if len(batch) == 0 or len(batch) >= max_lines or chars + len(text) > max_chars:
+            batch, chars = [], 0
+            batches.append(batch)
+        batch.append(line)
+        open_batches[speaker_id] = (batch, chars + len(text))
+    return batches
 
 
 class PodcastStudio:
-    def __init__(self, api_key: str, logging_level: int = logging.INFO):
-        self.blogger = BloggerAgent(api_key=api_key)
-        self.writer = WriterAgent(api_key=api_key)
-        self.structure_agent = StructureAgent(api_key=api_key)
+    def __init__(
+        self,
+        api_key: str,
+        logging_level: int = logging.INFO,
+        mastering_config: MasteringConfig | None = None,
+        scheduler: Scheduler | None = None,
+        flights: SingleFlight | None = None,
+        synthesis_batch_size: int = 1,
+        section_parallel: bool = False,
+        router: Router | None = None,
+        fetcher: AutoFetcher | None = None,
+    ):
+        # share `router` between studios so the latency and errors it observes add up
+        self.router = router or Router()
+        self.blogger = BloggerAgent(api_key=api_key, router=self.router)
+        self.writer = WriterAgent(api_key=api_key, router=self.router)
+        self.section_writer = SectionWriterAgent(api_key=api_key, router=self.router)
+        self.structure_agent = StructureAgent(api_key=api_key, router=self.router)
 
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging_level)
 
-        self.fetcher = AutoFetcher()
+        # share `flights` between studios so identical fetches, LLM calls and lines run once
+        self.flights = flights or SingleFlight()
+        # share `fetcher` between studios so they share its download limit
+        self.fetcher = fetcher or AutoFetcher(flights=self.flights)
+
+        self.mastering_config = mastering_config or MasteringConfig()
+        self.scheduler = scheduler
+        # lines per /multi_synthesis request, 1 synthesizes line by line
+        self.synthesis_batch_size = synthesis_batch_size
+        # write the script's sections concurrently instead of in one long call
+        self.section_parallel = section_parallel
+
+    def slot(self, resource: str, memory: int = 0):
+        if self.scheduler is None:
+            return contextlib.nullcontext()
+        return self.scheduler.slot(resource, memory=memory)
+
+    async def ask(
+        self,
+        agent: BloggerAgent | WriterAgent | SectionWriterAgent | StructureAgent,
+        *inputs: str | int | BaseModel | None,
+        method: str = "task",
+    ):
+        call = getattr(agent, method)
+
+        async def _call():
+            async with self.slot("llm"):
+                return await call(*inputs)
+
+        key = (
+            "llm",
+            type(agent).__name__,
+            method,
+            digest(
+                agent.api_key,
+                *(
+                    x.model_dump_json() if isinstance(x, BaseModel) else str(x)
+                    for x in inputs
+                ),
+            ),
+        )
+        return await self.flights.do(key, _call)
+
+    async def structure(self, dialogue: str) -> Conversation:
+        """
+        Parses the script locally, asking `StructureAgent` only if it is not in the usual
+        format.
+        """
+
+        conversation = parse_dialogue(dialogue)
+        if conversation is not None:
+            return conversation
+        self.logger.info("Could not parse the dialogue, asking the structure agent.")
+        return await self.ask(self.structure_agent, dialogue)
+
+    async def write_dialogue(self, paper: str, blog: str | None) -> str:
+        """
+        The script, from `paper` and the blog written from it, or from `paper` alone.
+        """
+
+        if not self.section_parallel:
+            return await self.ask(self.writer, paper, blog)
+
+        writer = self.section_writer
+        outline = await self.ask(writer, paper, blog, method="outline")
+        self.logger.info(f"Writing {len(outline.parts)} parts concurrently...")
+
+        async def _part(index: int) -> str:
+            text = await self.ask(writer, paper, blog, outline, index, method="section")
+            if not writer.check(text):
+                self.logger.warning(
+                    f"Part {outline.parts[index]} looks broken, writing it again."
+                )
+                # the same inputs would join the same flight, so bypass it
+                async with self.slot("llm"):
+                    text = await writer.section(paper, blog, outline, index)
+            return text
+
+        parts = await asyncio.gather(*(_part(i) for i in range(len(outline.parts))))
+        return writer.stitch(outline, list(parts))
+
+    async def preflight(
+        self, voicevox_client: VoiceVoxClient, speakers: list[SpeakerId]
+    ) -> EngineCapabilities:
+        """
+        Checks that the engine is up and has the styles. Raises `EngineUnavailable`.
+        """
+
+        return await self.flights.do(
+            ("preflight", voicevox_client.endpoint, *speakers),
+            lambda: voicevox_client.preflight(speakers),
+        )
+
+    async def warm_up(self, voicevox_client: VoiceVoxClient, speakers: list[SpeakerId]):
+        """
+        Loads the styles' models on the engine, e.g. while the LLM writes the script.
+        """
+
+        async def _initialize(speaker: SpeakerId):
+            async with self.slot("engine"):
+                await voicevox_client.initialize_speaker(speaker)
+
+        await asyncio.gather(
+            *(
+                self.flights.do(
+                    ("initialize", voicevox_client.endpoint, speaker),
+                    lambda speaker=speaker: _initialize(speaker),
+                )
+                for speaker in dict.fromkeys(speakers)
+            )
+        )
+
+    async def synthesize(
+        self,
+        voicevox_client: VoiceVoxClient,
+        speaker_id: SpeakerId,
+        text: str,
+    ) -> Audio:
+        async def _call() -> Audio:
+            async with self.slot("engine", memory=len(text) * AUDIO_BYTES_PER_CHAR):
+                audio_query = await voicevox_client.post_audio_query(
+                    text=text,
+                    speaker=speaker_id,
+                )
+                set_speed(audio_query, 1.1, tempo_dynamics(voicevox_client))
+
+                return await voicevox_client.post_synthesis(
+                    speaker=speaker_id,
+                    audio_query=audio_query,
+                )
+
+        key = ("synthesis", voicevox_client.endpoint, speaker_id, text)
+        return await self.flights.do(key, _call)
+
+    async def synthesize_batch(
+        self,
+        voicevox_client: VoiceVoxClient,
+        speaker_id: SpeakerId,
+        texts: list[str],
+    ) -> list[Audio]:
+        """
+        Synthesizes the texts with one `/multi_synthesis` request, or line by line if the
+        engine does not have it.
+        """
+
+        if len(texts) == 1 or voicevox_client.supports_multi_synthesis is False:
+            if self.scheduler is None:
+                return [
+                    await self.synthesize(voicevox_client, speaker_id, text)
+                    for text in texts
+                ]
+            return list(
+                await asyncio.gather(
+                    *(
+                        self.synthesize(voicevox_client, speaker_id, text)
+                        for text in texts
+                    )
+                )
+            )
+
+        async def _call() -> list[Audio]:
+            memory = sum(len(text) for text in texts) * AUDIO_BYTES_PER_CHAR
+            async with self.slot("engine", memory=memory):
+                audio_queries = []
+                for text in texts:
+                    audio_query = await voicevox_client.post_audio_query(
+                        text=text,
+                        speaker=speaker_id,
+                    )
+                    set_speed(audio_query, 1.1, tempo_dynamics(voicevox_client))
+                    audio_queries.append(audio_query)
 
-    async def create_conversation(self, url: str) -> tuple[str, str, Conversation]:
-        self.logger.info(f"Fetching paper from {url}...")
-        paper = await self.fetcher.fetch(url)
+                return await voicevox_client.post_multi_synthesis(
+                    speaker=speaker_id,
+                    audio_queries=audio_queries,
+                )
+
+        key = ("multi_synthesis", voicevox_client.endpoint, speaker_id, tuple(texts))
+        try:
+            return await self.flights.do(key, _call)
+        except UnsupportedEndpoint:
+            self.logger.info(
+                f"{voicevox_client.endpoint} has no /multi_synthesis, synthesizing line by line."
+            )
+            return await self.synthesize_batch(voicevox_client, speaker_id, texts)
+
+    async def fetch(self, urls: list[str], progress: ProgressReporter) -> str:
+        fetched = 0
+        fetched_chars = 0
+
+        def _on_fetched(_url: str, chars: int):
+            nonlocal fetched, fetched_chars
+            fetched += 1
+            fetched_chars += chars
+            progress.advance("fetch", fetched, len(urls), size=fetched_chars)
+
+        self.logger.info(f"Fetching paper from {', '.join(urls)}...")
+        with progress.stage("fetch", total=len(urls)):
+            paper = await self.fetcher.fetch_all(urls, on_fetched=_on_fetched)
         self.logger.info("Paper fetched successfully.")
         self.logger.debug(
             f"Paper content: {paper[:100]}..."
         )  # Log first 100 characters
+        return paper
+
+    async def create_conversation(
+        self,
+        url: str | list[str],
+        on_progress: ProgressCallback | None = None,
+    ) -> tuple[str, str, Conversation]:
+        urls = [url] if isinstance(url, str) else url
+        progress = ProgressReporter(on_progress)
+        paper = await self.fetch(urls, progress)
 
         self.logger.info("Creating blog from paper...")
-        blog = await self.blogger.task(paper)
+        with progress.stage("blog"):
+            blog = await self.ask(self.blogger, paper)
         self.logger.info("Blog created successfully.")
         self.logger.debug(f"{blog[:100]}...")  # Log first 100 characters
 
         self.logger.info("Creating dialogue from blog...")
-        dialogue = await self.writer.task(paper, blog)
+        with progress.stage("dialogue"):
+            dialogue = await self.write_dialogue(paper, blog)
         self.logger.info("Dialogue created successfully.")
         self.logger.debug(f"{dialogue[:100]}...")  # Log first 100 characters
 
         self.logger.info("Structuring conversation from dialogue...")
-        conversation = await self.structure_agent.task(dialogue)
+        with progress.stage("structure"):
+            conversation = await self.structure(dialogue)
         self.logger.info("Conversation structured successfully.")
         for _d in conversation.conversation:
             self.logger.debug(f"{_d.role}: {_d.content[:100]}...")
 
         return blog, dialogue, conversation
 
+    async def draft_conversation(
+        self,
+        url: str | list[str],
+        on_progress: ProgressCallback | None = None,
+    ) -> tuple[asyncio.Task[str], str, Conversation]:
+        """
+        Fast mode of `create_conversation`: the script is written from the sources alone
+        while the blog is written alongside, so it is not on the way to the audio. The blog
+        is returned as a task that may still be running.
+        """
+
+        urls = [url] if isinstance(url, str) else url
+        progress = ProgressReporter(on_progress)
+        paper = await self.fetch(urls, progress)
+
+        async def _blog() -> str:
+            with progress.stage("blog"):
+                blog = await self.ask(self.blogger, paper)
+            self.logger.info("Blog created successfully.")
+            return blog
+
+        self.logger.info("Creating blog and dialogue from paper...")
+        blog = asyncio.create_task(_blog())
+        try:
+            with progress.stage("dialogue"):
+                dialogue = await self.write_dialogue(paper, None)
+            self.logger.info("Dialogue created successfully.")
+
+            with progress.stage("structure"):
+                conversation = await self.structure(dialogue)
+            self.logger.info("Conversation structured successfully.")
+        except BaseException:
+            blog.cancel()
+            raise
+
+        return blog, dialogue, conversation
+
+    async def synthesize_lines(
+        self,
+        voicevox_client: VoiceVoxClient,
+        lines: list[Line],
+        on_line: Callable[[Line, Audio], None] | None = None,
+    ) -> dict[int, Audio]:
+        """
+        Synthesizes `lines` in batches of `synthesis_batch_size` and returns their audio by
+        line index. `on_line` is called as soon as each line is synthesized.
+        """
+
+        if self.synthesis_batch_size > 1:
+            batches = make_batches(lines, self.synthesis_batch_size, MAX_BATCH_CHARS)
+        else:
+            batches = [[line] for line in lines]
+
+        async def _synthesis(batch: list[Line]) -> list[tuple[int, Audio]]:
+            audios = await self.synthesize_batch(
+                voicevox_client,
+                speaker_id=batch[0][1],
+                texts=[text for _, _, text in batch],
+            )
+            if on_line is not None:
+                for line, audio in zip(batch, audios):
+                    on_line(line, audio)
+            return [(index, audio) for (index, _, _), audio in zip(batch, audios)]
+
+        jobs = [_synthesis(batch) for batch in batches]
+        if self.scheduler is None:
+            results = [result for job in jobs for result in await job]
+        else:
+            # queue every batch, the scheduler decides how many run at once
+            results = [
+                result for batch in await asyncio.gather(*jobs) for result in batch
+            ]
+        return dict(results)
+
+    def render(
+        self, conversation: Conversation, audios: list[Audio]
+    ) -> tuple[Audio, PodcastIndex]:
+        """
+        The episode made of the lines' `audios`, and where each line ended up.
+        """
+
+        if not self.mastering_config.enabled:
+            # connect audio files locally, copying each segment's PCM once
+            return Audio.concat(audios), PodcastIndex.of_concat(audios)
+        return master_indexed(
+            [
+                Segment(role=dialogue.role, text=dialogue.content, audio=audio)
+                for dialogue, audio in zip(conversation.conversation, audios)
+            ],
+            self.mastering_config,
+        )
+
     async def record_podcast(
         self,
         conversation: Conversation,
         voicevox_client: VoiceVoxClient,
         speaker_id: SpeakerId,
         supporter_id: SpeakerId,
+        on_segment: SegmentCallback | None = None,
+        on_progress: ProgressCallback | None = None,
+        on_index: Callable[[PodcastIndex], None] | None = None,
     ) -> Audio:
-        progress_bar = tqdm(
-            total=len(conversation.conversation),
-            desc="Synthesizing audio",
-            ncols=100,
+        """
+        Synthesizes every line and renders the episode. `on_index` receives where each line
+        ended up, for `rerecord_lines`.
+        """
+
+        lines_total = len(conversation.conversation)
+        lines_done = 0
+        progress = ProgressReporter(on_progress)
+        progress_bar = (
+            tqdm(total=lines_total, desc="Synthesizing audio", ncols=100)
+            if tqdm is not None
+            else None
         )
 
-        async def _synthesis(
-            speaker_id: SpeakerId,
-            text: str,
-            index: int,
-            progress: tqdm,
-        ) -> tuple[int, Audio]:
-            audio_query = await voicevox_client.post_audio_query(
-                text=text,
-                speaker=speaker_id,
-            )
-            if audio_query.tempoDynamicsScale is not None:
-                audio_query.tempoDynamicsScale = 1.1
-            else:
-                audio_query.speedScale = 1.1
-
-            audio = await voicevox_client.post_synthesis(
-                speaker=speaker_id,
-                audio_query=audio_query,
+        lines: list[Line] = [
+            (
+                i,
+                speaker_id if dialogue.role == "speaker" else supporter_id,
+                dialogue.content,
             )
-            progress.update(1)
-
-            progress.set_postfix({"text": text[:20] + "..."})
-
-            return index, audio
-
-        results = []
-        for i, dialogue in enumerate(conversation.conversation):
-            results.append(
-                await _synthesis(
-                    speaker_id=(
-                        speaker_id if dialogue.role == "speaker" else supporter_id
-                    ),
-                    text=dialogue.content,
-                    index=i,
-                    progress=progress_bar,
+            for i, dialogue in enumerate(conversation.conversation)
+        ]
+
+        def _on_line(line: Line, audio: Audio):
+            nonlocal lines_done
+            index, _, text = line
+            lines_done += 1
+            progress.advance("recording", lines_done, lines_total)
+            if on_segment is not None:
+                on_segment(index, audio)
+
+            if progress_bar is not None:
+                progress_bar.update(1)
+                progress_bar.set_postfix({"text": text[:20] + "..."})
+
+        with progress.stage("recording", total=lines_total):
+            audios = await self.synthesize_lines(voicevox_client, lines, _on_line)
+        if progress_bar is not None:
+            progress_bar.close()
+
+        # numpy work on the whole episode, keep it off the event loop
+        podcast, index = await asyncio.to_thread(
+            self.render, conversation, [audios[i] for i in range(lines_total)]
+        )
+        if on_index is not None:
+            on_index(index)
+        return podcast
+
+    async def record_variants(
+        self,
+        conversation: Conversation,
+        voicevox_client: VoiceVoxClient,
+        voices: list[tuple[SpeakerId, SpeakerId]],
+        on_segment: VariantSegmentCallback | None = None,
+        on_progress: ProgressCallback | None = None,
+        on_index: Callable[[int, PodcastIndex], None] | None = None,
+    ) -> list[Audio]:
+        """
+        Renders `conversation` once per (speaker, supporter) pair of `voices`. The lines of
+        every pair are synthesized in one schedule, and a line said by the same voice in
+        several pairs (e.g. the same supporter) is synthesized once. `on_segment` and
+        `on_index` also receive the index of the pair.
+        """
+
+        dialogues = conversation.conversation
+        # (voice, text) -> the synthesis every pair saying it shares
+        syntheses: dict[tuple[SpeakerId, str], int] = {}
+        # pair -> synthesis of each of its lines
+        plans: list[list[int]] = [[] for _ in voices]
+        # line by line, so every pair is done at about the same time
+        for dialogue in dialogues:
+            for plan, (speaker_id, supporter_id) in zip(plans, voices):
+                voice = speaker_id if dialogue.role == "speaker" else supporter_id
+                key = (voice, dialogue.content)
+                plan.append(syntheses.setdefault(key, len(syntheses)))
+        lines: list[Line] = [
+            (synthesis, voice, text) for (voice, text), synthesis in syntheses.items()
+        ]
+        # synthesis -> (pair, line) using it
+        uses: dict[int, list[tuple[int, int]]] = {}
+        for pair, plan in enumerate(plans):
+            for index, synthesis in enumerate(plan):
+                uses.setdefault(synthesis, []).append((pair, index))
+
+        progress = ProgressReporter(on_progress)
+        lines_done = 0
+
+        def _on_line(line: Line, audio: Audio):
+            nonlocal lines_done
+            lines_done += 1
+            progress.advance("recording", lines_done, len(lines))
+            if on_segment is not None:
+                for pair, index in uses[line[0]]:
+                    on_segment(pair, index, audio)
+
+        self.logger.info(
+            f"Recording {len(voices)} voice pairs: {len(lines)} lines to synthesize "
+            f"for {len(voices) * len(dialogues)}."
+        )
+        with progress.stage("recording", total=len(lines)):
+            audios = await self.synthesize_lines(voicevox_client, lines, _on_line)
+
+        # numpy work on whole episodes, rendered side by side off the event loop
+        rendered = await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    self.render, conversation, [audios[synthesis] for synthesis in plan]
                 )
+                for plan in plans
             )
-        progress_bar.close()
+        )
+        podcasts = []
+        for pair, (podcast, index) in enumerate(rendered):
+            if on_index is not None:
+                on_index(pair, index)
+            podcasts.append(podcast)
+        return podcasts
 
-        # sort results by index
-        results.sort(key=lambda x: x[0])
+    async def rerecord_lines(
+        self,
+        conversation: Conversation,
+        lines: list[int],
+        podcast: Audio,
+        index: PodcastIndex,
+        voicevox_client: VoiceVoxClient,
+        speaker_id: SpeakerId,
+        supporter_id: SpeakerId,
+        on_segment: SegmentCallback | None = None,
+        on_progress: ProgressCallback | None = None,
+    ) -> tuple[Audio, PodcastIndex]:
+        """
+        Synthesizes only `lines` of `conversation` again and splices them into `podcast`,
+        a rendering of the same conversation before the edit (with the same speakers).
+        """
+
+        progress = ProgressReporter(on_progress)
+        dialogues = conversation.conversation
+        lines_done = 0
+
+        def _on_line(line: Line, audio: Audio):
+            nonlocal lines_done
+            lines_done += 1
+            progress.advance("recording", lines_done, len(lines))
+            if on_segment is not None:
+                on_segment(line[0], audio)
 
-        audios = [audio for _, audio in results]
+        with progress.stage("recording", total=len(lines)):
+            audios = await self.synthesize_lines(
+                voicevox_client,
+                [
+                    (
+                        line,
+                        speaker_id
+                        if dialogues[line].role == "speaker"
+                        else supporter_id,
+                        dialogues[line].content,
+                    )
+                    for line in lines
+                ],
+                _on_line,
+            )
 
-        # connect audio files
-        podcast = await voicevox_client.post_connect_waves(
-            audio_list=audios,
+        replacements = {
+            line: Segment(
+                role=dialogues[line].role,
+                text=dialogues[line].content,
+                audio=audios[line],
+            )
+            for line in lines
+        }
+        # numpy work on the whole episode, keep it off the event loop
+        return await asyncio.to_thread(
+            splice,
+            podcast,
+            index,
+            replacements,
+            self.mastering_config,
+            [(dialogue.role, dialogue.content) for dialogue in dialogues],
         )
-        return podcast
@@ -0,0 +1,206 @@
+import asyncio
+import cProfile
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from pydantic import BaseModel
+
+# innermost frames of threads that are waiting, not working: the event loop's selector,
+# idle executor threads and lock waits
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+
+# only one cProfile per thread, jobs of the same worker take turns
+_cprofile_lock = threading.Lock()
+
+
+class BlockedCall(BaseModel):
+    stage: str
+    # how long the event loop did not run anything else
+    seconds: float
+    # innermost frame last, as in a traceback
+    stack: list[str]
+
+
+class ProfileReport(BaseModel):
+    # seconds spent in each stage, including waiting on the network
+    stages: dict[str, float] = {}
+    # how late the event loop woke up a sleeping task, in seconds
+    loop_lag_mean: float = 0.0
+    loop_lag_max: float = 0.0
+    blocked: list[BlockedCall] = []
+    samples: int = 0
+    sample_interval: float = 0.0
+    # False if another job of the worker held cProfile, then only samples are taken
+    cprofile: bool = False
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _stack(frame) -> list[str]:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return names[::-1]
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+class JobProfiler:
+    """
+    Profiles one job while it runs:
+
+    - cProfile of the event loop thread, where the coroutines of the pipeline run
+    - stacks of every thread sampled every `interval` seconds, so the work sent to threads
+      (PDF conversion, mastering) shows up too, as collapsed stacks for flamegraph tools
+    - event loop lag, and the stack of any callback holding the loop for more than
+      `block_threshold` seconds
+
+    Samples are labeled with the current `stage`. Other jobs running on the same worker
+    share the process and show up in the samples as well.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.005,
+        block_threshold: float = 0.1,
+        lag_interval: float = 0.05,
+    ):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.lag_interval = lag_interval
+        self.stage = "setup"
+
+        self._stage_started = time.monotonic()
+        self._stages: Counter[str] = Counter()
+        self._samples: Counter[str] = Counter()
+        self._sample_count = 0
+        self._lags: list[float] = []
+        self._blocked: list[BlockedCall] = []
+        self._heartbeat = time.monotonic()
+
+        self._profile: cProfile.Profile | None = None
+        self._loop_thread: int | None = None
+        self._stopped = threading.Event()
+        self._sampler: threading.Thread | None = None
+        self._lag_task: asyncio.Task | None = None
+
+    def set_stage(self, stage: str):
+        now = time.monotonic()
+        self._stages[self.stage] += now - self._stage_started
+        self.stage = stage
+        self._stage_started = now
+
+    def start(self):
+        """
+        Starts profiling, from the event loop thread.
+        """
+
+        self._loop_thread = threading.get_ident()
+        if _cprofile_lock.acquire(blocking=False):
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._heartbeat = time.monotonic()
+        self._lag_task = asyncio.create_task(self._watch_lag())
+        self._sampler = threading.Thread(
+            target=self._sample, name="profiler", daemon=True
+        )
+        self._sampler.start()
+
+    def stop(self) -> ProfileReport:
+        """
+        Stops profiling, from the thread that started it.
+        """
+
+        if self._profile is not None:
+            self._profile.disable()
+            _cprofile_lock.release()
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.set_stage(self.stage)
+
+        lags = self._lags or [0.0]
+        return ProfileReport(
+            stages=dict(self._stages),
+            loop_lag_mean=sum(lags) / len(lags),
+            loop_lag_max=max(lags),
+            blocked=self._blocked,
+            samples=self._sample_count,
+            sample_interval=self.interval,
+            cprofile=self._profile is not None,
+        )
+
+    async def _watch_lag(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.lag_interval)
+            self._heartbeat = time.monotonic()
+            self._lags.append(max(self._heartbeat - started - self.lag_interval, 0.0))
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        blocked_since: float | None = None
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            self._sample_count += 1
+            for ident, frame in frames.items():
+                if ident == me or _is_idle(frame):
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                thread = names.get(ident, str(ident))
+                stack = ";".join([self.stage, thread, *_stack(frame)])
+                self._samples[stack] += 1
+
+            # the loop did not get to wake up the lag watcher: something is blocking it
+            late = time.monotonic() - self._heartbeat - self.lag_interval
+            if late > self.block_threshold and self._loop_thread in frames:
+                if blocked_since != self._heartbeat:
+                    blocked_since = self._heartbeat
+                    self._blocked.append(
+                        BlockedCall(
+                            stage=self.stage,
+                            seconds=late,
+                            stack=_stack(frames[self._loop_thread]),
+                        )
+                    )
+                else:
+                    self._blocked[-1].seconds = late
+
+    def collapsed(self) -> str:
+        """
+        Samples as collapsed stacks (`stage;thread;frame;... count`), the input format of
+        flamegraph.pl, speedscope and similar tools.
+        """
+
+        return "".join(f"{stack} {count}\n" for stack, count in self._samples.items())
+
+    def pstats(self) -> bytes | None:
+        """
+        cProfile statistics in the format of `pstats.Stats`, or None without cProfile.
+        """
+
+        if self._profile is None:
+            return None
+        self._profile.create_stats()
+        return marshal.dumps(self._profile.stats)  # type: ignore[attr-defined]
@@ -0,0 +1,122 @@
+import contextlib
+import time
+from collections import deque
+from typing import Callable, Iterator, Literal
+
+from pydantic import BaseModel
+
+# stages of a `generate` job in order, a `record` job only has the last one
+Stage = Literal["fetch", "blog", "dialogue", "structure", "recording"]
+STAGES: list[Stage] = ["fetch", "blog", "dialogue", "structure", "recording"]
+
+
+class ProgressEvent(BaseModel):
+    stage: Stage
+    status: Literal["started", "progress", "finished"]
+    # e.g. lines synthesized out of all lines, sources fetched out of all sources
+    done: int = 0
+    total: int = 0
+    # characters fetched so far, in the fetch stage
+    size: int = 0
+    # seconds since the stage started
+    elapsed: float = 0.0
+
+
+ProgressCallback = Callable[[ProgressEvent], None]
+
+
+class ProgressReporter:
+    """
+    Sends `ProgressEvent`s for the stages of a job to `callback`, if any.
+    """
+
+    def __init__(self, callback: ProgressCallback | None = None):
+        self.callback = callback
+        self._started: dict[Stage, float] = {}
+
+    def _emit(self, stage: Stage, status, done: int, total: int, size: int):
+        if self.callback is None:
+            return
+        elapsed = time.monotonic() - self._started.get(stage, time.monotonic())
+        self.callback(
+            ProgressEvent(
+                stage=stage,
+                status=status,
+                done=done,
+                total=total,
+                size=size,
+                elapsed=elapsed,
+            )
+        )
+
+    @contextlib.contextmanager
+    def stage(self, stage: Stage, total: int = 0) -> Iterator[None]:
+        self._started[stage] = time.monotonic()
+        self._emit(stage, "started", 0, total, 0)
+        yield
+        self._emit(stage, "finished", total, total, 0)
+
+    def advance(self, stage: Stage, done: int, total: int, size: int = 0):
+        self._emit(stage, "progress", done, total, size)
+
+
+class StageStats:
+    """
+    Rolling duration and throughput of each stage over the last `window` jobs, used to
+    estimate how long a job still takes.
+    """
+
+    def __init__(self, window: int = 20):
+        self.window = window
+        # stage -> (units of work, seconds) of recent runs
+        self._runs: dict[str, deque[tuple[int, float]]] = {}
+
+    def record(self, stage: Stage, seconds: float, units: int = 0):
+        runs = self._runs.setdefault(stage, deque(maxlen=self.window))
+        runs.append((units, seconds))
+
+    def duration(self, stage: Stage) -> float | None:
+        runs = self._runs.get(stage)
+        if not runs:
+            return None
+        return sum(seconds for _, seconds in runs) / len(runs)
+
+    def seconds_per_unit(self, stage: Stage) -> float | None:
+        runs = self._runs.get(stage)
+        units = sum(units for units, _ in runs or ())
+        if units == 0:
+            return None
+        return sum(seconds for _, seconds in runs) / units
+
+    def eta(
+        self,
+        stages: list[Stage],
+        event: ProgressEvent,
+    ) -> float | None:
+        """
+        Seconds left in `stages` (the job's stages), given the latest event of its current
+        stage. None until every stage left has been seen at least once.
+        """
+
+        if event.total > 0 and event.done > 0:
+            # measured on this job, the pace of the engine and the model vary a lot
+            per_unit = event.elapsed / event.done
+        else:
+            per_unit = self.seconds_per_unit(event.stage)
+
+        if event.status == "finished":
+            remaining = 0.0
+        elif event.total > 0 and per_unit is not None:
+            remaining = (event.total - event.done) * per_unit
+        else:
+            duration = self.duration(event.stage)
+            if duration is None:
+                return None
+            remaining = max(duration - event.elapsed, 0.0)
+
+        for stage in stages[stages.index(event.stage) + 1 :]:
+            duration = self.duration(stage)
+            if duration is None:
+                return None
+            remaining += duration
+        return remaining
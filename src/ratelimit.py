@@ -0,0 +1,142 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from pydantic import BaseModel
+
+from .singleflight import digest
+
+
+class RateLimit(BaseModel):
+    # limits of the provider for one API key and model, None for no limit
+    requests_per_minute: int | None = None
+    tokens_per_minute: int | None = None
+
+    def share(self, parts: int) -> "RateLimit":
+        """
+        The limit of each of `parts` processes that share it, e.g. worker processes.
+        """
+
+        return RateLimit(
+            requests_per_minute=_share(self.requests_per_minute, parts),
+            tokens_per_minute=_share(self.tokens_per_minute, parts),
+        )
+
+
+def _share(limit: int | None, parts: int) -> int | None:
+    return None if limit is None else max(limit // parts, 1)
+
+
+def estimate_tokens(messages: list[dict]) -> int:
+    """
+    Rough token count of the messages before sending them: about one token per Japanese
+    character and per three or four ASCII characters. Corrected by the usage afterwards.
+    """
+
+    return sum(
+        len(str(message["content"]).encode("utf-8")) // 3 for message in messages
+    )
+
+
+class TokenBucket:
+    """
+    Refills `per_minute` units over a minute, up to a minute's worth. Reservations are
+    taken at once, going into debt if needed, and the caller waits until the debt is paid,
+    so callers are served in order at the allowed rate.
+    """
+
+    def __init__(self, per_minute: int, clock: Callable[[], float] = time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.clock = clock
+        self.level = self.capacity
+        self._updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Takes `amount` and returns the seconds to wait before using it.
+        """
+
+        self._refill()
+        self.level -= amount
+        if self.level >= 0:
+            return 0.0
+        return -self.level / self.rate
+
+    def refund(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Reservation:
+    def __init__(self, tokens: TokenBucket | None, amount: int):
+        self.tokens = tokens
+        self.amount = amount
+
+    def settle(self, used: int | None):
+        """
+        Corrects the token bucket with the tokens actually used, if known.
+        """
+
+        if self.tokens is not None and used is not None:
+            self.tokens.refund(self.amount - used)
+            self.amount = used
+
+
+class RateLimiter:
+    """
+    Client-side requests/min and tokens/min limits per API key and model, shared by every
+    agent call of the process, so bursts wait here instead of failing with 429.
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, RateLimit] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable] = asyncio.sleep,
+    ):
+        # model -> limit
+        self.limits = limits or {}
+        self.clock = clock
+        self.sleep = sleep
+        self._buckets: dict[tuple[str, str, str], TokenBucket] = {}
+
+    def _bucket(self, api_key: str, model: str, kind: str) -> TokenBucket | None:
+        limit = self.limits.get(model)
+        per_minute = None if limit is None else getattr(limit, f"{kind}_per_minute")
+        if per_minute is None:
+            return None
+        key = (digest(api_key), model, kind)
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(per_minute, clock=self.clock)
+        return self._buckets[key]
+
+    async def acquire(self, api_key: str, model: str, tokens: int) -> Reservation:
+        """
+        Waits until a request of about `tokens` tokens is allowed.
+        """
+
+        requests = self._bucket(api_key, model, "requests")
+        token_bucket = self._bucket(api_key, model, "tokens")
+        delays = [0.0]
+        if requests is not None:
+            delays.append(requests.reserve(1))
+        if token_bucket is not None:
+            delays.append(token_bucket.reserve(tokens))
+
+        reservation = Reservation(token_bucket, tokens)
+        try:
+            if max(delays) > 0:
+                await self.sleep(max(delays))
+        except asyncio.CancelledError:
+            # give the place back to the callers behind us
+            if requests is not None:
+                requests.refund(1)
+            reservation.settle(0)
+            raise
+        return reservation
@@ -0,0 +1,166 @@
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable
+
+from pydantic import BaseModel
+
+from .ratelimit import RateLimit, RateLimiter
+
+
+class ModelRoute(BaseModel):
+    model: str
+    max_tokens: int
+    # None: do not send the thinking option, 0: disable thinking
+    thinking_budget: int | None = None
+    # only used for inputs up to this many characters
+    max_input_chars: int | None = None
+    # tried after the other routes while its average latency (seconds) is above this
+    max_latency: float | None = None
+    # request timeout in seconds, then the next route is tried
+    timeout: float | None = None
+    # cache the document shared by the agents' prompts with the provider,
+    # None: if the provider supports it
+    context_caching: bool | None = None
+
+
+class RoutingConfig(BaseModel):
+    """
+    Models to use per agent (`blogger`, `writer`, `outline`, `section_writer`, `structure`),
+    in order of preference. Agents without routes use their class attributes.
+    """
+
+    routes: dict[str, list[ModelRoute]] = {}
+
+    # number of recent requests per model the statistics are computed over
+    window: int = 20
+    min_samples: int = 5
+    max_error_rate: float = 0.5
+    # seconds a model is skipped after it answered "rate limited"
+    rate_limit_cooldown: float = 60.0
+    # seconds a call waits in total for a model to cool down when every route is rate limited
+    max_rate_limit_wait: float = 120.0
+    # requests and tokens per minute allowed per API key and model, calls over them wait
+    rate_limits: dict[str, RateLimit] = {}
+
+    def share(self, parts: int) -> "RoutingConfig":
+        """
+        The config of each of `parts` processes, with `rate_limits` split between them.
+        """
+
+        return self.model_copy(
+            update={
+                "rate_limits": {
+                    model: limit.share(parts)
+                    for model, limit in self.rate_limits.items()
+                }
+            }
+        )
+
+    @classmethod
+    def load(cls, path: str | Path) -> "RoutingConfig":
+        return cls.model_validate_json(Path(path).read_text(encoding="utf-8"))
+
+
+class _ModelStats:
+    __slots__ = ("latencies", "outcomes", "cooldown_until")
+
+    def __init__(self, window: int):
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.cooldown_until = 0.0
+
+
+class Router:
+    """
+    Picks the model for each agent call from the input size and the rolling latency and
+    error rate observed per model.
+
+    `choose` returns every route that fits the input, healthy ones first, so callers fall
+    back to the next one when a request fails.
+    """
+
+    def __init__(
+        self,
+        config: RoutingConfig | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.config = config or RoutingConfig()
+        self.clock = clock
+        self._stats: dict[str, _ModelStats] = {}
+        self.limiter = RateLimiter(self.config.rate_limits)
+
+    def _get_stats(self, model: str) -> _ModelStats:
+        if model not in self._stats:
+            self._stats[model] = _ModelStats(self.config.window)
+        return self._stats[model]
+
+    def error_rate(self, model: str) -> float:
+        stats = self._get_stats(model)
+        if len(stats.outcomes) < self.config.min_samples:
+            return 0.0
+        return stats.outcomes.count(False) / len(stats.outcomes)
+
+    def latency(self, model: str) -> float | None:
+        stats = self._get_stats(model)
+        if len(stats.latencies) == 0:
+            return None
+        return sum(stats.latencies) / len(stats.latencies)
+
+    def is_healthy(self, route: ModelRoute) -> bool:
+        stats = self._get_stats(route.model)
+        if stats.cooldown_until > self.clock():
+            return False
+        if self.error_rate(route.model) > self.config.max_error_rate:
+            return False
+        latency = self.latency(route.model)
+        if route.max_latency is not None and latency is not None:
+            return latency <= route.max_latency
+        return True
+
+    def cooldown(self, model: str) -> float:
+        """
+        Seconds until the model is tried again after it was rate limited, 0 if it is not.
+        """
+
+        return max(self._get_stats(model).cooldown_until - self.clock(), 0.0)
+
+    def choose(self, name: str, input_chars: int) -> list[ModelRoute]:
+        routes = self.config.routes.get(name, [])
+        fitting = [
+            route
+            for route in routes
+            if route.max_input_chars is None or input_chars <= route.max_input_chars
+        ]
+        if len(fitting) == 0:
+            # too large for every limit, the last route is the most capable
+            fitting = routes[-1:]
+
+        healthy = [route for route in fitting if self.is_healthy(route)]
+        return healthy + [route for route in fitting if route not in healthy]
+
+    def record(
+        self,
+        model: str,
+        latency: float,
+        error: Exception | None = None,
+        rate_limited: bool = False,
+    ):
+        stats = self._get_stats(model)
+        stats.outcomes.append(error is None)
+        if error is None:
+            stats.latencies.append(latency)
+        if rate_limited:
+            stats.cooldown_until = self.clock() + self.config.rate_limit_cooldown
+
+    def stats(self) -> dict:
+        now = self.clock()
+        return {
+            model: {
+                "requests": len(stats.outcomes),
+                "error_rate": self.error_rate(model),
+                "latency": self.latency(model),
+                "cooling_down": stats.cooldown_until > now,
+            }
+            for model, stats in self._stats.items()
+        }
@@ -0,0 +1,240 @@
+import asyncio
+import contextlib
+import contextvars
+import itertools
+from enum import IntEnum
+from typing import AsyncIterator, Callable, Iterator
+
+
+class Priority(IntEnum):
+    """
+    Lower value is served first.
+    """
+
+    PREVIEW = 0
+    RERECORD = 1
+    GENERATE = 2
+
+
+PositionCallback = Callable[[int], None]
+
+
+class SchedulerContext:
+    """
+    Who is asking for resources: set once per request with `Scheduler.context`.
+    """
+
+    def __init__(
+        self,
+        session: str,
+        priority: Priority,
+        on_position: PositionCallback | None = None,
+    ):
+        self.session = session
+        self.priority = priority
+        self.on_position = on_position
+
+        # 1-based queue position last reported, 0 when not waiting
+        self.position = 0
+
+
+DEFAULT_CONTEXT = SchedulerContext(session="default", priority=Priority.GENERATE)
+
+_current_context: contextvars.ContextVar[SchedulerContext] = contextvars.ContextVar(
+    "scheduler_context", default=DEFAULT_CONTEXT
+)
+
+
+class _Waiter:
+    __slots__ = ("resource", "context", "memory", "seq", "future")
+
+    def __init__(
+        self,
+        resource: str,
+        context: SchedulerContext,
+        memory: int,
+        seq: int,
+        future: asyncio.Future,
+    ):
+        self.resource = resource
+        self.context = context
+        self.memory = memory
+        self.seq = seq
+        self.future = future
+
+
+class Scheduler:
+    """
+    Admission control shared by every user of the process.
+
+    Each resource (e.g. `engine`, `llm`) has a global concurrency limit. Waiters are served by
+    priority class first, then by fair share (the session holding the fewest slots of that resource
+    goes next), then in arrival order. Slots may also reserve bytes of a global in-flight
+    memory budget for the audio they produce. The bytes are returned when the slot exits, so
+    the budget bounds the audio being synthesized at once, not the audio callers keep
+    afterwards.
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, int],
+        inflight_memory_budget: int = 1024**3,
+    ):
+        self.limits = limits
+        self.inflight_memory_budget = inflight_memory_budget
+
+        self._active: dict[str, int] = {resource: 0 for resource in limits}
+        self._active_by_session: dict[tuple[str, str], int] = {}
+        self._inflight_memory = 0
+        self._waiters: dict[str, list[_Waiter]] = {resource: [] for resource in limits}
+        self._seq = itertools.count()
+        self._queued_contexts: list[SchedulerContext] = []
+
+    @contextlib.contextmanager
+    def context(
+        self,
+        session: str,
+        priority: Priority,
+        on_position: PositionCallback | None = None,
+    ) -> Iterator[SchedulerContext]:
+        """
+        Sets the session and priority used by `slot` calls made inside this block.
+        """
+
+        context = SchedulerContext(session, priority, on_position)
+        token = _current_context.set(context)
+        try:
+            yield context
+        finally:
+            _current_context.reset(token)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, resource: str, memory: int = 0) -> AsyncIterator[None]:
+        """
+        Waits for a slot of `resource` (and `memory` bytes of the in-flight budget) and holds
+        it for the block.
+        """
+
+        if resource not in self.limits:
+            raise KeyError(f"Unknown resource: {resource}")
+
+        context = _current_context.get()
+        memory = min(memory, self.inflight_memory_budget)
+        waiter = _Waiter(
+            resource=resource,
+            context=context,
+            memory=memory,
+            seq=next(self._seq),
+            future=asyncio.get_running_loop().create_future(),
+        )
+        self._waiters[resource].append(waiter)
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # granted at the same time as cancelled
+                self._release(waiter)
+            elif waiter in self._waiters[resource]:
+                self._waiters[resource].remove(waiter)
+                self._dispatch()
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+    def _sort_key(self, waiter: _Waiter) -> tuple[int, int, int]:
+        return (
+            waiter.context.priority,
+            self._active_by_session.get((waiter.resource, waiter.context.session), 0),
+            waiter.seq,
+        )
+
+    def _grant(self, waiter: _Waiter):
+        key = (waiter.resource, waiter.context.session)
+        self._active[waiter.resource] += 1
+        self._active_by_session[key] = self._active_by_session.get(key, 0) + 1
+        self._inflight_memory += waiter.memory
+        waiter.future.set_result(None)
+
+    def _release(self, waiter: _Waiter):
+        key = (waiter.resource, waiter.context.session)
+        self._active[waiter.resource] -= 1
+        self._active_by_session[key] -= 1
+        if self._active_by_session[key] == 0:
+            del self._active_by_session[key]
+        self._inflight_memory -= waiter.memory
+        self._dispatch()
+
+    def _dispatch(self):
+        for resource, waiters in self._waiters.items():
+            # drop waiters cancelled before they could clean up after themselves
+            waiters[:] = [waiter for waiter in waiters if not waiter.future.done()]
+            while waiters and self._active[resource] < self.limits[resource]:
+                waiter = min(waiters, key=self._sort_key)
+                if self._inflight_memory + waiter.memory > self.inflight_memory_budget:
+                    # keep the order; wait for audio to be released
+                    break
+                waiters.remove(waiter)
+                self._grant(waiter)
+
+        self._notify_positions()
+
+    def _notify_positions(self):
+        # only contexts with a callback are told their position; most waiters have none
+        # (e.g. the jobs of a worker), and resources without one are not sorted at all
+        watched = {id(context) for context in self._queued_contexts}
+        positions: dict[int, tuple[SchedulerContext, int]] = {}
+        for waiters in self._waiters.values():
+            if not any(
+                waiter.context.on_position is not None or id(waiter.context) in watched
+                for waiter in waiters
+            ):
+                continue
+            for position, waiter in enumerate(sorted(waiters, key=self._sort_key), 1):
+                context = waiter.context
+                if context.on_position is None:
+                    continue
+                if id(context) not in positions or position < positions[id(context)][1]:
+                    positions[id(context)] = (context, position)
+
+        # contexts that were waiting and have been admitted since
+        for context in self._queued_contexts:
+            if id(context) not in positions:
+                positions[id(context)] = (context, 0)
+
+        self._queued_contexts = []
+        for context, position in positions.values():
+            if position > 0:
+                self._queued_contexts.append(context)
+            if context.position == position:
+                continue
+            context.position = position
+            if context.on_position is not None:
+                context.on_position(position)
+
+    def position(self, session: str) -> int | None:
+        """
+        1-based queue position of the session's most advanced waiter, or None if it is not waiting.
+        """
+
+        positions = [
+            position + 1
+            for waiters in self._waiters.values()
+            for position, waiter in enumerate(sorted(waiters, key=self._sort_key))
+            if waiter.context.session == session
+        ]
+        return min(positions) if positions else None
+
+    def stats(self) -> dict:
+        return {
+            "active": dict(self._active),
+            "waiting": {
+                resource: len(waiters) for resource, waiters in self._waiters.items()
+            },
+            "inflight_memory": self._inflight_memory,
+            "inflight_memory_budget": self.inflight_memory_budget,
+        }
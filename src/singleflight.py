@@ -0,0 +1,68 @@
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+def digest(*parts: str | bytes) -> str:
+    """
+    SHA-256 of the parts, used to key work on large inputs (documents, prompts).
+    """
+
+    hasher = hashlib.sha256()
+    for part in parts:
+        data = part.encode("utf-8") if isinstance(part, str) else part
+        # length prefix, so ("ab", "c") and ("a", "bc") differ
+        hasher.update(len(data).to_bytes(8, "little"))
+        hasher.update(data)
+    return hasher.hexdigest()
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Runs identical concurrent work once.
+
+    Callers asking for the same key while a call is in flight wait on the same task and get
+    its result (or its exception). A caller that is cancelled only stops waiting; the shared
+    call is cancelled when the last caller leaves. Results are not kept after the call ends.
+
+    The call runs in the context of the first caller, so scheduler slots are charged to it.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done():
+                # we were cancelled, not the shared call
+                call.waiters -= 1
+                if call.waiters == 0:
+                    self._forget(key, call)
+                    call.task.cancel()
+            raise
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+
+class AudioStore:
+    """
+    Content-addressed store for rendered audio files.
+
+    Files are named by the SHA-256 of their content, so identical audio is written only once.
+    Writes are atomic (temporary file + rename), and the store is kept under `max_bytes`
+    by evicting the least recently used files. Files not accessed for `ttl` seconds are removed as well.
+
+    `pinned` returns the names of files that are never evicted, e.g. the ones job artifacts
+    refer to: the directory is shared between processes that each only know their own
+    accesses.
+    """
+
+    def __init__(
+        self,
+        root: str | Path,
+        max_bytes: int = 2 * 1024**3,
+        ttl: float | None = 24 * 60 * 60,
+        suffix: str = ".wav",
+        pinned: Callable[[], set[str]] | None = None,
+    ):
+        self.root = Path(root).resolve()
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.suffix = suffix
+        self.pinned = pinned
+
+        # name -> (size, last access), oldest first
+        self._entries: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._scan()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _scan(self):
+        entries = []
+        for path in self.root.iterdir():
+            if path.name.startswith(".tmp-"):
+                # leftover from an interrupted write
+                path.unlink(missing_ok=True)
+                continue
+            if not path.is_file() or path.suffix != self.suffix:
+                continue
+            stat = path.stat()
+            entries.append((stat.st_mtime, path.name, stat.st_size))
+
+        for mtime, name, size in sorted(entries):
+            self._entries[name] = (size, mtime)
+            self._total_bytes += size
+
+        with self._lock:
+            self._evict()
+
+    def _remove(self, name: str):
+        size, _ = self._entries.pop(name)
+        self._total_bytes -= size
+        (self.root / name).unlink(missing_ok=True)
+
+    def _evict(self, keep: str | None = None):
+        expired = []
+        if self.ttl is not None:
+            deadline = time.time() - self.ttl
+            for name, (_size, accessed) in self._entries.items():
+                if accessed >= deadline:
+                    break
+                expired.append(name)
+        if len(expired) == 0 and self._total_bytes <= self.max_bytes:
+            return
+
+        # asked only when something has to go
+        kept = {keep} | (self.pinned() if self.pinned is not None else set())
+        for name in expired:
+            if name not in kept:
+                self._remove(name)
+
+        for name in list(self._entries.keys()):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if name not in kept:
+                self._remove(name)
+
+    def _touch(self, name: str):
+        size, _ = self._entries[name]
+        self._entries[name] = (size, time.time())
+        self._entries.move_to_end(name)
+
+    def path_for(self, digest: str) -> Path:
+        return self.root / f"{digest}{self.suffix}"
+
+    def put(self, data: bytes | bytearray | memoryview) -> str:
+        """
+        Stores `data` and returns the path of the file holding it.
+        """
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest)
+
+        with self._lock:
+            if path.name in self._entries and path.exists():
+                self._touch(path.name)
+                os.utime(path)
+                return str(path)
+
+        fd, temp_path = tempfile.mkstemp(prefix=".tmp-", dir=self.root)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            if path.name in self._entries:
+                self._touch(path.name)
+            else:
+                self._entries[path.name] = (len(data), time.time())
+                self._total_bytes += len(data)
+            self._evict(keep=path.name)
+
+        return str(path)
+
+    def get(self, path: str | Path) -> str | None:
+        """
+        Returns the path if it is still in the store and marks it as recently used.
+        """
+
+        name = Path(path).name
+        with self._lock:
+            if name not in self._entries:
+                # written by another process sharing the directory
+                if not name.endswith(self.suffix) or not (self.root / name).is_file():
+                    return None
+                size = (self.root / name).stat().st_size
+                self._entries[name] = (size, time.time())
+                self._total_bytes += size
+            if not (self.root / name).exists():
+                self._remove(name)
+                return None
+            self._touch(name)
+        return str(self.root / name)
+
+    def remove(self, path: str | Path):
+        """
+        Deletes a file from the store, e.g. the segments of a cancelled job.
+        """
+
+        name = Path(path).name
+        with self._lock:
+            if name in self._entries:
+                self._remove(name)
+
+    def evict(self):
+        with self._lock:
+            self._evict()
@@ -1,11 +1,60 @@
 import aiohttp
-from typing import Literal
+import asyncio
+import orjson
+from typing import Generic, Literal, TypeVar
 from pydantic import BaseModel
-import io
 import base64
+import io
+import zipfile
+
+from .audio import Audio
 
 SpeakerId = int
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# (endpoint, path) -> whether the engine has the optional API, learned on the first request
+_endpoint_support: dict[tuple[str, str], bool] = {}
+
+# what engines answer for APIs they lack (or have disabled, like /cancellable_synthesis)
+UNSUPPORTED_STATUSES = (404, 405, 501)
+
+
+class UnsupportedEndpoint(Exception):
+    """
+    The engine does not implement the endpoint.
+    """
+
+
+class EngineUnavailable(Exception):
+    """
+    The engine could not be reached, or cannot synthesize with the requested styles.
+    """
+
+
+class EngineCapabilities(BaseModel):
+    """
+    What an engine supports, probed once per endpoint.
+    """
+
+    endpoint: str
+    version: str
+    core_versions: list[str]
+    # paths in the engine's OpenAPI schema, empty if it does not serve one
+    paths: list[str] = []
+    # AivisSpeech's AudioQuery has `tempoDynamicsScale`, VOICEVOX's does not.
+    # None if the schema is unavailable.
+    tempo_dynamics: bool | None = None
+
+    def supports(self, path: str) -> bool | None:
+        if len(self.paths) == 0:
+            return None
+        return path in self.paths
+
+
+# endpoint -> capabilities, filled by `VoiceVoxClient.probe`
+_capabilities: dict[str, EngineCapabilities] = {}
+
 
 class SpeakerStyle(BaseModel):
     name: str
@@ -20,39 +69,207 @@ class Speaker(BaseModel):
     version: str
 
 
-class AudioQuery(BaseModel):
-    accent_phrases: list[dict]
-    speedScale: float
-    intonationScale: float
-    tempoDynamicsScale: float | None = None
-    pitchScale: float
-    volumeScale: float
-    prePhonemeLength: float
-    postPhonemeLength: float
-    pauseLength: float | None
-    pauseLengthScale: float
-    outputSamplingRate: int
-    outputStereo: bool
-    kana: str
+T = TypeVar("T")
+
+_MISSING = object()
+
+
+class _Field(Generic[T]):
+    """
+    Typed access to one top-level field of the audio query JSON.
+    """
+
+    def __init__(self, default: T | object = _MISSING):
+        self.default = default
+
+    def __set_name__(self, owner: type, name: str):
+        self.name = name
+
+    def __get__(self, obj: "AudioQuery", owner: type) -> T:
+        if self.default is _MISSING:
+            return obj.data[self.name]
+        return obj.data.get(self.name, self.default)
+
+    def __set__(self, obj: "AudioQuery", value: T):
+        obj.data[self.name] = value
+
 
+class AudioQuery:
+    """
+    Audio query as returned by the engine.
 
-class Audio(BaseModel):
-    wav: bytes
+    The JSON is kept as is and only parsed when a field is read, so `accent_phrases` is
+    never validated and unknown fields (and fields this engine does not have, like
+    `tempoDynamicsScale` or `pauseLength`) pass through to `/synthesis` unchanged.
+    """
+
+    __slots__ = ("_data", "_raw")
+
+    accent_phrases = _Field[list[dict]]()
+    speedScale = _Field[float]()
+    intonationScale = _Field[float]()
+    tempoDynamicsScale = _Field[float | None](None)
+    pitchScale = _Field[float]()
+    volumeScale = _Field[float]()
+    prePhonemeLength = _Field[float]()
+    postPhonemeLength = _Field[float]()
+    pauseLength = _Field[float | None](None)
+    pauseLengthScale = _Field[float](1.0)
+    outputSamplingRate = _Field[int]()
+    outputStereo = _Field[bool]()
+    kana = _Field[str]("")
+
+    def __init__(self, raw: bytes | None = None, data: dict | None = None):
+        if raw is None and data is None:
+            raise ValueError("Either raw or data is required")
+        self._raw = raw
+        self._data = data
+
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            assert self._raw is not None
+            self._data = orjson.loads(self._raw)
+            # the dict may be modified from now on
+            self._raw = None
+        return self._data
+
+    def to_json(self) -> bytes:
+        if self._raw is not None:
+            return self._raw
+        return orjson.dumps(self._data)
+
+    def model_dump(self) -> dict:
+        return self.data
 
 
 class VoiceVoxClient:
     endpoint: str
 
-    def __init__(self, endpoint: str = "http://127.0.0.1:50021"):
+    def __init__(
+        self,
+        endpoint: str = "http://127.0.0.1:50021",
+        cancellable: bool = False,
+    ):
         self.endpoint = endpoint
+        # use /cancellable_synthesis where enabled, so the engine stops when we hang up
+        self.cancellable = cancellable
+
+    def supports(self, path: str) -> bool | None:
+        """
+        Whether the engine has the optional `path`, or None if not known yet.
+        """
+
+        return _endpoint_support.get((self.endpoint, path))
+
+    def _mark_support(self, path: str, supported: bool):
+        _endpoint_support[(self.endpoint, path)] = supported
+
+    @property
+    def supports_multi_synthesis(self) -> bool | None:
+        return self.supports("/multi_synthesis")
+
+    @property
+    def capabilities(self) -> EngineCapabilities | None:
+        return _capabilities.get(self.endpoint)
+
+    async def probe(self, refresh: bool = False) -> EngineCapabilities:
+        """
+        Checks that the engine is up and learns what it supports. The result is cached per
+        endpoint. Raises `EngineUnavailable` if the engine does not answer.
+        """
+
+        if not refresh and self.endpoint in _capabilities:
+            return _capabilities[self.endpoint]
+
+        async def _get(session: aiohttp.ClientSession, path: str):
+            async with session.get(f"{self.endpoint}{path}") as response:
+                if response.status != 200:
+                    return None
+                return orjson.loads(await response.read())
+
+        try:
+            async with aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=10)
+            ) as session:
+                version, core_versions, schema = await asyncio.gather(
+                    _get(session, "/version"),
+                    _get(session, "/core_versions"),
+                    _get(session, "/openapi.json"),
+                )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise EngineUnavailable(f"{self.endpoint} is not reachable: {e!r}") from e
+        if version is None:
+            raise EngineUnavailable(f"{self.endpoint} did not answer /version")
+
+        capabilities = EngineCapabilities(
+            endpoint=self.endpoint,
+            version=str(version),
+            core_versions=core_versions or [],
+        )
+        if schema is not None:
+            capabilities.paths = sorted(schema.get("paths", {}))
+            audio_query = (
+                schema.get("components", {}).get("schemas", {}).get("AudioQuery", {})
+            )
+            capabilities.tempo_dynamics = "tempoDynamicsScale" in audio_query.get(
+                "properties", {}
+            )
+            # /cancellable_synthesis is in the schema even when disabled, learn it later
+            for path in ("/multi_synthesis", "/initialize_speaker"):
+                self._mark_support(path, capabilities.supports(path) is True)
+
+        _capabilities[self.endpoint] = capabilities
+        return capabilities
+
+    async def preflight(self, speakers: list[SpeakerId]) -> EngineCapabilities:
+        """
+        Probes the engine and checks that it has the style ids, so a job fails before it
+        spends time on the LLM.
+        """
+
+        capabilities = await self.probe(refresh=True)
+        try:
+            engine_speakers = await asyncio.wait_for(self.get_speakers(), timeout=10)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise EngineUnavailable(f"{self.endpoint} is not reachable: {e!r}") from e
+        styles = {style.id for speaker in engine_speakers for style in speaker.styles}
+        missing = [speaker for speaker in speakers if speaker not in styles]
+        if len(missing) > 0:
+            raise EngineUnavailable(
+                f"{self.endpoint} has no style {', '.join(map(str, missing))}"
+            )
+        return capabilities
+
+    async def initialize_speaker(self, speaker: SpeakerId):
+        """
+        Loads the style's model, so the first line does not wait for it. Does nothing on
+        engines without `/initialize_speaker`.
+        """
+
+        if self.supports("/initialize_speaker") is False:
+            return
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                f"{self.endpoint}/initialize_speaker",
+                params={"speaker": speaker, "skip_reinit": "true"},
+            ) as response:
+                if response.status in UNSUPPORTED_STATUSES:
+                    self._mark_support("/initialize_speaker", False)
+                    return
+                if response.status not in (200, 204):
+                    raise Exception(f"Failed to initialize speaker: {response.status}")
 
     async def get_speakers(self) -> list[Speaker]:
         async with aiohttp.ClientSession() as session:
             async with session.get(f"{self.endpoint}/speakers") as response:
                 if response.status != 200:
-                    raise Exception(f"Failed to get speakers: {response.status}")
+                    raise EngineUnavailable(
+                        f"Failed to get speakers from {self.endpoint}: {response.status}"
+                    )
                 return [
-                    Speaker.model_validate(speaker) for speaker in await response.json()
+                    Speaker.model_validate(speaker)
+                    for speaker in orjson.loads(await response.read())
                 ]
 
     async def get_core_versions(self) -> list[str]:
@@ -60,7 +277,7 @@ class VoiceVoxClient:
             async with session.get(f"{self.endpoint}/core_versions") as response:
                 if response.status != 200:
                     raise Exception(f"Failed to get core version: {response.status}")
-                return await response.json()
+                return orjson.loads(await response.read())
 
     async def post_audio_query(
         self,
@@ -78,8 +295,7 @@ class VoiceVoxClient:
             ) as res:
                 if res.status != 200:
                     raise Exception(f"Failed to post audio query: {res.status}")
-                json_data = await res.json()
-                return AudioQuery.model_validate(json_data)
+                return AudioQuery(await res.read())
 
     async def post_synthesis(
         self,
@@ -88,6 +304,10 @@ class VoiceVoxClient:
         enable_interrogative_upspeak: bool = True,
         core_version: str | None = None,
     ) -> Audio:
+        path = "/synthesis"
+        if self.cancellable and self.supports("/cancellable_synthesis") is not False:
+            path = "/cancellable_synthesis"
+
         async with aiohttp.ClientSession() as session:
             params: dict[str, str | int | float] = {
                 "speaker": speaker,
@@ -98,14 +318,25 @@ class VoiceVoxClient:
             if core_version:
                 params["core_version"] = core_version
             async with session.post(
-                f"{self.endpoint}/synthesis",
+                f"{self.endpoint}{path}",
                 params=params,
-                json=audio_query.model_dump(),
+                data=audio_query.to_json(),
+                headers=JSON_HEADERS,
             ) as response:
+                if path != "/synthesis":
+                    if response.status in UNSUPPORTED_STATUSES:
+                        # not enabled on this engine, use the plain endpoint from now on
+                        self._mark_support(path, False)
+                        return await self.post_synthesis(
+                            speaker=speaker,
+                            audio_query=audio_query,
+                            enable_interrogative_upspeak=enable_interrogative_upspeak,
+                            core_version=core_version,
+                        )
+                    self._mark_support(path, True)
                 if response.status != 200:
                     raise Exception(f"Failed to post synthesis: {response.status}")
-                wav = io.BytesIO(await response.read())
-                return Audio(wav=wav.getvalue())
+                return Audio(await response.read())
 
     async def post_connect_waves(
         self,
@@ -117,9 +348,57 @@ class VoiceVoxClient:
             ]
             async with session.post(
                 f"{self.endpoint}/connect_waves",
-                json=audio_data,
+                data=orjson.dumps(audio_data),
+                headers=JSON_HEADERS,
             ) as response:
                 if response.status != 200:
                     raise Exception(f"Failed to connect waves: {response.status}")
-                wav = io.BytesIO(await response.read())
-                return Audio(wav=wav.getvalue())
+                return Audio(await response.read())
+
+    async def post_multi_synthesis(
+        self,
+        speaker: SpeakerId,
+        audio_queries: list[AudioQuery],
+        core_version: str | None = None,
+    ) -> list[Audio]:
+        """
+        Synthesizes several queries in one request. Raises `UnsupportedEndpoint` if the
+        engine does not have `/multi_synthesis`.
+        """
+
+        if self.supports_multi_synthesis is False:
+            raise UnsupportedEndpoint(f"{self.endpoint} has no /multi_synthesis")
+
+        async with aiohttp.ClientSession() as session:
+            params: dict[str, str | int | float] = {"speaker": speaker}
+            if core_version:
+                params["core_version"] = core_version
+            async with session.post(
+                f"{self.endpoint}/multi_synthesis",
+                params=params,
+                # the raw queries, joined without parsing them
+                data=b"["
+                + b",".join(query.to_json() for query in audio_queries)
+                + b"]",
+                headers=JSON_HEADERS,
+            ) as response:
+                if response.status in UNSUPPORTED_STATUSES:
+                    self._mark_support("/multi_synthesis", False)
+                    raise UnsupportedEndpoint(
+                        f"{self.endpoint} has no /multi_synthesis"
+                    )
+                if response.status != 200:
+                    raise Exception(
+                        f"Failed to post multi synthesis: {response.status}"
+                    )
+                self._mark_support("/multi_synthesis", True)
+                data = await response.read()
+
+        # a zip of 001.wav, 002.wav, ... in the order of the queries
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            audios = [Audio(archive.read(name)) for name in sorted(archive.namelist())]
+        if len(audios) != len(audio_queries):
+            raise Exception(
+                f"Expected {len(audio_queries)} files from multi synthesis, got {len(audios)}"
+            )
+        return audios
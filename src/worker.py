@@ -0,0 +1,677 @@
+import asyncio
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+
+from .agent import Conversation
+from .audio import Audio
+from .context_cache import PromptStats, collect_prompt_stats
+from .fetcher import AutoFetcher
+from .jobqueue import Job, JobQueue, LeaseLost
+from .mastering import PodcastIndex
+from .podcast import PodcastStudio
+from .profiling import JobProfiler
+from .progress import STAGES, ProgressEvent, StageStats
+from .routing import Router, RoutingConfig
+from .scheduler import Scheduler
+from .singleflight import SingleFlight
+from .storage import AudioStore
+from .voicevox import VoiceVoxClient
+
+
+class Worker:
+    """
+    Claims jobs from the `JobQueue` and runs up to `max_jobs` of them at once with
+    `PodcastStudio`. The jobs share the scheduler, and identical work in concurrent jobs
+    (same URL, same LLM request, same line) runs only once.
+
+    While a job runs, its lease is renewed every `lease / 3` seconds and ownership is checked
+    every `cancel_poll` seconds. If the job was cancelled (or another worker took it over
+    after we stalled), it is abandoned at once: pending lines are dropped, requests to the
+    engine are aborted and the audio it wrote is deleted.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        audio_store: AudioStore,
+        api_key: str,
+        voicevox_endpoint: str,
+        scheduler: Scheduler | None = None,
+        lease: float = 30.0,
+        poll_interval: float = 1.0,
+        name: str | None = None,
+        max_jobs: int = 4,
+        studio_options: dict | None = None,
+        cancel_poll: float = 1.0,
+        router: Router | None = None,
+    ):
+        self.queue = queue
+        self.audio_store = audio_store
+        self.voicevox_endpoint = voicevox_endpoint
+        self.scheduler = scheduler
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_jobs = max_jobs
+        # extra `PodcastStudio` arguments, e.g. `synthesis_batch_size`
+        self.studio_options = studio_options or {}
+        self.cancel_poll = cancel_poll
+        self.name = (
+            name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        )
+
+        self.flights = SingleFlight()
+        self.router = router or Router()
+        self.fetcher = AutoFetcher(flights=self.flights)
+        # how long each stage took in recent jobs, for the ETA shown to users
+        self.stage_stats = StageStats()
+        self.studio = self._create_studio(api_key)
+        self.logger = logging.getLogger(__name__)
+
+        self._stopping = False
+        # job id -> audio files written for it, deleted if the job is cancelled
+        self._written: dict[str, set[str]] = {}
+        # job id -> profiler of the jobs submitted with `profile`
+        self._profilers: dict[str, JobProfiler] = {}
+        # job id -> blog still being written for a `fast` job, cancelled with the job
+        self._blogs: dict[str, asyncio.Task[str]] = {}
+
+    def _create_studio(self, api_key: str) -> PodcastStudio:
+        return PodcastStudio(
+            api_key=api_key,
+            scheduler=self.scheduler,
+            flights=self.flights,
+            router=self.router,
+            fetcher=self.fetcher,
+            **self.studio_options,
+        )
+
+    def stop(self):
+        self._stopping = True
+
+    async def run(self):
+        self.logger.info(f"Worker {self.name} started.")
+        running: set[asyncio.Task] = set()
+        try:
+            while not self._stopping:
+                if len(running) >= self.max_jobs:
+                    await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                job = await asyncio.to_thread(self.queue.claim, self.name, self.lease)
+                if job is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                task = asyncio.create_task(self.run_job(job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            await asyncio.gather(*running)
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+        self.logger.info(f"Worker {self.name} stopped.")
+
+    def _job_context(self, job: Job):
+        if self.scheduler is None:
+            return contextlib.nullcontext()
+        return self.scheduler.context(job.id, job.request.priority)
+
+    async def run_job(self, job: Job):
+        self.logger.info(f"Running job {job.id} ({job.request.kind}).")
+        if job.request.profile:
+            profiler = JobProfiler()
+            profiler.start()
+            self._profilers[job.id] = profiler
+        with self._job_context(job):
+            task = asyncio.create_task(self._execute(job))
+        heartbeat = asyncio.create_task(self._heartbeat(job, task))
+        try:
+            await task
+        except LeaseLost:
+            self.logger.warning(f"Lost the lease of job {job.id}.")
+            await self._discard(job)
+        except asyncio.CancelledError:
+            if not heartbeat.done() or heartbeat.cancelled():
+                # we are shutting down: give the job back
+                try:
+                    await asyncio.to_thread(
+                        self.queue.release, job.id, self.name, job.api_key
+                    )
+                except LeaseLost:
+                    pass
+                raise
+            self.logger.warning(f"Job {job.id} was cancelled or taken over.")
+            await self._discard(job)
+        except Exception as e:
+            self.logger.exception(f"Job {job.id} failed.")
+            try:
+                # slow jobs that end up failing are worth a look too
+                await self._save_profile(job)
+                await asyncio.to_thread(
+                    self.queue.finish, job.id, self.name, "failed", repr(e)
+                )
+            except LeaseLost:
+                pass
+        finally:
+            heartbeat.cancel()
+            self._written.pop(job.id, None)
+            profiler = self._profilers.pop(job.id, None)
+            if profiler is not None:
+                profiler.stop()
+            blog = self._blogs.pop(job.id, None)
+            if blog is not None:
+                blog.cancel()
+
+    async def _discard(self, job: Job):
+        """
+        Deletes the audio written for a cancelled job, unless another job uses it too.
+        """
+
+        job_now = await asyncio.to_thread(self.queue.get, job.id)
+        if job_now is None or job_now.status != "cancelled":
+            # taken over by another worker, which keeps the artifacts
+            return
+        paths = list(self._written.get(job.id, ()))
+        paths += await asyncio.to_thread(self.queue.discard_artifacts, job.id)
+        for path in await asyncio.to_thread(self.queue.unreferenced, paths):
+            self.audio_store.remove(path)
+
+    async def _heartbeat(self, job: Job, task: asyncio.Task):
+        renewed = time.monotonic()
+        while True:
+            await asyncio.sleep(min(self.cancel_poll, self.lease / 3))
+            try:
+                if time.monotonic() - renewed >= self.lease / 3:
+                    await asyncio.to_thread(
+                        self.queue.heartbeat, job.id, self.name, self.lease
+                    )
+                    renewed = time.monotonic()
+                else:
+                    await asyncio.to_thread(self.queue.check, job.id, self.name)
+            except LeaseLost:
+                task.cancel()
+                return
+
+    async def _update(self, job: Job, event: str, data: dict, **fields):
+        await asyncio.to_thread(
+            self.queue.update, job.id, self.name, event, data, **fields
+        )
+
+    async def _put_text(self, job: Job, name: str, text: str | bytes):
+        await asyncio.to_thread(
+            self.queue.put_artifact, job.id, self.name, name, text=text
+        )
+
+    async def _save_prompts(self, job: Job, prompt_stats: PromptStats):
+        prompts = prompt_stats.summary()
+        self.logger.info(
+            f"Job {job.id}: {len(prompts['calls'])} LLM calls, "
+            f"{prompts['prompt_tokens']} prompt tokens, "
+            f"{prompts['tokens_saved']} saved by caching and condensing."
+        )
+        await self._put_text(job, "prompts.json", json.dumps(prompts, indent=2))
+
+    async def _save_profile(self, job: Job):
+        """
+        Stops the profiler of the job, if any, and saves its results as artifacts.
+        """
+
+        profiler = self._profilers.pop(job.id, None)
+        if profiler is None:
+            return
+        report = profiler.stop()
+        stats = profiler.pstats()
+        if stats is not None:
+            # kept with the job in the queue, the audio store is for audio only
+            await self._put_text(job, "profile.pstats", stats)
+        await self._put_text(job, "profile.collapsed", profiler.collapsed())
+        await self._put_text(job, "profile.json", report.model_dump_json(indent=2))
+
+    async def _load_base(
+        self, job: Job
+    ) -> tuple[Conversation, Audio, PodcastIndex, list[str | None]] | None:
+        """
+        The rendering of `base_job` that `job` edits, or None if it cannot be reused (other
+        speakers or engine, lines added, removed or swapped, or its audio is gone).
+        """
+
+        request = job.request
+        assert request.base_job is not None and request.conversation is not None
+        base = await asyncio.to_thread(self.queue.get, request.base_job)
+        if (
+            base is None
+            or base.status != "succeeded"
+            or base.request.speaker_id != request.speaker_id
+            or base.request.supporter_id != request.supporter_id
+            or base.request.voicevox_endpoint != request.voicevox_endpoint
+        ):
+            return None
+
+        def _artifact(name: str) -> tuple[str | None, str | None]:
+            artifact = self.queue.artifact(request.base_job, name)
+            return artifact if artifact is not None else (None, None)
+
+        conversation_json, _ = await asyncio.to_thread(_artifact, "conversation.json")
+        index_json, _ = await asyncio.to_thread(_artifact, "podcast.index.json")
+        _, podcast_path = await asyncio.to_thread(_artifact, "podcast.wav")
+        if conversation_json is None or index_json is None or podcast_path is None:
+            return None
+        conversation = Conversation.model_validate_json(conversation_json)
+        roles = [dialogue.role for dialogue in conversation.conversation]
+        if roles != [dialogue.role for dialogue in request.conversation.conversation]:
+            return None
+        local_path = self.audio_store.get(podcast_path)
+        if local_path is None:
+            return None
+
+        segments = [
+            (await asyncio.to_thread(_artifact, f"segments/{i}"))[1]
+            for i in range(len(roles))
+        ]
+        return (
+            conversation,
+            Audio.from_file(local_path),
+            PodcastIndex.model_validate_json(index_json),
+            segments,
+        )
+
+    async def _execute(self, job: Job):
+        started = time.monotonic()
+        request = job.request
+        studio = self._create_studio(job.api_key) if job.api_key else self.studio
+        voicevox_client = VoiceVoxClient(
+            request.voicevox_endpoint or self.voicevox_endpoint,
+            cancellable=True,
+        )
+        pending: set[asyncio.Task] = set()
+        written = self._written.setdefault(job.id, set())
+        if request.kind == "record":
+            stages = STAGES[-1:]
+        elif request.mode == "fast":
+            # the blog is written alongside the script, the ETA does not wait for it
+            stages = [stage for stage in STAGES if stage != "blog"]
+        else:
+            stages = STAGES
+        eta: float | None = None
+        # progress events are written one at a time, in order
+        progress_lock = asyncio.Lock()
+
+        def _background(coro):
+            task = asyncio.create_task(coro)
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            # LeaseLost after a cancel is handled by the heartbeat, not here
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+        async def _write_progress(data: dict, **fields):
+            async with progress_lock:
+                await self._update(job, "progress", data, **fields)
+
+        def _on_progress(event: ProgressEvent):
+            nonlocal eta
+            profiler = self._profilers.get(job.id)
+            if profiler is not None and event.status == "started":
+                profiler.set_stage(event.stage)
+            if event.status == "finished":
+                self.stage_stats.record(event.stage, event.elapsed, units=event.total)
+            if event.stage not in stages:
+                # off the way to the audio, the job stays in its current stage
+                _background(_write_progress(event.model_dump() | {"background": True}))
+                return
+            eta = self.stage_stats.eta(stages, event)
+            if event.stage == "recording" and event.status == "progress":
+                # reported with the segment
+                return
+            fields = {"stage": event.stage} if event.status == "started" else {}
+            _background(_write_progress(event.model_dump() | {"eta": eta}, **fields))
+
+        # fail now rather than after the LLM stages if the engine is down
+        speakers = [request.speaker_id, request.supporter_id]
+        speakers += [voice for voices in request.voices for voice in voices]
+        await studio.preflight(voicevox_client, speakers)
+        warm_up = asyncio.create_task(studio.warm_up(voicevox_client, speakers))
+        warm_up.add_done_callback(lambda t: t.cancelled() or t.exception())
+        # saves the blog of a `fast` job once it is written
+        blog_saved: asyncio.Task | None = None
+        try:
+            if request.kind == "generate":
+                assert len(request.sources) > 0
+                await self._update(
+                    job, "stage", {"stage": "conversation"}, stage="conversation"
+                )
+                with collect_prompt_stats() as prompt_stats:
+                    if request.mode == "fast":
+                        (
+                            blog_task,
+                            dialogue,
+                            conversation,
+                        ) = await studio.draft_conversation(
+                            request.sources, on_progress=_on_progress
+                        )
+                        self._blogs[job.id] = blog_task
+                    else:
+                        blog, dialogue, conversation = await studio.create_conversation(
+                            request.sources, on_progress=_on_progress
+                        )
+                await self._put_text(job, "dialogue.md", dialogue)
+                if request.mode == "fast":
+
+                    async def _save_blog():
+                        try:
+                            blog = await blog_task
+                        except Exception as e:
+                            # the episode is out already, the job still succeeds
+                            self.logger.warning(
+                                f"Job {job.id}: could not write the blog: {e!r}"
+                            )
+                            await self._update(job, "blog_failed", {"error": repr(e)})
+                        else:
+                            await self._put_text(job, "blog.md", blog)
+                        await self._save_prompts(job, prompt_stats)
+
+                    blog_saved = asyncio.create_task(_save_blog())
+                    blog_saved.add_done_callback(
+                        lambda t: t.cancelled() or t.exception()
+                    )
+                else:
+                    await self._put_text(job, "blog.md", blog)
+                    await self._save_prompts(job, prompt_stats)
+            else:
+                assert request.conversation is not None
+                conversation = request.conversation
+            try:
+                await warm_up
+            except Exception as e:
+                # only a head start, synthesis loads the models itself
+                self.logger.warning(
+                    f"Job {job.id}: warming up the engine failed: {e!r}"
+                )
+        finally:
+            warm_up.cancel()
+        await self._put_text(
+            job,
+            "conversation.json",
+            conversation.model_dump_json(indent=2, exclude_none=True),
+        )
+
+        # with other voices too, every line is recorded
+        base = (
+            await self._load_base(job)
+            if request.base_job and not request.voices
+            else None
+        )
+        if base is not None:
+            base_conversation, _podcast, _index, base_segments = base
+            changed = [
+                i
+                for i, (new, old) in enumerate(
+                    zip(conversation.conversation, base_conversation.conversation)
+                )
+                if new.content != old.content
+            ]
+            # the lines that did not change keep their audio
+            for i, path in enumerate(base_segments):
+                if i not in changed and path is not None:
+                    await asyncio.to_thread(
+                        self.queue.put_artifact,
+                        job.id,
+                        self.name,
+                        f"segments/{i}",
+                        path=path,
+                    )
+
+        lines_total = len(conversation.conversation)
+        lines_done = 0 if base is None else lines_total - len(changed)
+        # where each line ended up, and the renderings with `request.voices`
+        indexes: list[PodcastIndex] = []
+        variants: list[Audio] = []
+        await self._update(
+            job,
+            "stage",
+            {"stage": "recording"},
+            stage="recording",
+            lines_total=lines_total,
+            lines_done=lines_done,
+        )
+
+        async def _save_segment(index: int, audio: Audio, data: dict):
+            # hashing and writing the line stays off the event loop
+            path = await asyncio.to_thread(self.audio_store.put, audio.wav)
+            written.add(path)
+            await asyncio.to_thread(
+                self.queue.put_artifact,
+                job.id,
+                self.name,
+                f"segments/{index}",
+                path=path,
+                event="segment",
+                event_data=data,
+                lines_done=data["lines_done"],
+            )
+
+        def _on_segment(index: int, audio: Audio):
+            nonlocal lines_done
+            lines_done += 1
+            data = {
+                "index": index,
+                "duration": audio.duration,
+                "lines_done": lines_done,
+                "lines_total": lines_total,
+                "eta": eta,
+            }
+            _background(_save_segment(index, audio, data))
+
+        if base is not None:
+            _conversation, base_podcast, base_index, _segments = base
+            self.logger.info(f"Job {job.id}: recording {len(changed)} edited lines.")
+            with base_podcast:
+                podcast, index = await studio.rerecord_lines(
+                    conversation=conversation,
+                    lines=changed,
+                    podcast=base_podcast,
+                    index=base_index,
+                    voicevox_client=voicevox_client,
+                    speaker_id=request.speaker_id,
+                    supporter_id=request.supporter_id,
+                    on_segment=_on_segment,
+                    on_progress=_on_progress,
+                )
+        elif request.voices:
+
+            def _on_variant_segment(pair: int, index: int, audio: Audio):
+                # the lines of the other voices are only saved as a whole
+                if pair == 0:
+                    _on_segment(index, audio)
+
+            def _on_variant_index(pair: int, index: PodcastIndex):
+                if pair == 0:
+                    indexes.append(index)
+
+            self.logger.info(
+                f"Job {job.id}: recording with {len(request.voices) + 1} voice pairs."
+            )
+            podcast, *variants = await studio.record_variants(
+                conversation=conversation,
+                voicevox_client=voicevox_client,
+                voices=[(request.speaker_id, request.supporter_id), *request.voices],
+                on_segment=_on_variant_segment,
+                on_progress=_on_progress,
+                on_index=_on_variant_index,
+            )
+            index = indexes[0] if len(indexes) > 0 else None
+        else:
+            podcast = await studio.record_podcast(
+                conversation=conversation,
+                voicevox_client=voicevox_client,
+                speaker_id=request.speaker_id,
+                supporter_id=request.supporter_id,
+                on_segment=_on_segment,
+                on_progress=_on_progress,
+                on_index=indexes.append,
+            )
+            index = indexes[0] if len(indexes) > 0 else None
+        await asyncio.gather(*pending)
+
+        for i, variant in enumerate(variants):
+            path = await asyncio.to_thread(self.audio_store.put, variant.wav)
+            written.add(path)
+            await asyncio.to_thread(
+                self.queue.put_artifact, job.id, self.name, f"variants/{i}", path=path
+            )
+
+        path = await asyncio.to_thread(self.audio_store.put, podcast.wav)
+        written.add(path)
+        if index is not None:
+            await self._put_text(job, "podcast.index.json", index.model_dump_json())
+        time_to_audio = time.monotonic() - started
+        self.logger.info(
+            f"Job {job.id}: audio ready after {time_to_audio:.1f}s ({request.mode})."
+        )
+        await asyncio.to_thread(
+            self.queue.put_artifact,
+            job.id,
+            self.name,
+            "podcast.wav",
+            path=path,
+            event="audio",
+            event_data={"mode": request.mode, "time_to_audio": time_to_audio},
+        )
+        if blog_saved is not None:
+            # the episode can be played meanwhile
+            await blog_saved
+            # e.g. the blog's progress events
+            await asyncio.gather(*pending)
+        await self._save_profile(job)
+        await asyncio.to_thread(self.queue.finish, job.id, self.name, "succeeded")
+        self.logger.info(f"Job {job.id} succeeded.")
+
+
+def _worker_main(
+    queue_path: str,
+    audio_dir: str,
+    api_key: str,
+    voicevox_endpoint: str,
+    engine_concurrency: int,
+    llm_concurrency: int,
+    lease: float,
+    journal_mode: str,
+    max_jobs: int,
+    studio_options: dict,
+    routing: RoutingConfig | None,
+):
+    logging.basicConfig(level=logging.INFO)
+    queue = JobQueue(queue_path, journal_mode=journal_mode)
+    worker = Worker(
+        queue=queue,
+        audio_store=AudioStore(audio_dir, pinned=queue.artifact_files),
+        api_key=api_key,
+        voicevox_endpoint=voicevox_endpoint,
+        scheduler=Scheduler(
+            limits={"engine": engine_concurrency, "llm": llm_concurrency}
+        ),
+        lease=lease,
+        max_jobs=max_jobs,
+        studio_options=studio_options,
+        router=Router(routing),
+    )
+    try:
+        asyncio.run(worker.run())
+    except KeyboardInterrupt:
+        pass
+
+
+class WorkerPool:
+    """
+    Keeps `num_workers` worker processes alive on this machine, restarting any that die.
+
+    Each process has its own scheduler and rate limiter, so `engine_concurrency`,
+    `llm_concurrency` and the `rate_limits` of `routing` are budgets for the whole pool,
+    split evenly between the processes (at least 1 each).
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        queue_path: str,
+        audio_dir: str,
+        api_key: str,
+        voicevox_endpoint: str,
+        engine_concurrency: int = 2,
+        llm_concurrency: int = 4,
+        lease: float = 30.0,
+        journal_mode: str = "WAL",
+        jobs_per_worker: int = 4,
+        studio_options: dict | None = None,
+        routing: RoutingConfig | None = None,
+    ):
+        self.num_workers = num_workers
+        self.logger = logging.getLogger(__name__)
+        parts = max(num_workers, 1)
+        if engine_concurrency < parts or llm_concurrency < parts:
+            self.logger.warning(
+                f"{num_workers} workers get at least 1 engine and LLM slot each, more "
+                f"than engine_concurrency={engine_concurrency} or "
+                f"llm_concurrency={llm_concurrency}."
+            )
+        self.args = (
+            queue_path,
+            audio_dir,
+            api_key,
+            voicevox_endpoint,
+            max(engine_concurrency // parts, 1),
+            max(llm_concurrency // parts, 1),
+            lease,
+            journal_mode,
+            jobs_per_worker,
+            studio_options or {},
+            None if routing is None else routing.share(parts),
+        )
+
+        # spawn, so workers do not inherit the parent's event loop or server sockets
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: list[multiprocessing.process.BaseProcess] = []
+
+    def _spawn(self) -> multiprocessing.process.BaseProcess:
+        process = self._context.Process(
+            target=_worker_main, args=self.args, daemon=True
+        )
+        process.start()
+        return process
+
+    def start(self):
+        self._processes = [self._spawn() for _ in range(self.num_workers)]
+
+    def check(self):
+        for i, process in enumerate(self._processes):
+            if not process.is_alive():
+                self.logger.warning(
+                    f"Worker process {process.pid} exited ({process.exitcode}), restarting."
+                )
+                self._processes[i] = self._spawn()
+
+    async def supervise(self, interval: float = 5.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.check()
+
+    def run_forever(self, interval: float = 5.0):
+        self.start()
+        try:
+            while True:
+                time.sleep(interval)
+                self.check()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join(timeout=10)
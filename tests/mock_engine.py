@@ -0,0 +1,143 @@
+import asyncio
+import io
+import wave
+import zipfile
+from collections import Counter
+
+import orjson
+from aiohttp import web
+
+
+def make_wav(num_frames: int, value: int = 0x10) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(24000)
+        f.writeframes(value.to_bytes(2, "little") * num_frames)
+    return buffer.getvalue()
+
+
+def create_engine(
+    has_multi_synthesis: bool = True,
+    has_cancellable_synthesis: bool = False,
+    has_tempo_dynamics: bool = False,
+    styles: tuple[int, ...] = (1, 2),
+    latency: float = 0.0,
+    speakers_status: int = 200,
+) -> tuple[web.Application, Counter]:
+    """
+    Minimal VOICEVOX compatible engine: each line renders 100 frames per character of
+    its text, so tests can tell lines apart by length. Audio queries and each rendered
+    line take `latency` seconds, for load tests. `/speakers` fails unless
+    `speakers_status` is 200.
+    """
+
+    calls: Counter = Counter()
+    paths = ["/audio_query", "/synthesis", "/initialize_speaker", "/speakers"]
+    if has_cancellable_synthesis:
+        paths.append("/cancellable_synthesis")
+    if has_multi_synthesis:
+        paths.append("/multi_synthesis")
+    audio_query_properties = ["accent_phrases", "speedScale", "kana"]
+    if has_tempo_dynamics:
+        audio_query_properties.append("tempoDynamicsScale")
+
+    async def version(request: web.Request) -> web.Response:
+        return web.json_response("0.0.0")
+
+    async def core_versions(request: web.Request) -> web.Response:
+        return web.json_response(["0.0.0"])
+
+    async def openapi(request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "paths": {path: {} for path in paths},
+                "components": {
+                    "schemas": {
+                        "AudioQuery": {
+                            "properties": {name: {} for name in audio_query_properties}
+                        }
+                    }
+                },
+            }
+        )
+
+    async def speakers(request: web.Request) -> web.Response:
+        if speakers_status != 200:
+            return web.Response(status=speakers_status)
+        return web.json_response(
+            [
+                {
+                    "name": "mock",
+                    "speaker_uuid": "00000000-0000-0000-0000-000000000000",
+                    "styles": [
+                        {"name": f"style {i}", "id": i, "type": "talk"} for i in styles
+                    ],
+                    "version": "0.0.0",
+                }
+            ]
+        )
+
+    async def initialize_speaker(request: web.Request) -> web.Response:
+        calls["initialize_speaker"] += 1
+        return web.Response(status=204)
+
+    async def _render(query: dict) -> bytes:
+        if latency > 0:
+            await asyncio.sleep(latency)
+        return make_wav(100 * len(query["kana"]))
+
+    async def audio_query(request: web.Request) -> web.Response:
+        calls["audio_query"] += 1
+        if latency > 0:
+            await asyncio.sleep(latency)
+        return web.json_response(
+            {
+                "accent_phrases": [],
+                "speedScale": 1.0,
+                "intonationScale": 1.0,
+                "pitchScale": 0.0,
+                "volumeScale": 1.0,
+                "prePhonemeLength": 0.1,
+                "postPhonemeLength": 0.1,
+                "pauseLength": None,
+                "pauseLengthScale": 1.0,
+                "outputSamplingRate": 24000,
+                "outputStereo": False,
+                "kana": request.query["text"],
+            }
+        )
+
+    async def synthesis(request: web.Request) -> web.Response:
+        calls["synthesis"] += 1
+        query = orjson.loads(await request.read())
+        return web.Response(body=await _render(query), content_type="audio/wav")
+
+    async def cancellable_synthesis(request: web.Request) -> web.Response:
+        calls["cancellable_synthesis"] += 1
+        query = orjson.loads(await request.read())
+        return web.Response(body=await _render(query), content_type="audio/wav")
+
+    async def multi_synthesis(request: web.Request) -> web.Response:
+        calls["multi_synthesis"] += 1
+        queries = orjson.loads(await request.read())
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for i, query in enumerate(queries):
+                archive.writestr(f"{i + 1:03}.wav", await _render(query))
+        return web.Response(body=buffer.getvalue(), content_type="application/zip")
+
+    app = web.Application()
+    app.router.add_get("/version", version)
+    app.router.add_get("/core_versions", core_versions)
+    app.router.add_get("/openapi.json", openapi)
+    app.router.add_get("/speakers", speakers)
+    app.router.add_post("/initialize_speaker", initialize_speaker)
+    app.router.add_post("/audio_query", audio_query)
+    app.router.add_post("/synthesis", synthesis)
+    if has_cancellable_synthesis:
+        app.router.add_post("/cancellable_synthesis", cancellable_synthesis)
+    if has_multi_synthesis:
+        app.router.add_post("/multi_synthesis", multi_synthesis)
+    return app, calls
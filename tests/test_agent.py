@@ -6,8 +6,11 @@ import os
 from src.agent import (
     BloggerAgent,
     WriterAgent,
+    SectionWriterAgent,
     StructureAgent,
     Conversation,
+    Outline,
+    OutlineSection,
 )
 from src.fetcher import PDFFetcher
 
@@ -73,3 +76,51 @@ async def test_structure_agent():
 
     with open("./dist/conversation2.json", "w", encoding="utf-8") as f:
         f.write(conversation.model_dump_json(indent=2))
+
+
+OUTLINE = Outline(
+    intro="羅生門を紹介する",
+    sections=[
+        OutlineSection(title="あらすじ", points=["下人", "老婆"]),
+        OutlineSection(title="テーマ", points=["善悪"]),
+    ],
+    outro="現代との接点",
+)
+
+
+def test_section_writer_check():
+    assert SectionWriterAgent.check("**S:** こんにちは\n\n**A:** こんにちは！")
+    assert SectionWriterAgent.check("スピーカー: はい\nA: なるほど")
+    # preamble only, or one speaker talking alone
+    assert not SectionWriterAgent.check("承知しました。以下が脚本です。")
+    assert not SectionWriterAgent.check("S: 一行目\nS: 二行目")
+
+
+def test_section_writer_stitch():
+    parts = [
+        "はい、承知しました。\n\nS: こんにちは！\nA: 今日は羅生門ですね。",
+        "### あらすじ\nA: 今日は羅生門ですね。\nS: 下人が主人公です。\nA: なるほど。",
+        "S: テーマは善悪です。\nA: 深いですね。",
+        "S: 今日はここまで。\nA: ありがとうございました！",
+    ]
+    dialogue = SectionWriterAgent.stitch(OUTLINE, parts)
+
+    assert OUTLINE.parts == ["イントロ", "あらすじ", "テーマ", "アウトロ"]
+    assert dialogue.startswith("### 1. イントロ\n\nS: こんにちは！")
+    assert "### 4. アウトロ" in dialogue
+    assert "承知しました" not in dialogue
+    # the line repeated across the boundary appears once
+    assert dialogue.count("今日は羅生門ですね。") == 1
+
+
+@pytest.mark.asyncio
+async def test_section_writer_agent():
+    fetcher = PDFFetcher()
+    paper = await fetcher.fetch("https://arxiv.org/pdf/2309.17400")
+    agent = SectionWriterAgent(api_key=API_KEY)
+
+    outline = await agent.outline(paper, paper[:2000])
+    assert len(outline.sections) > 0
+
+    text = await agent.section(paper, paper[:2000], outline, 1)
+    assert SectionWriterAgent.check(text)
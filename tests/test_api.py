@@ -0,0 +1,481 @@
+import asyncio
+import io
+import json
+import marshal
+import wave
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+
+from src.agent import Conversation, Dialogue
+from src.api import create_router
+from src.audio import Audio
+from src.jobqueue import JobQueue
+from src.jobs import JobManager, JobRequest
+from src.mastering import MasteringConfig, PodcastIndex, Segment, splice
+from src.progress import ProgressReporter
+from src.storage import AudioStore
+from src.worker import Worker
+
+
+def make_wav(num_frames: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(24000)
+        f.writeframes(b"\x10\x00" * num_frames)
+    return buffer.getvalue()
+
+
+def make_conversation(url: str) -> Conversation:
+    return Conversation(
+        conversation=[
+            Dialogue(role="speaker", content=f"{url} を紹介します。"),
+            Dialogue(role="supporter", content="なるほど！"),
+        ]
+    )
+
+
+class FakeStudio:
+    # when the blog of a fast job is written
+    blog_written = staticmethod(lambda: True)
+    # raised by the blogger of a fast job
+    blog_error: Exception | None = None
+    # raised while loading the voices' models
+    warm_up_error: Exception | None = None
+
+    async def create_conversation(self, url: str, on_progress=None):
+        progress = ProgressReporter(on_progress)
+        for stage in ("fetch", "blog", "dialogue", "structure"):
+            with progress.stage(stage):
+                pass
+        return "# blog", "S: dialogue", make_conversation(url)
+
+    async def draft_conversation(self, url: str, on_progress=None):
+        progress = ProgressReporter(on_progress)
+
+        async def _blog():
+            with progress.stage("blog"):
+                for _ in range(200):
+                    if self.blog_written():
+                        break
+                    await asyncio.sleep(0.01)
+            if self.blog_error is not None:
+                raise self.blog_error
+            return "# blog"
+
+        with progress.stage("fetch"):
+            pass
+        blog = asyncio.create_task(_blog())
+        for stage in ("dialogue", "structure"):
+            with progress.stage(stage):
+                pass
+        return blog, "S: dialogue", make_conversation(url)
+
+    async def preflight(self, voicevox_client, speakers):
+        pass
+
+    async def warm_up(self, voicevox_client, speakers):
+        if self.warm_up_error is not None:
+            raise self.warm_up_error
+
+    async def record_podcast(
+        self,
+        conversation,
+        voicevox_client,
+        speaker_id,
+        supporter_id,
+        on_segment=None,
+        on_progress=None,
+        on_index=None,
+    ):
+        progress = ProgressReporter(on_progress)
+        lines = conversation.conversation
+        audios = []
+        with progress.stage("recording", total=len(lines)):
+            for i, _dialogue in enumerate(lines):
+                audio = Audio(make_wav(100 * (i + 1)))
+                progress.advance("recording", i + 1, len(lines))
+                if on_segment is not None:
+                    on_segment(i, audio)
+                audios.append(audio)
+        if on_index is not None:
+            on_index(PodcastIndex.of_concat(audios))
+        return Audio.concat(audios)
+
+    async def record_variants(
+        self,
+        conversation,
+        voicevox_client,
+        voices,
+        on_segment=None,
+        on_progress=None,
+        on_index=None,
+    ):
+        podcasts = []
+        for pair, (speaker_id, supporter_id) in enumerate(voices):
+            podcast = await self.record_podcast(
+                conversation,
+                voicevox_client,
+                speaker_id,
+                supporter_id,
+                on_segment=lambda i, audio, pair=pair: (
+                    on_segment is not None and on_segment(pair, i, audio)
+                ),
+                on_progress=on_progress,
+                on_index=lambda index, pair=pair: (
+                    on_index is not None and on_index(pair, index)
+                ),
+            )
+            podcasts.append(Audio.concat([podcast] * (pair + 1)))
+        return podcasts
+
+    async def rerecord_lines(
+        self,
+        conversation,
+        lines,
+        podcast,
+        index,
+        voicevox_client,
+        speaker_id,
+        supporter_id,
+        on_segment=None,
+        on_progress=None,
+    ):
+        self.rerecorded = list(lines)
+        replacements = {}
+        for i in lines:
+            dialogue = conversation.conversation[i]
+            audio = Audio(make_wav(100 * len(dialogue.content)))
+            if on_segment is not None:
+                on_segment(i, audio)
+            replacements[i] = Segment(dialogue.role, dialogue.content, audio)
+        return splice(podcast, index, replacements, MasteringConfig(enabled=False))
+
+
+def test_job_api(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    audio_store = AudioStore(tmp_path / "audio")
+    manager = JobManager(queue=queue, audio_store=audio_store, poll_interval=0.01)
+    worker = Worker(
+        queue=queue,
+        audio_store=audio_store,
+        api_key="",
+        voicevox_endpoint="http://127.0.0.1:10101",
+    )
+    worker.studio = FakeStudio()  # type: ignore
+
+    app = FastAPI()
+    app.include_router(create_router(manager), prefix="/api")
+
+    with TestClient(app) as client:
+        res = client.post(
+            "/api/jobs",
+            json={"url": "https://example.com", "speaker_id": 1, "supporter_id": 2},
+        )
+        assert res.status_code == 202
+        job_id = res.json()["id"]
+        assert res.json()["status"] == "queued"
+
+        job = queue.claim(worker.name, lease=30)
+        assert job is not None and job.id == job_id
+        asyncio.run(worker.run_job(job))
+
+        with client.stream("GET", f"/api/jobs/{job_id}/events") as stream:
+            lines = list(stream.iter_lines())
+        events = [
+            line.removeprefix("event: ") for line in lines if line.startswith("event: ")
+        ]
+        assert events[0] == "status"
+        assert events.count("segment") == 2
+        # started and finished of every stage
+        assert events.count("progress") == 10
+        assert events[-1] == "status"
+
+        progress = [
+            json.loads(line.removeprefix("data: "))
+            for line in lines
+            if line.startswith("data: ") and '"status": "started"' in line
+        ]
+        assert [event["stage"] for event in progress] == [
+            "fetch",
+            "blog",
+            "dialogue",
+            "structure",
+            "recording",
+        ]
+        # recorded for the ETA of the next jobs
+        assert worker.stage_stats.duration("recording") is not None
+
+        job = client.get(f"/api/jobs/{job_id}").json()
+        assert job["status"] == "succeeded"
+        assert job["lines_done"] == 2
+        assert job["lines_total"] == 2
+        assert set(job["artifacts"]) == {
+            "blog.md",
+            "dialogue.md",
+            "conversation.json",
+            "podcast.wav",
+            "podcast.index.json",
+            "prompts.json",
+        }
+
+        conversation = json.loads(
+            client.get(f"/api/jobs/{job_id}/artifacts/conversation.json").text
+        )
+        assert len(conversation["conversation"]) == 2
+
+        audio = client.get(f"/api/jobs/{job_id}/artifacts/podcast.wav")
+        assert Audio(audio.content).num_frames == 300
+
+        segment = client.get(f"/api/jobs/{job_id}/segments/1")
+        assert Audio(segment.content).num_frames == 200
+
+        assert client.get("/api/jobs/unknown").status_code == 404
+
+
+def test_fast_job(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    audio_store = AudioStore(tmp_path / "audio")
+    manager = JobManager(queue=queue, audio_store=audio_store, poll_interval=0.01)
+    worker = Worker(
+        queue=queue,
+        audio_store=audio_store,
+        api_key="",
+        voicevox_endpoint="http://127.0.0.1:10101",
+    )
+    studio = FakeStudio()
+    worker.studio = studio  # type: ignore
+
+    app = FastAPI()
+    app.include_router(create_router(manager), prefix="/api")
+
+    with TestClient(app) as client:
+        job_id = client.post(
+            "/api/jobs",
+            json={
+                "url": "https://example.com",
+                "mode": "fast",
+                "speaker_id": 1,
+                "supporter_id": 2,
+            },
+        ).json()["id"]
+        # slower than the rest of the job
+        studio.blog_written = lambda: queue.artifact(job_id, "podcast.wav") is not None
+        asyncio.run(worker.run_job(queue.claim(worker.name, lease=30)))  # type: ignore
+
+        job = client.get(f"/api/jobs/{job_id}").json()
+        assert job["status"] == "succeeded"
+        assert {"blog.md", "prompts.json", "podcast.wav"} <= set(job["artifacts"])
+
+        events = list(queue.events(job_id))
+        # the blog was written while recording, it does not hold up the audio
+        names = [event.data.get("name") for event in events]
+        assert names.index("podcast.wav") < names.index("blog.md")
+        audio = next(event for event in events if event.type == "audio")
+        assert audio.data["mode"] == "fast"
+        assert audio.data["time_to_audio"] > 0
+
+        # reported, but not as the stage the job is in
+        progress = [event.data for event in events if event.type == "progress"]
+        assert [data["stage"] for data in progress if data.get("background")] == [
+            "blog",
+            "blog",
+        ]
+        assert "blog" not in [
+            data["stage"] for data in progress if not data.get("background")
+        ]
+
+
+def test_fast_job_keeps_the_audio_when_the_blog_fails(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    audio_store = AudioStore(tmp_path / "audio")
+    worker = Worker(
+        queue=queue,
+        audio_store=audio_store,
+        api_key="",
+        voicevox_endpoint="http://127.0.0.1:10101",
+    )
+    studio = FakeStudio()
+    studio.blog_error = RuntimeError("blogger is down")
+    worker.studio = studio  # type: ignore
+
+    job = queue.enqueue(
+        JobRequest(url="https://example.com", mode="fast", speaker_id=1, supporter_id=2)
+    )
+    studio.blog_written = lambda: queue.artifact(job.id, "podcast.wav") is not None
+    asyncio.run(worker.run_job(queue.claim(worker.name, lease=30)))  # type: ignore
+
+    job = queue.get(job.id)
+    assert job is not None
+    # the audio was delivered, the job is not failed after the fact
+    assert job.status == "succeeded"
+    assert "podcast.wav" in job.artifacts
+    assert "blog.md" not in job.artifacts
+    failed = [event for event in queue.events(job.id) if event.type == "blog_failed"]
+    assert "blogger is down" in failed[0].data["error"]
+
+
+def test_failed_warm_up_does_not_fail_the_job(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    audio_store = AudioStore(tmp_path / "audio")
+    worker = Worker(
+        queue=queue,
+        audio_store=audio_store,
+        api_key="",
+        voicevox_endpoint="http://127.0.0.1:10101",
+    )
+    studio = FakeStudio()
+    studio.warm_up_error = TimeoutError()
+    worker.studio = studio  # type: ignore
+
+    job = queue.enqueue(
+        JobRequest(url="https://example.com", speaker_id=1, supporter_id=2)
+    )
+    asyncio.run(worker.run_job(queue.claim(worker.name, lease=30)))  # type: ignore
+
+    job = queue.get(job.id)
+    assert job is not None and job.status == "succeeded"
+    assert "podcast.wav" in job.artifacts
+
+
+def test_record_with_several_voices(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    audio_store = AudioStore(tmp_path / "audio")
+    manager = JobManager(queue=queue, audio_store=audio_store, poll_interval=0.01)
+    worker = Worker(
+        queue=queue,
+        audio_store=audio_store,
+        api_key="",
+        voicevox_endpoint="http://127.0.0.1:10101",
+    )
+    worker.studio = FakeStudio()  # type: ignore
+
+    app = FastAPI()
+    app.include_router(create_router(manager), prefix="/api")
+
+    with TestClient(app) as client:
+        job_id = client.post(
+            "/api/jobs",
+            json={
+                "url": "https://example.com",
+                "speaker_id": 1,
+                "supporter_id": 2,
+                "voices": [[3, 2], [1, 4]],
+            },
+        ).json()["id"]
+        asyncio.run(worker.run_job(queue.claim(worker.name, lease=30)))  # type: ignore
+
+        job = client.get(f"/api/jobs/{job_id}").json()
+        assert job["status"] == "succeeded"
+        # segments of the first pair only
+        assert job["lines_done"] == 2
+        assert {"podcast.wav", "variants/0", "variants/1"} <= set(job["artifacts"])
+
+        audio = client.get(f"/api/jobs/{job_id}/artifacts/podcast.wav")
+        assert Audio(audio.content).num_frames == 300
+        for i in range(2):
+            variant = client.get(f"/api/jobs/{job_id}/variants/{i}")
+            assert Audio(variant.content).num_frames == 300 * (i + 2)
+        assert client.get(f"/api/jobs/{job_id}/variants/2").status_code == 404
+
+
+def test_record_edited_lines(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    audio_store = AudioStore(tmp_path / "audio")
+    manager = JobManager(queue=queue, audio_store=audio_store, poll_interval=0.01)
+    worker = Worker(
+        queue=queue,
+        audio_store=audio_store,
+        api_key="",
+        voicevox_endpoint="http://127.0.0.1:10101",
+    )
+    studio = FakeStudio()
+    worker.studio = studio  # type: ignore
+
+    app = FastAPI()
+    app.include_router(create_router(manager), prefix="/api")
+
+    with TestClient(app) as client:
+        base_id = client.post(
+            "/api/jobs",
+            json={"url": "https://example.com", "speaker_id": 1, "supporter_id": 2},
+        ).json()["id"]
+        asyncio.run(worker.run_job(queue.claim(worker.name, lease=30)))  # type: ignore
+
+        conversation = json.loads(
+            client.get(f"/api/jobs/{base_id}/artifacts/conversation.json").text
+        )
+        conversation["conversation"][1]["content"] = "なるほど、面白いですね！"
+        job_id = client.post(
+            "/api/jobs",
+            json={
+                "kind": "record",
+                "conversation": conversation,
+                "base_job": base_id,
+                "speaker_id": 1,
+                "supporter_id": 2,
+            },
+        ).json()["id"]
+        asyncio.run(worker.run_job(queue.claim(worker.name, lease=30)))  # type: ignore
+
+        job = client.get(f"/api/jobs/{job_id}").json()
+        assert job["status"] == "succeeded"
+        assert job["lines_done"] == 2
+        # only the edited line was synthesized again
+        assert studio.rerecorded == [1]
+        assert queue.artifact(job_id, "segments/0") == queue.artifact(
+            base_id, "segments/0"
+        )
+
+        audio = client.get(f"/api/jobs/{job_id}/artifacts/podcast.wav")
+        assert Audio(audio.content).num_frames == 100 + 1200
+        segment = client.get(f"/api/jobs/{job_id}/segments/1")
+        assert Audio(segment.content).num_frames == 1200
+
+
+def test_profiled_job(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    audio_store = AudioStore(tmp_path / "audio")
+    manager = JobManager(queue=queue, audio_store=audio_store, poll_interval=0.01)
+    worker = Worker(
+        queue=queue,
+        audio_store=audio_store,
+        api_key="",
+        voicevox_endpoint="http://127.0.0.1:10101",
+    )
+    worker.studio = FakeStudio()  # type: ignore
+
+    app = FastAPI()
+    app.include_router(create_router(manager), prefix="/api")
+
+    with TestClient(app) as client:
+        job_id = client.post(
+            "/api/jobs",
+            json={
+                "url": "https://example.com",
+                "speaker_id": 1,
+                "supporter_id": 2,
+                "profile": True,
+            },
+        ).json()["id"]
+        asyncio.run(worker.run_job(queue.claim(worker.name, lease=30)))  # type: ignore
+
+        job = client.get(f"/api/jobs/{job_id}").json()
+        assert job["status"] == "succeeded"
+        assert {"profile.json", "profile.collapsed", "profile.pstats"} <= set(
+            job["artifacts"]
+        )
+        report = client.get(f"/api/jobs/{job_id}/artifacts/profile.json").json()
+        assert "recording" in report["stages"]
+        res = client.get(f"/api/jobs/{job_id}/artifacts/profile.pstats")
+        assert res.status_code == 200 and len(res.content) > 0
+        assert marshal.loads(res.content)
+        # kept with the job, not in the audio store
+        assert queue.artifact(job_id, "profile.pstats")[1] is None
+        assert not any(
+            path.suffix == ".wav" and path.read_bytes() == res.content
+            for path in audio_store.root.iterdir()
+        )
@@ -0,0 +1,57 @@
+import io
+import wave
+
+
+from src.audio import Audio
+
+
+def make_wav(num_frames: int, value: int = 1000, sample_rate: int = 24000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(value.to_bytes(2, "little", signed=True) * num_frames)
+    return buffer.getvalue()
+
+
+def test_audio_header():
+    audio = Audio(make_wav(24000))
+
+    assert audio.sample_rate == 24000
+    assert audio.channels == 1
+    assert audio.bits_per_sample == 16
+    assert audio.data_offset == 44
+    assert audio.num_frames == 24000
+    assert audio.duration == 1.0
+    assert audio.pcm.nbytes == 48000
+
+
+def test_audio_concat():
+    audio_1 = Audio(make_wav(100, value=1))
+    audio_2 = Audio(make_wav(200, value=2))
+
+    joined = Audio.concat([audio_1, audio_2])
+    assert joined.num_frames == 300
+    assert joined.pcm[:200] == audio_1.pcm
+    assert joined.pcm[200:] == audio_2.pcm
+
+    with wave.open(io.BytesIO(joined.wav), "rb") as f:
+        assert f.getnframes() == 300
+        assert f.getframerate() == 24000
+
+
+def test_audio_from_file(tmp_path):
+    path = tmp_path / "audio.wav"
+    path.write_bytes(make_wav(100))
+
+    with Audio.from_file(path) as audio:
+        assert audio.num_frames == 100
+        assert audio.wav == make_wav(100)
+
+
+def test_audio_from_pcm():
+    source = Audio(make_wav(100, value=7))
+    audio = Audio.from_pcm(source.pcm, sample_rate=source.sample_rate)
+
+    assert audio.wav == source.wav
@@ -0,0 +1,128 @@
+import pytest
+
+import litellm
+from litellm.types.utils import ModelResponse, Usage
+
+from src.agent import BloggerAgent, WriterAgent
+from src.context_cache import collect_prompt_stats, condense
+from src.routing import ModelRoute, Router, RoutingConfig
+
+# long enough to be worth caching
+DOCUMENT = "\n".join(
+    f"第 {i} 段落: 低ランク適応によって学習するパラメータを減らす。" for i in range(500)
+)
+
+
+def _response(content: str, cached_tokens: int = 0) -> ModelResponse:
+    return ModelResponse(
+        choices=[{"message": {"role": "assistant", "content": content}}],
+        usage=Usage(
+            prompt_tokens=1000,
+            completion_tokens=10,
+            total_tokens=1010,
+            prompt_tokens_details={"cached_tokens": cached_tokens},
+        ),
+    )
+
+
+def _router(model: str) -> Router:
+    route = [ModelRoute(model=model, max_tokens=100)]
+    return Router(RoutingConfig(routes={"blogger": route, "writer": route}))
+
+
+def test_condense():
+    text = "\n".join(
+        [
+            "# LoRA",
+            "arXiv:2106.09685v2",
+            "本文 1",
+            "",
+            "",
+            "",
+            "arXiv:2106.09685v2",
+            "本文 2",
+            "arXiv:2106.09685v2",
+            "本文 3",
+            "References",
+            "[1] Hu et al.",
+        ]
+    )
+
+    # the reference list, page headers and blank runs are dropped
+    assert condense(text) == "# LoRA\n本文 1\n\n本文 2\n本文 3"
+    assert condense("あ" * 100, max_chars=10) == "あ" * 10 + "\n\n(以下省略)"
+
+
+@pytest.mark.asyncio
+async def test_agents_share_the_cached_document(monkeypatch):
+    calls = []
+
+    async def acompletion(**kwargs):
+        calls.append(kwargs)
+        return _response("ok", cached_tokens=900 if len(calls) > 1 else 0)
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    router = _router("gemini/flash")
+
+    with collect_prompt_stats() as stats:
+        await BloggerAgent(api_key="dummy", router=router).task(DOCUMENT)
+        await WriterAgent(api_key="dummy", router=router).task(DOCUMENT, "blog")
+
+    # both start with the same document, marked for caching
+    prefixes = [call["messages"][0] for call in calls]
+    assert prefixes[0] == prefixes[1]
+    assert prefixes[0]["content"][0]["cache_control"] == {"type": "ephemeral"}
+    assert DOCUMENT in prefixes[0]["content"][0]["text"]
+
+    summary = stats.summary()
+    assert [call["agent"] for call in summary["calls"]] == ["blogger", "writer"]
+    assert summary["prompt_tokens"] == 2000
+    assert summary["tokens_saved"] == 900
+
+
+@pytest.mark.asyncio
+async def test_writer_condenses_without_caching(monkeypatch):
+    calls = []
+
+    async def acompletion(**kwargs):
+        calls.append(kwargs)
+        return _response("ok")
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    router = _router("openai/gpt")
+    document = DOCUMENT + "\n参考文献\n" + "[1] 文献\n" * 1000
+
+    with collect_prompt_stats() as stats:
+        await BloggerAgent(api_key="dummy", router=router).task(document)
+        await WriterAgent(api_key="dummy", router=router).task(document, "blog")
+
+    # the blogger reads everything, the writer also has the blog
+    assert calls[0]["messages"][0]["content"] == f"# 情報\n{document}"
+    assert "参考文献" not in calls[1]["messages"][0]["content"]
+    assert calls[1]["messages"][-1]["content"] == "# 解説\nblog"
+    assert stats.calls[0].condensed_tokens == 0
+    assert stats.calls[1].condensed_tokens > 0
+
+    # nothing is collected outside of a job
+    await BloggerAgent(api_key="dummy", router=router).task(document)
+    assert len(stats.calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_writer_without_blog_reads_the_whole_document(monkeypatch):
+    calls = []
+
+    async def acompletion(**kwargs):
+        calls.append(kwargs)
+        return _response("ok")
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    router = _router("openai/gpt")
+    document = DOCUMENT + "\n参考文献\n" + "[1] 文献\n" * 1000
+
+    # fast mode: the script is written before the blog exists
+    await WriterAgent(api_key="dummy", router=router).task(document)
+
+    messages = calls[0]["messages"]
+    assert messages[0]["content"] == f"# 情報\n{document}"
+    assert not any(message["content"].startswith("# 解説") for message in messages)
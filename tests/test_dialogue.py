@@ -0,0 +1,95 @@
+from src.agent import Conversation
+from src.dialogue import parse_dialogue
+
+
+def test_parse_dialogue_sample():
+    with open("sample/rashoumon_dialogue.md", encoding="utf-8") as f:
+        dialogue = f.read()
+    with open("sample/rashoumon_conversation.json", encoding="utf-8") as f:
+        expected = Conversation.model_validate_json(f.read())
+
+    assert parse_dialogue(dialogue) == expected
+
+
+def test_parse_dialogue_formats():
+    dialogue = """## 脚本
+
+スピーカー: こんにちは。今日は**量子計算**の話です。
+サポーター：よろしくお願いします！
+
+（BGM がフェードアウト）
+
+**スピーカー**: （笑いながら）まずは基本からいきましょう。
+- A: はい、お願いします。
+"""
+    conversation = parse_dialogue(dialogue)
+
+    assert conversation is not None
+    assert [(d.role, d.content) for d in conversation.conversation] == [
+        ("speaker", "こんにちは。今日は量子計算の話です。"),
+        ("supporter", "よろしくお願いします！"),
+        ("speaker", "まずは基本からいきましょう。"),
+        ("supporter", "はい、お願いします。"),
+    ]
+
+
+def test_parse_dialogue_continuation_lines():
+    dialogue = """S: 今日は新しいモデルの話です。
+このモデルは、
+**従来の手法**より高速です。
+A: へえ！
+S:
+（資料を見ながら）論文のタイトルは
+Attention Is All You Need
+です。
+A: 有名ですね。
+"""
+    conversation = parse_dialogue(dialogue)
+
+    assert conversation is not None
+    assert [(d.role, d.content) for d in conversation.conversation] == [
+        (
+            "speaker",
+            "今日は新しいモデルの話です。このモデルは、従来の手法より高速です。",
+        ),
+        ("supporter", "へえ！"),
+        ("speaker", "論文のタイトルはAttention Is All You Needです。"),
+        ("supporter", "有名ですね。"),
+    ]
+
+
+def test_parse_dialogue_continuation_lines_with_colons():
+    dialogue = """S: 詳しくは論文のページを見てください。
+https://example.com/paper
+A: ポイントは何ですか？
+S: ポイントは二つあります。
+ポイント：速さ
+詳しくは：次回
+A: 楽しみです。
+"""
+    conversation = parse_dialogue(dialogue)
+
+    assert conversation is not None
+    assert [(d.role, d.content) for d in conversation.conversation] == [
+        ("speaker", "詳しくは論文のページを見てください。https://example.com/paper"),
+        ("supporter", "ポイントは何ですか？"),
+        ("speaker", "ポイントは二つあります。ポイント：速さ詳しくは：次回"),
+        ("supporter", "楽しみです。"),
+    ]
+
+
+def test_parse_dialogue_low_confidence():
+    # not a script
+    assert parse_dialogue("羅生門は芥川龍之介の短編小説です。") is None
+    # only one role
+    assert parse_dialogue("\n".join(["S: こんにちは"] * 10)) is None
+    # lines the parser does not understand
+    assert (
+        parse_dialogue(
+            "\n".join(
+                ["S: こんにちは", "A: どうも", "S: 今日は", "A: はい"]
+                + ["太郎: 割り込みます", "**花子**：割り込みます"]
+            )
+        )
+        is None
+    )
@@ -0,0 +1,60 @@
+import json
+
+from src.agent import Conversation, Dialogue
+from src.examples import BUNDLE_FILE, ExampleBundle, RenderedExample
+
+
+def make_example(url: str, audio: str) -> RenderedExample:
+    return RenderedExample(
+        title="LoRA",
+        url=url,
+        source="# LoRA",
+        blog="# blog",
+        dialogue="S: こんにちは",
+        conversation=Conversation(
+            conversation=[Dialogue(role="speaker", content="こんにちは")]
+        ),
+        speaker_name="Anneli (テンション高め)",
+        supporter_name="まい (ノーマル)",
+        speaker_id=1,
+        supporter_id=2,
+        audio=audio,
+    )
+
+
+def test_example_bundle(tmp_path):
+    assert ExampleBundle.load(tmp_path) is None
+
+    (tmp_path / "audio").mkdir()
+    (tmp_path / "audio" / "00.wav").write_bytes(b"RIFF")
+    bundle = ExampleBundle(
+        revision="abc1234",
+        examples=[
+            make_example("https://arxiv.org/pdf/2106.09685", "audio/00.wav"),
+            make_example("https://arxiv.org/pdf/2501.03575", "audio/01.wav"),
+        ],
+    )
+    bundle.save(tmp_path)
+
+    loaded = ExampleBundle.load(tmp_path)
+    assert loaded is not None
+    assert loaded.revision == "abc1234"
+    # the example whose audio is missing is dropped
+    assert [example.url for example in loaded.examples] == [
+        "https://arxiv.org/pdf/2106.09685"
+    ]
+    example = loaded.find("https://arxiv.org/pdf/2106.09685")
+    assert (
+        example is not None and example.conversation == bundle.examples[0].conversation
+    )
+    assert loaded.find("https://example.com") is None
+
+
+def test_example_bundle_version(tmp_path):
+    ExampleBundle().save(tmp_path)
+    data = json.loads((tmp_path / BUNDLE_FILE).read_text())
+    data["version"] = 0
+    (tmp_path / BUNDLE_FILE).write_text(json.dumps(data))
+
+    # built for another layout: rendered again rather than misread
+    assert ExampleBundle.load(tmp_path) is None
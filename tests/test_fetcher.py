@@ -1,7 +1,11 @@
-import pytest
+import asyncio
+import time
 
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 
-from src.fetcher import PDFFetcher, HTMLFetcher, AutoFetcher
+from src.fetcher import PDFFetcher, HTMLFetcher, AutoFetcher, allocate
 
 
 @pytest.mark.asyncio
@@ -40,3 +44,78 @@ async def test_fetch_auto():
     markdown_html = await fetcher.fetch(html_url)
     assert isinstance(markdown_html, str)
     assert len(markdown_html) > 0
+
+
+def _create_site(delay: float) -> web.Application:
+    pages = {
+        "paper": "論文の本文です。" * 50,
+        "project": "プロジェクトページです。",
+        "mirror": "論文の本文です。" * 50,
+        "blank": " \n",
+    }
+
+    async def page(request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        if name not in pages:
+            raise web.HTTPNotFound()
+        await asyncio.sleep(delay)
+        return web.Response(text=pages[name], content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/{name}", page)
+    return app
+
+
+def test_allocate():
+    assert allocate([10, 20], 100) == [10, 20]
+    assert allocate([10, 1000, 1000], 110) == [10, 50, 50]
+    assert allocate([1000, 10], 100) == [90, 10]
+
+
+@pytest.mark.asyncio
+async def test_fetch_all_concurrently():
+    server = TestServer(_create_site(delay=0.3))
+    await server.start_server()
+    try:
+        fetcher = AutoFetcher()
+        urls = [str(server.make_url(f"/{name}")) for name in ("paper", "project")]
+
+        start = time.monotonic()
+        document = await fetcher.fetch_all(urls + [urls[0]])
+        # about the slowest source, not the sum of them
+        assert time.monotonic() - start < 0.55
+
+        assert document.count("# 情報源") == 2
+        assert f"# 情報源 1: {urls[0]}" in document
+        assert f"# 情報源 2: {urls[1]}" in document
+    finally:
+        await server.close()
+
+
+@pytest.mark.asyncio
+async def test_fetch_all_drops_duplicates_and_failures():
+    server = TestServer(_create_site(delay=0))
+    await server.start_server()
+    try:
+        fetcher = AutoFetcher()
+        urls = [
+            str(server.make_url(f"/{name}"))
+            for name in ("paper", "mirror", "missing", "project")
+        ]
+
+        document = await fetcher.fetch_all(urls, max_chars=120)
+        assert document.count("# 情報源") == 2
+        assert "/mirror" not in document and "/missing" not in document
+        # the long paper is cut, the short page is kept whole
+        assert "(以下省略)" in document
+        assert "プロジェクトページです。" in document
+
+        with pytest.raises(Exception):
+            await fetcher.fetch_all(urls[2:3] * 2 + [urls[2] + "2"])
+
+        # nothing failed, but nothing is left either
+        blank = str(server.make_url("/blank"))
+        with pytest.raises(ValueError, match="No usable content"):
+            await fetcher.fetch_all([blank, blank + "?copy"])
+    finally:
+        await server.close()
@@ -0,0 +1,186 @@
+import pytest
+
+from src.agent import Conversation, Dialogue
+from src.jobqueue import JobQueue, JobRequest, LeaseLost
+
+
+def make_request(kind: str = "generate") -> JobRequest:
+    if kind == "generate":
+        return JobRequest(url="https://example.com", speaker_id=1, supporter_id=2)
+    return JobRequest(
+        kind="record",
+        conversation=Conversation(
+            conversation=[Dialogue(role="speaker", content="こんにちは")]
+        ),
+        speaker_id=1,
+        supporter_id=2,
+    )
+
+
+def test_claim_and_finish(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    job = queue.enqueue(make_request(), api_key="secret")
+    assert queue.position(job.id) == 1
+
+    claimed = queue.claim("worker-a", lease=30)
+    assert claimed is not None and claimed.id == job.id
+    assert claimed.status == "running"
+    assert claimed.attempts == 1
+    assert queue.position(job.id) is None
+    assert queue.claim("worker-b", lease=30) is None
+
+    # the key goes to the worker and is not kept in the file
+    assert claimed.api_key == "secret"
+    assert "secret" not in claimed.model_dump_json()
+    assert queue.get(job.id).api_key is None
+
+    queue.put_artifact(job.id, "worker-a", "blog.md", text="# blog")
+    queue.finish(job.id, "worker-a", "succeeded")
+
+    finished = queue.get(job.id)
+    assert finished is not None
+    assert finished.status == "succeeded"
+    assert finished.artifacts == ["blog.md"]
+    assert queue.artifact(job.id, "blog.md") == ("# blog", None)
+
+    types = [event.type for event in queue.events(job.id)]
+    assert types[0] == "status" and types[-1] == "status"
+    assert "artifact" in types
+
+
+def test_priority_order(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    first = queue.enqueue(make_request("generate"))
+    second = queue.enqueue(make_request("generate"))
+    record = queue.enqueue(make_request("record"))
+
+    # re-recordings go ahead of full generations
+    assert queue.position(record.id) == 1
+    assert queue.position(first.id) == 2
+    assert queue.position(second.id) == 3
+
+    claimed = [queue.claim("worker", lease=30) for _ in range(3)]
+    assert [job.id for job in claimed if job is not None] == [
+        record.id,
+        first.id,
+        second.id,
+    ]
+
+
+def test_expired_lease_is_retried(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db", max_attempts=2)
+    job = queue.enqueue(make_request())
+
+    assert queue.claim("worker-a", lease=-1) is not None
+    retried = queue.claim("worker-b", lease=-1)
+    assert retried is not None and retried.id == job.id
+    assert retried.worker == "worker-b"
+    assert retried.attempts == 2
+
+    # the old worker cannot report anymore
+    with pytest.raises(LeaseLost):
+        queue.heartbeat(job.id, "worker-a", lease=30)
+
+    # out of attempts
+    assert queue.claim("worker-c", lease=30) is None
+    failed = queue.get(job.id)
+    assert failed is not None
+    assert failed.status == "failed"
+
+
+def test_cancel(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    job = queue.enqueue(make_request())
+    assert queue.claim("worker", lease=30) is not None
+
+    cancelled = queue.cancel(job.id)
+    assert cancelled is not None
+    assert cancelled.status == "cancelled"
+    with pytest.raises(LeaseLost):
+        queue.heartbeat(job.id, "worker", lease=30)
+    assert queue.claim("worker", lease=30) is None
+
+
+def test_release(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    job = queue.enqueue(make_request())
+    assert queue.claim("worker-a", lease=30) is not None
+
+    queue.release(job.id, "worker-a")
+    assert queue.position(job.id) == 1
+    claimed = queue.claim("worker-b", lease=30)
+    assert claimed is not None and claimed.id == job.id
+
+
+def test_key_is_not_retried(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    released = queue.enqueue(make_request(), api_key="secret")
+    claimed = queue.claim("worker-a", lease=30)
+    assert claimed is not None and claimed.api_key == "secret"
+    # a worker shutting down hands the key back
+    queue.release(released.id, "worker-a", claimed.api_key)
+    claimed = queue.claim("worker-b", lease=-1)
+    assert claimed is not None and claimed.api_key == "secret"
+
+    # a worker that died took the key with it
+    assert queue.claim("worker-c", lease=30) is None
+    failed = queue.get(released.id)
+    assert failed is not None and failed.status == "failed"
+
+    # jobs without a key are retried as usual
+    job = queue.enqueue(make_request())
+    assert queue.claim("worker-a", lease=-1) is not None
+    retried = queue.claim("worker-b", lease=30)
+    assert retried is not None and retried.id == job.id and retried.api_key is None
+
+
+def test_prune(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    jobs = [queue.enqueue(make_request()) for _ in range(3)]
+    for job in jobs:
+        assert queue.claim("worker", lease=30) is not None
+    queue.put_artifact(jobs[0].id, "worker", "podcast.wav", path="/audio/old.wav")
+    queue.put_artifact(jobs[0].id, "worker", "segments/0", path="/audio/shared.wav")
+    queue.put_artifact(jobs[1].id, "worker", "segments/0", path="/audio/shared.wav")
+    queue.finish(jobs[0].id, "worker", "succeeded")
+    queue.finish(jobs[1].id, "worker", "succeeded")
+    running = queue.enqueue(make_request())
+
+    # the oldest finished job goes, the shared file stays with the newer one
+    assert queue.prune(max_jobs=1) == ["/audio/old.wav"]
+    assert queue.get(jobs[0].id) is None
+    assert queue.events(jobs[0].id) == []
+    assert queue.artifact(jobs[0].id, "podcast.wav") is None
+    assert queue.get(jobs[1].id) is not None
+
+    assert queue.prune(max_age=0) == ["/audio/shared.wav"]
+    assert queue.get(jobs[1].id) is None
+    # unfinished jobs are kept whatever their age
+    assert queue.get(jobs[2].id) is not None
+    assert queue.get(running.id) is not None
+
+
+def test_discard_artifacts(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    first = queue.enqueue(make_request())
+    second = queue.enqueue(make_request())
+    assert queue.claim("worker-a", lease=30) is not None
+    assert queue.claim("worker-b", lease=30) is not None
+
+    queue.put_artifact(first.id, "worker-a", "segments/0", path="/audio/shared.wav")
+    queue.put_artifact(first.id, "worker-a", "segments/1", path="/audio/own.wav")
+    queue.put_artifact(first.id, "worker-a", "blog.md", text="# blog")
+    queue.put_artifact(second.id, "worker-b", "segments/0", path="/audio/shared.wav")
+
+    queue.cancel(first.id)
+    with pytest.raises(LeaseLost):
+        queue.check(first.id, "worker-a")
+    queue.check(second.id, "worker-b")
+
+    # the shared file is still used by the second job
+    assert queue.discard_artifacts(first.id) == ["/audio/own.wav"]
+    job = queue.get(first.id)
+    assert job is not None and job.artifacts == []
+    assert queue.unreferenced(["/audio/shared.wav", "/audio/own.wav"]) == [
+        "/audio/own.wav"
+    ]
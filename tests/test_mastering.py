@@ -0,0 +1,152 @@
+import numpy as np
+
+
+from src.audio import Audio
+from src.mastering import (
+    MasteringConfig,
+    PodcastIndex,
+    Segment,
+    master,
+    master_indexed,
+    splice,
+)
+
+SAMPLE_RATE = 24000
+
+
+def make_audio(amplitude: float, voiced: float, silence: float = 0.2) -> Audio:
+    t = np.arange(int(voiced * SAMPLE_RATE)) / SAMPLE_RATE
+    tone = amplitude * np.sin(2 * np.pi * 220 * t)
+    pad = np.zeros(int(silence * SAMPLE_RATE))
+    samples = np.concatenate([pad, tone, pad])
+    pcm = (samples * 32767).astype("<i2")
+    return Audio.from_pcm(pcm.tobytes(), sample_rate=SAMPLE_RATE)
+
+
+def rms(samples: np.ndarray) -> float:
+    return float(np.sqrt(np.mean((samples / 32768.0) ** 2)))
+
+
+def test_master_levels_speakers_and_trims():
+    config = MasteringConfig(trim_padding=0.0, turn_gap=0.5)
+    segments = [
+        Segment(
+            "speaker", "こんにちは、今日はよろしくお願いします。", make_audio(0.5, 1.0)
+        ),
+        Segment(
+            "supporter",
+            "よろしくお願いします、楽しみにしていました！",
+            make_audio(0.05, 1.0),
+        ),
+    ]
+
+    audio = master(segments, config)
+    samples = np.frombuffer(audio.pcm, dtype="<i2")
+
+    # silence around each segment is trimmed and replaced by the configured gap
+    expected = 2 * SAMPLE_RATE + int(0.5 * SAMPLE_RATE)
+    assert abs(audio.num_frames - expected) < 10
+
+    speaker = samples[100 : SAMPLE_RATE - 100]
+    supporter = samples[-SAMPLE_RATE + 100 : -100]
+    assert abs(rms(speaker) - rms(supporter)) < 0.01
+    assert abs(20 * np.log10(rms(speaker)) - config.target_loudness_db) < 0.5
+
+
+def test_master_backchannel_gap():
+    config = MasteringConfig(trim_padding=0.0, turn_gap=0.5, backchannel_gap=0.1)
+    segments = [
+        Segment("speaker", "今日は論文を紹介します。", make_audio(0.3, 1.0)),
+        Segment("supporter", "なるほど！", make_audio(0.3, 0.5)),
+    ]
+
+    audio = master(segments, config)
+    expected = int(1.5 * SAMPLE_RATE) + int(0.1 * SAMPLE_RATE)
+    assert abs(audio.num_frames - expected) < 10
+
+
+def test_master_limits_peaks():
+    config = MasteringConfig(target_loudness_db=-3.0, ceiling_db=-1.0)
+    segments = [Segment("speaker", "大きな声で話します。", make_audio(0.9, 1.0))]
+
+    audio = master(segments, config)
+    samples = np.frombuffer(audio.pcm, dtype="<i2")
+    assert np.abs(samples).max() <= 10 ** (-1.0 / 20) * 32767 + 1
+
+
+def test_splice_replaces_one_line():
+    config = MasteringConfig()
+    segments = [
+        Segment("speaker", "今日は論文を紹介します。", make_audio(0.3, 1.0)),
+        Segment("supporter", "なるほど！", make_audio(0.1, 0.5)),
+        Segment("speaker", "まずは背景からです。", make_audio(0.3, 0.8)),
+    ]
+    podcast, index = master_indexed(segments, config)
+    assert podcast.wav == master(segments, config).wav
+    assert index.segments[0][0] == 0
+    assert sum(frames for _, frames in index.segments) < podcast.num_frames
+
+    # the same line again: nothing changes
+    same, same_index = splice(podcast, index, {1: segments[1]}, config)
+    assert same.wav == podcast.wav
+    assert same_index == index
+
+    # a longer line: the rest is shifted, not re-rendered
+    longer = Segment("supporter", "なるほど、面白いですね！", make_audio(0.1, 1.0))
+    edited, edited_index = splice(podcast, index, {1: longer}, config)
+    delta = edited_index.segments[1][1] - index.segments[1][1]
+    assert abs(delta - SAMPLE_RATE // 2) < 10
+    assert edited.num_frames == podcast.num_frames + delta
+    assert edited_index.segments[2][0] == index.segments[2][0] + delta
+
+    old = np.frombuffer(podcast.pcm, dtype="<i2")
+    new = np.frombuffer(edited.pcm, dtype="<i2")
+    start, frames = index.segments[2]
+    moved = new[start + delta : start + delta + frames]
+    assert np.array_equal(moved, old[start : start + frames])
+    assert np.array_equal(new[: index.segments[1][0]], old[: index.segments[1][0]])
+    # leveled with the episode's gain
+    start, frames = edited_index.segments[1]
+    expected = 0.1 / np.sqrt(2) * index.gains["supporter"]
+    assert abs(20 * np.log10(rms(new[start : start + frames]) / expected)) < 0.5
+
+
+def test_splice_without_mastering():
+    config = MasteringConfig(enabled=False)
+    audios = [make_audio(0.3, 0.5), make_audio(0.3, 0.3)]
+    podcast = Audio.concat(audios)
+    index = PodcastIndex.of_concat(audios)
+
+    replacement = make_audio(0.5, 0.4)
+    edited, edited_index = splice(
+        podcast, index, {0: Segment("speaker", "", replacement)}, config
+    )
+    assert edited.wav == Audio.concat([replacement, audios[1]]).wav
+    assert edited_index == PodcastIndex.of_concat([replacement, audios[1]])
+
+
+def test_splice_lays_out_pauses_around_lines_that_were_silent():
+    config = MasteringConfig()
+    segments = [
+        Segment("speaker", "今日は論文を紹介します。", make_audio(0.3, 1.0)),
+        Segment("supporter", "なるほど！", make_audio(0.0, 0.5)),
+        Segment("speaker", "まずは背景からです。", make_audio(0.3, 0.8)),
+    ]
+    podcast, index = master_indexed(segments, config)
+    assert index.segments[1][1] == 0
+
+    voiced = Segment("supporter", "なるほど！", make_audio(0.1, 0.5))
+    edited = [segments[0], voiced, segments[2]]
+    lines = [(segment.role, segment.text) for segment in edited]
+    spliced, spliced_index = splice(podcast, index, {1: voiced}, config, lines)
+    # the same layout as rendering the edited episode from scratch
+    _, fresh_index = master_indexed(edited, config)
+    assert spliced_index.segments == fresh_index.segments
+    assert spliced.num_frames == spliced_index.segments[2][0] + index.segments[2][1]
+
+    # and back to silent
+    silent, silent_index = splice(
+        spliced, spliced_index, {1: segments[1]}, config, lines
+    )
+    assert silent_index.segments == index.segments
+    assert silent.num_frames == podcast.num_frames
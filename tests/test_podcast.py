@@ -1,9 +1,18 @@
 import pytest
 import dotenv
 import os
+from aiohttp.test_utils import TestServer
 
+from mock_engine import create_engine
+import asyncio
+import time
+
+from src.agent import Conversation, Dialogue, Outline, OutlineSection
 from src.voicevox import VoiceVoxClient
-from src.podcast import PodcastStudio
+from src.podcast import PodcastStudio, make_batches
+from src.audio import Audio
+from src.mastering import MasteringConfig
+from src.scheduler import Scheduler
 
 dotenv.load_dotenv(".env.local")
 API_KEY = os.environ.get("GEMINI_API_KEY", "")
@@ -26,7 +35,8 @@ async def test_record_podcast_pdf():
     )
 
     assert podcast_audio is not None
-    assert isinstance(podcast_audio.wav, bytes)
+    assert isinstance(podcast_audio, Audio)
+    assert podcast_audio.num_frames > 0
 
     with open("./dist/arxiv_draft_blog.md", "wb") as f:
         f.write(_blog.encode("utf-8"))
@@ -59,7 +69,8 @@ async def test_record_podcast_html():
     )
 
     assert podcast_audio is not None
-    assert isinstance(podcast_audio.wav, bytes)
+    assert isinstance(podcast_audio, Audio)
+    assert podcast_audio.num_frames > 0
 
     with open("./dist/rashoumon_blog.md", "wb") as f:
         f.write(_blog.encode("utf-8"))
@@ -74,3 +85,208 @@ async def test_record_podcast_html():
         f.write(podcast_audio.wav)
 
     print("Podcast audio recorded successfully.")
+
+
+def test_make_batches():
+    lines = [
+        (0, 1, "a" * 10),
+        (1, 2, "b" * 10),
+        (2, 1, "c" * 10),
+        (3, 1, "d" * 10),
+        (4, 2, "e" * 50),
+        (5, 1, "f" * 10),
+    ]
+    batches = make_batches(lines, max_lines=2, max_chars=40)
+    assert [[index for index, _, _ in batch] for batch in batches] == [
+        [0, 2],
+        [1],
+        [3, 5],
+        [4],
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("has_multi_synthesis", [True, False])
+async def test_record_podcast_batches(has_multi_synthesis: bool):
+    conversation = Conversation(
+        conversation=[
+            Dialogue(role="speaker" if i % 3 else "supporter", content="あ" * (i + 1))
+            for i in range(10)
+        ]
+    )
+    app, calls = create_engine(has_multi_synthesis=has_multi_synthesis)
+    async with TestServer(app) as server:
+        podcast_studio = PodcastStudio(
+            api_key="",
+            mastering_config=MasteringConfig(enabled=False),
+            synthesis_batch_size=4,
+        )
+        segments = []
+        podcast_audio = await podcast_studio.record_podcast(
+            conversation=conversation,
+            voicevox_client=VoiceVoxClient(str(server.make_url("")).rstrip("/")),
+            speaker_id=1,
+            supporter_id=2,
+            on_segment=lambda index, audio: segments.append((index, audio.num_frames)),
+        )
+
+    assert sorted(segments) == [(i, 100 * (i + 1)) for i in range(10)]
+    assert podcast_audio.num_frames == sum(100 * (i + 1) for i in range(10))
+    if has_multi_synthesis:
+        assert calls["multi_synthesis"] == 3
+        assert calls["synthesis"] == 0
+    else:
+        assert calls["synthesis"] == 10
+
+
+@pytest.mark.asyncio
+async def test_record_variants_share_lines():
+    conversation = Conversation(
+        conversation=[
+            Dialogue(role="speaker" if i % 3 else "supporter", content="あ" * (i + 1))
+            for i in range(10)
+        ]
+    )
+    app, calls = create_engine(has_multi_synthesis=False, styles=(1, 2, 3))
+    async with TestServer(app) as server:
+        podcast_studio = PodcastStudio(
+            api_key="",
+            mastering_config=MasteringConfig(enabled=False),
+            scheduler=Scheduler(limits={"engine": 4}),
+        )
+        segments = []
+        indexes = []
+        podcasts = await podcast_studio.record_variants(
+            conversation=conversation,
+            voicevox_client=VoiceVoxClient(str(server.make_url("")).rstrip("/")),
+            # the same supporter in both
+            voices=[(1, 2), (3, 2)],
+            on_segment=lambda pair, index, audio: segments.append((pair, index)),
+            on_index=lambda pair, index: indexes.append(pair),
+        )
+
+    # the supporter's 4 lines are synthesized once for both pairs
+    assert calls["synthesis"] == 6 * 2 + 4
+    assert sorted(segments) == [(pair, i) for pair in range(2) for i in range(10)]
+    assert sorted(indexes) == [0, 1]
+    for podcast in podcasts:
+        assert podcast.num_frames == sum(100 * (i + 1) for i in range(10))
+
+
+@pytest.mark.asyncio
+async def test_rerecord_lines_batches():
+    conversation = Conversation(
+        conversation=[
+            Dialogue(role="speaker" if i % 3 else "supporter", content="あ" * (i + 1))
+            for i in range(10)
+        ]
+    )
+    app, calls = create_engine(has_multi_synthesis=True)
+    async with TestServer(app) as server:
+        podcast_studio = PodcastStudio(
+            api_key="",
+            mastering_config=MasteringConfig(enabled=False),
+            synthesis_batch_size=4,
+        )
+        voicevox_client = VoiceVoxClient(str(server.make_url("")).rstrip("/"))
+        indexes = []
+        podcast = await podcast_studio.record_podcast(
+            conversation=conversation,
+            voicevox_client=voicevox_client,
+            speaker_id=1,
+            supporter_id=2,
+            on_index=indexes.append,
+        )
+
+        edited = conversation.model_copy(deep=True)
+        for line in (1, 2, 5):
+            edited.conversation[line].content = "い" * 20
+        calls["multi_synthesis"] = 0
+        segments = []
+        spliced, index = await podcast_studio.rerecord_lines(
+            edited,
+            [1, 2, 5],
+            podcast,
+            indexes[0],
+            voicevox_client,
+            speaker_id=1,
+            supporter_id=2,
+            on_segment=lambda line, audio: segments.append(line),
+        )
+
+    # the speaker's lines go in one request, like a full recording
+    assert calls["multi_synthesis"] == 1
+    assert sorted(segments) == [1, 2, 5]
+    lengths = [20 if i in (1, 2, 5) else i + 1 for i in range(10)]
+    assert [frames for _, frames in index.segments] == [100 * n for n in lengths]
+    assert spliced.num_frames == 100 * sum(lengths)
+
+
+@pytest.mark.asyncio
+async def test_write_dialogue_sections_in_parallel():
+    podcast_studio = PodcastStudio(api_key="", section_parallel=True)
+    writer = podcast_studio.section_writer
+    calls = []
+
+    async def outline(information: str, blog: str) -> Outline:
+        return Outline(
+            intro="イントロ",
+            sections=[
+                OutlineSection(title=f"セクション {i}", points=[]) for i in range(4)
+            ],
+            outro="アウトロ",
+        )
+
+    async def section(information: str, blog: str, outline: Outline, index: int):
+        calls.append(index)
+        await asyncio.sleep(0.2)
+        if index == 2 and calls.count(2) == 1:
+            return "承知しました。"  # broken the first time
+        return f"S: パート {index} です。\nA: なるほど。"
+
+    writer.outline = outline  # type: ignore
+    writer.section = section  # type: ignore
+
+    start = time.time()
+    dialogue = await podcast_studio.write_dialogue("paper", "blog")
+    elapsed = time.time() - start
+
+    # six parts, one rewritten, in about two sections' time
+    assert sorted(calls) == [0, 1, 2, 2, 3, 4, 5]
+    assert elapsed < 0.6
+    for i in range(6):
+        assert f"S: パート {i} です。" in dialogue
+
+
+@pytest.mark.asyncio
+async def test_draft_conversation_writes_the_blog_alongside():
+    podcast_studio = PodcastStudio(api_key="")
+    stages = []
+
+    async def fetch_all(urls: list[str], on_fetched=None) -> str:
+        return "paper"
+
+    async def blog(information: str) -> str:
+        await asyncio.sleep(0.3)
+        return "blog"
+
+    async def dialogue(information: str, blog: str | None = None) -> str:
+        assert blog is None
+        await asyncio.sleep(0.2)
+        return "\n".join(f"S: 台詞 {i}\nA: なるほど" for i in range(2))
+
+    podcast_studio.fetcher.fetch_all = fetch_all  # type: ignore
+    podcast_studio.blogger.task = blog  # type: ignore
+    podcast_studio.writer.task = dialogue  # type: ignore
+
+    start = time.time()
+    blog_task, _dialogue, conversation = await podcast_studio.draft_conversation(
+        "https://example.com",
+        on_progress=lambda event: stages.append((event.stage, event.status)),
+    )
+    # the script did not wait for the blog
+    assert time.time() - start < 0.3
+    assert len(conversation.conversation) == 4
+    assert await blog_task == "blog"
+    assert ("blog", "finished") in stages
+    assert stages.index(("dialogue", "finished")) < stages.index(("blog", "finished"))
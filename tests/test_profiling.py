@@ -0,0 +1,68 @@
+import asyncio
+import pstats
+import time
+
+import pytest
+
+from src.profiling import JobProfiler
+
+
+def _busy(seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def block_the_loop(seconds: float):
+    # called from a coroutine: nothing else runs meanwhile
+    _busy(seconds)
+
+
+@pytest.mark.asyncio
+async def test_job_profiler(tmp_path):
+    profiler = JobProfiler(interval=0.002, block_threshold=0.1, lag_interval=0.01)
+    profiler.start()
+
+    profiler.set_stage("fetch")
+    await asyncio.sleep(0.05)
+    await asyncio.to_thread(_busy, 0.1)
+
+    profiler.set_stage("blog")
+    block_the_loop(0.3)
+    await asyncio.sleep(0.02)
+
+    report = profiler.stop()
+    assert set(report.stages) == {"setup", "fetch", "blog"}
+    assert report.stages["blog"] >= 0.3
+    assert report.loop_lag_max >= 0.2
+    assert report.samples > 0
+
+    # the stall is reported with the code that caused it
+    assert len(report.blocked) == 1
+    assert report.blocked[0].stage == "blog"
+    assert report.blocked[0].seconds >= 0.2
+    assert any("block_the_loop" in frame for frame in report.blocked[0].stack)
+
+    # work in threads is sampled under its stage
+    collapsed = profiler.collapsed().splitlines()
+    assert any(line.startswith("fetch;") and "_busy" in line for line in collapsed)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in collapsed)
+
+    stats = profiler.pstats()
+    assert stats is not None and report.cprofile
+    path = tmp_path / "profile.pstats"
+    path.write_bytes(stats)
+    functions = {name for _, _, name in pstats.Stats(str(path)).stats}  # type: ignore[attr-defined]
+    assert "block_the_loop" in functions
+
+
+@pytest.mark.asyncio
+async def test_job_profiler_shares_cprofile():
+    first = JobProfiler()
+    second = JobProfiler()
+    first.start()
+    second.start()
+    # one cProfile per thread: the second job only samples
+    assert second.stop().cprofile is False
+    assert second.pstats() is None
+    assert first.stop().cprofile is True
@@ -0,0 +1,50 @@
+from src.progress import STAGES, ProgressEvent, ProgressReporter, StageStats
+
+
+def test_progress_reporter():
+    events: list[ProgressEvent] = []
+    progress = ProgressReporter(events.append)
+
+    with progress.stage("recording", total=2):
+        progress.advance("recording", 1, 2)
+        progress.advance("recording", 2, 2)
+
+    assert [(e.status, e.done, e.total) for e in events] == [
+        ("started", 0, 2),
+        ("progress", 1, 2),
+        ("progress", 2, 2),
+        ("finished", 2, 2),
+    ]
+
+    # no callback, no events
+    with ProgressReporter().stage("blog"):
+        pass
+
+
+def test_stage_stats_eta():
+    stats = StageStats(window=2)
+
+    event = ProgressEvent(stage="blog", status="started")
+    # never seen the stages left
+    assert stats.eta(STAGES, event) is None
+
+    stats.record("blog", 30.0)
+    stats.record("dialogue", 60.0)
+    stats.record("structure", 5.0)
+    stats.record("recording", 100.0, units=50)
+    assert stats.eta(STAGES[1:], event) == 30 + 60 + 5 + 100
+
+    # the window keeps the last runs only
+    stats.record("blog", 20.0)
+    stats.record("blog", 20.0)
+    assert stats.duration("blog") == 20
+
+    # recording: from this job's own pace once lines are done
+    event = ProgressEvent(
+        stage="recording", status="progress", done=10, total=50, elapsed=10.0
+    )
+    assert stats.eta(STAGES, event) == 40
+    event = ProgressEvent(stage="recording", status="started", total=50)
+    assert stats.eta(STAGES, event) == 100
+    event = ProgressEvent(stage="recording", status="finished", done=50, total=50)
+    assert stats.eta(STAGES, event) == 0
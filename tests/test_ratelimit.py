@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from src.ratelimit import RateLimit, RateLimiter, TokenBucket, estimate_tokens
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock=clock)
+
+    # a minute's worth at once, then one per second
+    assert all(bucket.reserve(1) == 0 for _ in range(60))
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    assert bucket.reserve(1) == pytest.approx(2.0)
+
+    clock.now = 10
+    assert bucket.reserve(1) == 0
+    bucket.refund(100)
+    assert bucket.level == 60
+
+
+def test_estimate_tokens():
+    assert estimate_tokens([{"role": "user", "content": "あいうえお"}]) == 5
+    assert estimate_tokens([{"role": "user", "content": "abcdef"}]) == 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_queues_calls():
+    clock = FakeClock()
+    limiter = RateLimiter(
+        {"model": RateLimit(requests_per_minute=2, tokens_per_minute=600)},
+        clock=clock,
+        sleep=clock.sleep,
+    )
+
+    await limiter.acquire("key", "model", 100)
+    await limiter.acquire("key", "model", 100)
+    assert clock.sleeps == []
+
+    # the third request of the minute waits for a request slot
+    await limiter.acquire("key", "model", 100)
+    assert clock.sleeps == [pytest.approx(30.0)]
+
+    # other keys and unlimited models do not wait
+    await limiter.acquire("other", "model", 100)
+    await limiter.acquire("key", "unlimited", 10_000)
+    assert len(clock.sleeps) == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_corrects_tokens():
+    clock = FakeClock()
+    limiter = RateLimiter(
+        {"model": RateLimit(tokens_per_minute=600)}, clock=clock, sleep=clock.sleep
+    )
+
+    reservation = await limiter.acquire("key", "model", 600)
+    # used far less than estimated: the rest is available again
+    reservation.settle(100)
+    await limiter.acquire("key", "model", 500)
+    assert clock.sleeps == []
+
+    # a cancelled waiter gives its tokens back
+    async def never(_seconds: float):
+        await asyncio.Event().wait()
+
+    limiter.sleep = never
+    task = asyncio.create_task(limiter.acquire("key", "model", 300))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    limiter.sleep = clock.sleep
+    await limiter.acquire("key", "model", 0)
+    assert clock.sleeps == []
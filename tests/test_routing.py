@@ -0,0 +1,241 @@
+import asyncio
+import time
+
+import pytest
+
+import litellm
+from litellm.types.utils import ModelResponse
+
+from src.agent import BloggerAgent, StructureAgent
+from src.ratelimit import RateLimit, Reservation
+from src.routing import ModelRoute, Router, RoutingConfig
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _config(**kwargs) -> RoutingConfig:
+    return RoutingConfig(
+        routes={
+            "writer": [
+                ModelRoute(model="small", max_tokens=1024, max_input_chars=100),
+                ModelRoute(model="fast", max_tokens=4096, max_latency=10),
+                ModelRoute(model="large", max_tokens=8192, thinking_budget=2048),
+            ]
+        },
+        min_samples=2,
+        **kwargs,
+    )
+
+
+def _models(routes: list[ModelRoute]) -> list[str]:
+    return [route.model for route in routes]
+
+
+def test_router_routes_by_input_size():
+    router = Router(_config())
+
+    assert _models(router.choose("writer", 50)) == ["small", "fast", "large"]
+    assert _models(router.choose("writer", 5_000)) == ["fast", "large"]
+    # no routes: the agent uses its own settings
+    assert router.choose("blogger", 50) == []
+
+
+def test_router_demotes_slow_and_failing_models():
+    router = Router(_config())
+
+    router.record("fast", 30.0)
+    assert _models(router.choose("writer", 5_000)) == ["large", "fast"]
+
+    router = Router(_config(max_error_rate=0.5))
+    router.record("fast", 1.0, error=TimeoutError())
+    router.record("fast", 1.0, error=TimeoutError())
+    assert router.error_rate("fast") == 1.0
+    assert _models(router.choose("writer", 5_000)) == ["large", "fast"]
+
+    # recovers once the failures leave the window
+    for _ in range(router.config.window):
+        router.record("fast", 1.0)
+    assert _models(router.choose("writer", 5_000)) == ["fast", "large"]
+
+
+def test_router_cools_down_rate_limited_models():
+    clock = FakeClock()
+    router = Router(_config(rate_limit_cooldown=60), clock=clock)
+
+    router.record("fast", 0.1, error=RuntimeError(), rate_limited=True)
+    assert _models(router.choose("writer", 5_000)) == ["large", "fast"]
+    assert router.stats()["fast"]["cooling_down"]
+
+    clock.now = 61
+    assert _models(router.choose("writer", 5_000)) == ["fast", "large"]
+
+
+def _response(content: str) -> ModelResponse:
+    return ModelResponse(
+        choices=[{"message": {"role": "assistant", "content": content}}]
+    )
+
+
+@pytest.mark.asyncio
+async def test_agent_falls_back_to_next_route(monkeypatch):
+    calls = []
+
+    async def acompletion(**kwargs):
+        calls.append(kwargs)
+        if kwargs["model"] == "gemini/primary":
+            raise litellm.RateLimitError(
+                message="quota", llm_provider="gemini", model="primary"
+            )
+        return _response("blog")
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    router = Router(
+        RoutingConfig(
+            routes={
+                "blogger": [
+                    ModelRoute(model="gemini/primary", max_tokens=100),
+                    ModelRoute(
+                        model="openai/fallback", max_tokens=200, thinking_budget=0
+                    ),
+                ]
+            }
+        )
+    )
+    agent = BloggerAgent(api_key="dummy", router=router)
+
+    assert await agent.task("information") == "blog"
+    assert [call["model"] for call in calls] == ["gemini/primary", "openai/fallback"]
+    assert calls[1]["max_completion_tokens"] == 200
+    assert calls[1]["thinking"] == {"type": "disabled"}
+    # gemini only options are not sent to other providers
+    assert "safety_settings" in calls[0] and "safety_settings" not in calls[1]
+
+    # the rate limited model is skipped next time
+    calls.clear()
+    assert await agent.task("information") == "blog"
+    assert [call["model"] for call in calls] == ["openai/fallback"]
+
+
+@pytest.mark.asyncio
+async def test_agent_skips_unhealthy_routes(monkeypatch):
+    calls = []
+
+    async def acompletion(**kwargs):
+        calls.append(kwargs["model"])
+        raise litellm.RateLimitError(
+            message="quota", llm_provider="openai", model=kwargs["model"]
+        )
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    router = Router(
+        RoutingConfig(
+            routes={
+                "blogger": [
+                    ModelRoute(model="openai/primary", max_tokens=100),
+                    ModelRoute(model="openai/fallback", max_tokens=100),
+                ]
+            },
+            # fail instead of waiting for the models to cool down
+            max_rate_limit_wait=0,
+        )
+    )
+    router.record("openai/primary", 0.1, error=RuntimeError(), rate_limited=True)
+    agent = BloggerAgent(api_key="dummy", router=router)
+
+    # the cooling down model is not tried after the healthy one fails
+    with pytest.raises(litellm.RateLimitError):
+        await agent.task("information")
+    assert calls == ["openai/fallback"]
+
+    # with no healthy route left, every route is tried
+    calls.clear()
+    with pytest.raises(litellm.RateLimitError):
+        await agent.task("information")
+    assert calls == ["openai/primary", "openai/fallback"]
+
+
+@pytest.mark.asyncio
+async def test_agent_waits_for_the_only_route_to_cool_down(monkeypatch):
+    calls = []
+
+    async def acompletion(**kwargs):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise litellm.RateLimitError(
+                message="quota", llm_provider="openai", model=kwargs["model"]
+            )
+        return _response("blog")
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    router = Router(RoutingConfig(rate_limit_cooldown=0.2, max_rate_limit_wait=1))
+    agent = BloggerAgent(api_key="dummy", router=router)
+
+    assert await agent.task("information") == "blog"
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.15
+
+    # gives up once the wait would go over the limit
+    calls.clear()
+    router.config.max_rate_limit_wait = 0.1
+    with pytest.raises(litellm.RateLimitError):
+        await agent.task("information")
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_agent_settles_reservations(monkeypatch):
+    settled = []
+    monkeypatch.setattr(Reservation, "settle", lambda self, used: settled.append(used))
+    started = asyncio.Event()
+
+    async def acompletion(**kwargs):
+        if kwargs["api_key"] == "wrong":
+            raise litellm.AuthenticationError(
+                message="bad key", llm_provider="openai", model=kwargs["model"]
+            )
+        started.set()
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    config = RoutingConfig(
+        routes={"blogger": [ModelRoute(model="openai/model", max_tokens=100)]},
+        rate_limits={"openai/model": RateLimit(tokens_per_minute=100_000)},
+    )
+
+    agent = BloggerAgent(api_key="wrong", router=Router(config))
+    with pytest.raises(litellm.AuthenticationError):
+        await agent.task("information")
+    # nothing was used
+    assert settled == [0]
+
+    agent = BloggerAgent(api_key="dummy", router=Router(config))
+    task = asyncio.create_task(agent.task("information"))
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # the request may have been served: the estimate is kept
+    assert settled == [0, None]
+
+
+@pytest.mark.asyncio
+async def test_agent_defaults_to_class_attributes(monkeypatch):
+    calls = []
+
+    async def acompletion(**kwargs):
+        calls.append(kwargs)
+        return _response('{"conversation": []}')
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    agent = StructureAgent(api_key="dummy", router=Router())
+
+    await agent.task("S: こんにちは")
+    assert calls[0]["model"] == StructureAgent.model
+    assert calls[0]["max_completion_tokens"] == StructureAgent.max_tokens
+    assert calls[0]["thinking"] == {"type": "disabled"}
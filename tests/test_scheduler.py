@@ -0,0 +1,140 @@
+import asyncio
+import pytest
+
+
+from src.scheduler import Scheduler, Priority
+
+
+async def occupy(
+    scheduler: Scheduler, resource: str, started: asyncio.Event, release: asyncio.Event
+):
+    with scheduler.context("blocker", Priority.GENERATE):
+        async with scheduler.slot(resource):
+            started.set()
+            await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_priority_order():
+    scheduler = Scheduler(limits={"engine": 1})
+    started, release = asyncio.Event(), asyncio.Event()
+    blocker = asyncio.create_task(occupy(scheduler, "engine", started, release))
+    await started.wait()
+
+    order = []
+
+    async def job(session: str, priority: Priority):
+        with scheduler.context(session, priority):
+            async with scheduler.slot("engine"):
+                order.append(session)
+
+    tasks = [
+        asyncio.create_task(job("generate", Priority.GENERATE)),
+        asyncio.create_task(job("rerecord", Priority.RERECORD)),
+        asyncio.create_task(job("preview", Priority.PREVIEW)),
+    ]
+    await asyncio.sleep(0)
+    assert scheduler.position("preview") == 1
+    assert scheduler.position("generate") == 3
+
+    release.set()
+    await asyncio.gather(blocker, *tasks)
+    assert order == ["preview", "rerecord", "generate"]
+
+
+@pytest.mark.asyncio
+async def test_scheduler_fair_share():
+    scheduler = Scheduler(limits={"engine": 2})
+    order = []
+
+    async def line(session: str, index: int):
+        with scheduler.context(session, Priority.GENERATE):
+            async with scheduler.slot("engine"):
+                order.append(session)
+                await asyncio.sleep(0.01)
+
+    # session a queues many lines before b arrives, b still gets every other slot
+    tasks = [asyncio.create_task(line("a", i)) for i in range(6)]
+    await asyncio.sleep(0)
+    tasks += [asyncio.create_task(line("b", i)) for i in range(2)]
+    await asyncio.gather(*tasks)
+
+    assert order.index("b") < 4
+
+
+@pytest.mark.asyncio
+async def test_scheduler_memory_budget_and_positions():
+    scheduler = Scheduler(limits={"engine": 4}, inflight_memory_budget=100)
+    started, release = asyncio.Event(), asyncio.Event()
+    positions = []
+
+    async def big():
+        with scheduler.context("big", Priority.GENERATE):
+            async with scheduler.slot("engine", memory=80):
+                started.set()
+                await release.wait()
+
+    async def small():
+        with scheduler.context(
+            "small", Priority.GENERATE, on_position=positions.append
+        ):
+            async with scheduler.slot("engine", memory=80):
+                pass
+
+    task_big = asyncio.create_task(big())
+    await started.wait()
+    task_small = asyncio.create_task(small())
+    await asyncio.sleep(0)
+    assert scheduler.stats()["waiting"]["engine"] == 1
+
+    release.set()
+    await asyncio.gather(task_big, task_small)
+    assert positions == [1, 0]
+    assert scheduler.stats()["inflight_memory"] == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_cancel_waiting():
+    scheduler = Scheduler(limits={"engine": 1})
+    started, release = asyncio.Event(), asyncio.Event()
+    blocker = asyncio.create_task(occupy(scheduler, "engine", started, release))
+    await started.wait()
+
+    async def job():
+        async with scheduler.slot("engine"):
+            pass
+
+    task = asyncio.create_task(job())
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    release.set()
+    await blocker
+    assert scheduler.stats()["active"]["engine"] == 0
+    assert scheduler.stats()["waiting"]["engine"] == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_positions_count_unwatched_waiters():
+    scheduler = Scheduler(limits={"engine": 1})
+    started, release = asyncio.Event(), asyncio.Event()
+    blocker = asyncio.create_task(occupy(scheduler, "engine", started, release))
+    await started.wait()
+    positions = []
+
+    async def job(session: str, on_position=None):
+        with scheduler.context(session, Priority.GENERATE, on_position=on_position):
+            async with scheduler.slot("engine"):
+                pass
+
+    tasks = [asyncio.create_task(job("worker"))]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(job("watched", positions.append)))
+    await asyncio.sleep(0)
+    assert positions == [2]
+
+    release.set()
+    await asyncio.gather(blocker, *tasks)
+    assert positions == [2, 1, 0]
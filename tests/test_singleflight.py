@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+
+
+from src.singleflight import SingleFlight, digest
+
+
+@pytest.mark.asyncio
+async def test_singleflight_shares_one_call():
+    flights = SingleFlight()
+    calls = 0
+    release = asyncio.Event()
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "result"
+
+    waiters = [asyncio.create_task(flights.do("key", work)) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert len(flights) == 1
+
+    release.set()
+    assert await asyncio.gather(*waiters) == ["result"] * 5
+    assert calls == 1
+    assert len(flights) == 0
+
+    # finished calls are not cached
+    assert await flights.do("key", work) == "result"
+    assert calls == 2
+
+
+@pytest.mark.asyncio
+async def test_singleflight_propagates_errors():
+    flights = SingleFlight()
+    release = asyncio.Event()
+
+    async def work():
+        await release.wait()
+        raise ValueError("failed")
+
+    waiters = [asyncio.create_task(flights.do("key", work)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(flights) == 0
+
+
+@pytest.mark.asyncio
+async def test_singleflight_cancellation():
+    flights = SingleFlight()
+    release = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def work():
+        try:
+            await release.wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "result"
+
+    first = asyncio.create_task(flights.do("key", work))
+    second = asyncio.create_task(flights.do("key", work))
+    await asyncio.sleep(0)
+
+    # one waiter leaving does not stop the call for the others
+    first.cancel()
+    await asyncio.sleep(0)
+    assert first.cancelled()
+    assert not cancelled.is_set()
+    release.set()
+    assert await second == "result"
+
+    # the call is cancelled once nobody waits for it
+    release.clear()
+    only = asyncio.create_task(flights.do("other", work))
+    await asyncio.sleep(0)
+    only.cancel()
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    assert len(flights) == 0
+
+
+def test_digest():
+    assert digest("ab", "c") != digest("a", "bc")
+    assert digest("a", b"b") == digest(b"a", "b")
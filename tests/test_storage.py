@@ -0,0 +1,93 @@
+import os
+import time
+from pathlib import Path
+
+
+from src.jobqueue import JobQueue, JobRequest
+from src.storage import AudioStore
+
+
+def test_audio_store_dedup(tmp_path):
+    store = AudioStore(tmp_path / "audio", max_bytes=1024)
+
+    path_1 = store.put(b"RIFF" + b"\x00" * 100)
+    path_2 = store.put(b"RIFF" + b"\x00" * 100)
+    assert path_1 == path_2
+    assert Path(path_1).read_bytes() == b"RIFF" + b"\x00" * 100
+    assert store.total_bytes == 104
+
+    # no temporary files are left behind
+    assert sorted(os.listdir(store.root)) == [Path(path_1).name]
+
+
+def test_audio_store_lru_eviction(tmp_path):
+    store = AudioStore(tmp_path / "audio", max_bytes=250)
+
+    path_a = store.put(b"a" * 100)
+    path_b = store.put(b"b" * 100)
+    assert store.get(path_a) is not None  # a is now the most recently used
+
+    path_c = store.put(b"c" * 100)
+    assert store.get(path_b) is None
+    assert not Path(path_b).exists()
+    assert store.get(path_a) is not None
+    assert store.get(path_c) is not None
+    assert store.total_bytes == 200
+
+
+def test_audio_store_ttl(tmp_path):
+    store = AudioStore(tmp_path / "audio", ttl=0.05)
+
+    path_a = store.put(b"a" * 10)
+    time.sleep(0.1)
+    path_b = store.put(b"b" * 10)
+
+    assert store.get(path_a) is None
+    assert store.get(path_b) is not None
+
+
+def test_audio_store_rescan(tmp_path):
+    store = AudioStore(tmp_path / "audio")
+    path = store.put(b"a" * 10)
+
+    reopened = AudioStore(tmp_path / "audio")
+    assert reopened.get(path) == path
+    assert reopened.total_bytes == 10
+
+
+def test_audio_store_remove(tmp_path):
+    store = AudioStore(tmp_path / "audio")
+
+    path = store.put(b"RIFF" + b"\x00" * 100)
+    store.remove(path)
+    assert not Path(path).exists()
+    assert store.get(path) is None
+    assert store.total_bytes == 0
+
+    # removing twice is fine
+    store.remove(path)
+
+
+def test_audio_store_keeps_pinned_files(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    store = AudioStore(
+        tmp_path / "audio", max_bytes=250, ttl=0.05, pinned=queue.artifact_files
+    )
+
+    path_a = store.put(b"a" * 100)
+    job = queue.enqueue(
+        JobRequest(url="https://example.com", speaker_id=1, supporter_id=2)
+    )
+    queue.claim("worker", lease=30)
+    queue.put_artifact(job.id, "worker", "podcast.wav", path=path_a)
+
+    # another process sharing the directory, which never accessed the file
+    other = AudioStore(tmp_path / "audio", max_bytes=250, pinned=queue.artifact_files)
+    other.put(b"b" * 100)
+    other.put(b"c" * 100)
+    time.sleep(0.1)
+    store.put(b"d" * 100)
+
+    # over the budget and expired, but a job still refers to it
+    assert Path(path_a).exists()
+    assert store.get(path_a) is not None
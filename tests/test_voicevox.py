@@ -1,7 +1,16 @@
+import orjson
 import pytest
+from aiohttp.test_utils import TestServer
 
+from mock_engine import create_engine
 
-from src.voicevox import VoiceVoxClient
+from src.voicevox import (
+    AudioQuery,
+    EngineUnavailable,
+    UnsupportedEndpoint,
+    VoiceVoxClient,
+)
+from src.audio import Audio
 
 
 @pytest.mark.asyncio
@@ -82,7 +91,8 @@ async def test_voicevox_synthesis():
         core_version=core_version,
     )
     assert audio_data is not None
-    assert isinstance(audio_data.wav, bytes)
+    assert isinstance(audio_data, Audio)
+    assert audio_data.num_frames > 0
 
 
 @pytest.mark.asyncio
@@ -109,7 +119,8 @@ async def test_aivis_synthesis():
         core_version=core_version,
     )
     assert audio_data is not None
-    assert isinstance(audio_data.wav, bytes)
+    assert isinstance(audio_data, Audio)
+    assert audio_data.num_frames > 0
 
 
 @pytest.mark.asyncio
@@ -136,7 +147,8 @@ async def test_aivis_connect_waves():
         core_version=core_version,
     )
     assert audio_data is not None
-    assert isinstance(audio_data.wav, bytes)
+    assert isinstance(audio_data, Audio)
+    assert audio_data.num_frames > 0
 
     audio_data2 = await client.post_synthesis(
         speaker=speakers[0].styles[0].id,
@@ -145,10 +157,185 @@ async def test_aivis_connect_waves():
         core_version=core_version,
     )
     assert audio_data2 is not None
-    assert isinstance(audio_data2.wav, bytes)
+    assert isinstance(audio_data2, Audio)
+    assert audio_data2.num_frames > 0
 
     connected_waves = await client.post_connect_waves(
         [audio_data, audio_data2],
     )
     assert connected_waves is not None
-    assert isinstance(connected_waves.wav, bytes)
+    assert isinstance(connected_waves, Audio)
+    assert connected_waves.num_frames > 0
+
+
+AUDIO_QUERY = {
+    "accent_phrases": [
+        {
+            "moras": [{"text": "コ", "consonant": "k", "vowel": "o", "pitch": 5.5}],
+            "accent": 1,
+            "is_interrogative": False,
+        }
+    ],
+    "speedScale": 1.0,
+    "intonationScale": 1.0,
+    "pitchScale": 0.0,
+    "volumeScale": 1.0,
+    "prePhonemeLength": 0.1,
+    "postPhonemeLength": 0.1,
+    "pauseLength": None,
+    "pauseLengthScale": 1.0,
+    "outputSamplingRate": 24000,
+    "outputStereo": False,
+    "kana": "コ'",
+    "unknownField": {"kept": True},
+}
+
+
+def test_audio_query_passthrough():
+    raw = orjson.dumps(AUDIO_QUERY)
+    audio_query = AudioQuery(raw)
+
+    # untouched queries are sent back byte for byte
+    assert audio_query.to_json() is raw
+
+    assert audio_query.speedScale == 1.0
+    assert audio_query.outputSamplingRate == 24000
+    assert audio_query.tempoDynamicsScale is None
+    assert audio_query.pauseLength is None
+
+    audio_query.speedScale = 1.1
+    sent = orjson.loads(audio_query.to_json())
+    assert sent["speedScale"] == 1.1
+    assert sent["unknownField"] == {"kept": True}
+    assert sent["accent_phrases"] == AUDIO_QUERY["accent_phrases"]
+    assert "tempoDynamicsScale" not in sent
+
+
+def test_audio_query_optional_fields():
+    data = {
+        key: value
+        for key, value in AUDIO_QUERY.items()
+        if key not in ("pauseLength", "pauseLengthScale")
+    }
+    data["tempoDynamicsScale"] = 1.0
+    audio_query = AudioQuery(orjson.dumps(data))
+
+    assert audio_query.tempoDynamicsScale == 1.0
+    assert audio_query.pauseLength is None
+    assert audio_query.pauseLengthScale == 1.0
+
+    audio_query.tempoDynamicsScale = 1.1
+    sent = orjson.loads(audio_query.to_json())
+    assert sent["tempoDynamicsScale"] == 1.1
+    assert "pauseLength" not in sent
+
+
+@pytest.mark.asyncio
+async def test_multi_synthesis():
+    app, calls = create_engine()
+    async with TestServer(app) as server:
+        client = VoiceVoxClient(str(server.make_url("")).rstrip("/"))
+        assert client.supports_multi_synthesis is None
+
+        texts = ["こんにちは", "はい", "さようなら"]
+        audio_queries = [
+            await client.post_audio_query(text=text, speaker=1) for text in texts
+        ]
+        audios = await client.post_multi_synthesis(
+            speaker=1, audio_queries=audio_queries
+        )
+
+        assert [audio.num_frames for audio in audios] == [
+            100 * len(text) for text in texts
+        ]
+        assert calls["multi_synthesis"] == 1
+        assert client.supports_multi_synthesis is True
+
+
+@pytest.mark.asyncio
+async def test_multi_synthesis_unsupported():
+    app, calls = create_engine(has_multi_synthesis=False)
+    async with TestServer(app) as server:
+        client = VoiceVoxClient(str(server.make_url("")).rstrip("/"))
+        audio_query = await client.post_audio_query(text="こんにちは", speaker=1)
+
+        with pytest.raises(UnsupportedEndpoint):
+            await client.post_multi_synthesis(speaker=1, audio_queries=[audio_query])
+        assert client.supports_multi_synthesis is False
+
+        # remembered, not asked again
+        with pytest.raises(UnsupportedEndpoint):
+            await client.post_multi_synthesis(speaker=1, audio_queries=[audio_query])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("has_cancellable_synthesis", [True, False])
+async def test_cancellable_synthesis(has_cancellable_synthesis: bool):
+    app, calls = create_engine(has_cancellable_synthesis=has_cancellable_synthesis)
+    async with TestServer(app) as server:
+        client = VoiceVoxClient(str(server.make_url("")).rstrip("/"), cancellable=True)
+        for _ in range(2):
+            audio_query = await client.post_audio_query(text="こんにちは", speaker=1)
+            audio = await client.post_synthesis(speaker=1, audio_query=audio_query)
+            assert audio.num_frames == 500
+
+        assert client.supports("/cancellable_synthesis") is has_cancellable_synthesis
+        if has_cancellable_synthesis:
+            assert calls["cancellable_synthesis"] == 2
+            assert calls["synthesis"] == 0
+        else:
+            # probed once, then the plain endpoint
+            assert calls["synthesis"] == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("has_tempo_dynamics", [True, False])
+async def test_probe(has_tempo_dynamics: bool):
+    from src.podcast import set_speed
+
+    app, calls = create_engine(
+        has_multi_synthesis=False, has_tempo_dynamics=has_tempo_dynamics
+    )
+    async with TestServer(app) as server:
+        client = VoiceVoxClient(str(server.make_url("")).rstrip("/"))
+        capabilities = await client.preflight([1, 2])
+
+        assert capabilities.core_versions == ["0.0.0"]
+        assert capabilities.tempo_dynamics is has_tempo_dynamics
+        assert client.capabilities is capabilities
+        # learned from the schema, without a failed request
+        assert client.supports_multi_synthesis is False
+
+        await client.initialize_speaker(1)
+        assert calls["initialize_speaker"] == 1
+
+        # the capability decides, not the fields of the query
+        audio_query = await client.post_audio_query(text="こんにちは", speaker=1)
+        set_speed(audio_query, 1.1, capabilities.tempo_dynamics)
+        if has_tempo_dynamics:
+            assert audio_query.tempoDynamicsScale == 1.1
+            assert audio_query.speedScale == 1.0
+        else:
+            assert audio_query.speedScale == 1.1
+
+        with pytest.raises(EngineUnavailable):
+            await client.preflight([1, 3])
+
+
+@pytest.mark.asyncio
+async def test_probe_unreachable():
+    app, _calls = create_engine()
+    async with TestServer(app) as server:
+        endpoint = str(server.make_url("")).rstrip("/")
+
+    with pytest.raises(EngineUnavailable):
+        await VoiceVoxClient(endpoint).probe()
+
+
+@pytest.mark.asyncio
+async def test_preflight_speakers_error():
+    app, _calls = create_engine(speakers_status=500)
+    async with TestServer(app) as server:
+        client = VoiceVoxClient(str(server.make_url("")).rstrip("/"))
+        with pytest.raises(EngineUnavailable, match="500"):
+            await client.preflight([1, 2])
@@ -0,0 +1,125 @@
+import asyncio
+import pytest
+from pathlib import Path
+
+
+from src.agent import Conversation, Dialogue
+from src.audio import Audio
+from src.jobqueue import JobQueue, JobRequest
+from src.jobs import JobManager
+from src.ratelimit import RateLimit
+from src.routing import RoutingConfig
+from src.storage import AudioStore
+from src.worker import Worker, WorkerPool
+
+from mock_engine import make_wav
+
+
+class BlockingStudio:
+    """
+    Records the first line, then hangs on the second until cancelled.
+    """
+
+    def __init__(self):
+        self.recording = asyncio.Event()
+        self.cancelled = False
+
+    async def preflight(self, voicevox_client, speakers):
+        pass
+
+    async def warm_up(self, voicevox_client, speakers):
+        pass
+
+    async def record_podcast(
+        self,
+        conversation,
+        voicevox_client,
+        speaker_id,
+        supporter_id,
+        on_segment=None,
+        on_progress=None,
+        on_index=None,
+    ):
+        assert on_segment is not None
+        on_segment(0, Audio(make_wav(100)))
+        self.recording.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+@pytest.mark.asyncio
+async def test_worker_cancel(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    audio_store = AudioStore(tmp_path / "audio")
+    manager = JobManager(queue=queue, audio_store=audio_store, poll_interval=0.01)
+    worker = Worker(
+        queue=queue,
+        audio_store=audio_store,
+        api_key="",
+        voicevox_endpoint="http://127.0.0.1:10101",
+        cancel_poll=0.05,
+    )
+    studio = BlockingStudio()
+    worker.studio = studio  # type: ignore
+
+    job = await manager.submit(
+        JobRequest(
+            kind="record",
+            conversation=Conversation(
+                conversation=[
+                    Dialogue(role="speaker", content="こんにちは"),
+                    Dialogue(role="supporter", content="はい"),
+                ]
+            ),
+            speaker_id=1,
+            supporter_id=2,
+        )
+    )
+    claimed = queue.claim(worker.name, lease=30)
+    assert claimed is not None
+    running = asyncio.create_task(worker.run_job(claimed))
+
+    await asyncio.wait_for(studio.recording.wait(), timeout=5)
+    # wait for the first segment to be recorded
+    while await manager.segment_path(job.id, 0) is None:
+        await asyncio.sleep(0.01)
+    segment = Path(str(await manager.segment_path(job.id, 0)))
+
+    cancelled = await manager.cancel(job.id)
+    assert cancelled is not None and cancelled.status == "cancelled"
+
+    # the worker notices within `cancel_poll` and stops recording
+    await asyncio.wait_for(running, timeout=5)
+    assert studio.cancelled
+    assert not segment.exists()
+    assert audio_store.total_bytes == 0
+
+    job_now = await manager.get(job.id)
+    assert job_now is not None
+    assert job_now.status == "cancelled"
+    assert job_now.artifacts == []
+
+
+def test_worker_pool_splits_the_budgets(tmp_path):
+    routing = RoutingConfig(
+        rate_limits={"gemini/flash": RateLimit(requests_per_minute=10)}
+    )
+    pool = WorkerPool(
+        num_workers=3,
+        queue_path=str(tmp_path / "jobs.db"),
+        audio_dir=str(tmp_path / "audio"),
+        api_key="",
+        voicevox_endpoint="http://127.0.0.1:10101",
+        engine_concurrency=6,
+        llm_concurrency=2,
+        routing=routing,
+    )
+
+    # the processes do not share their schedulers and limiters
+    _, _, _, _, engine, llm, *_, worker_routing = pool.args
+    assert (engine, llm) == (2, 1)
+    assert worker_routing.rate_limits["gemini/flash"].requests_per_minute == 3
+    assert routing.rate_limits["gemini/flash"].requests_per_minute == 10
@@ -4,12 +4,25 @@ import aiohttp
 import dotenv
 import os
 import time
-import logging
-
-
-from src.voicevox import VoiceVoxClient
-from src.agent import Conversation
-from src.podcast import PodcastStudio
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, Callable
+
+import uvicorn
+from fastapi import FastAPI
+
+from src.voicevox import EngineCapabilities, VoiceVoxClient
+from src.agent import Conversation, Dialogue
+from src.podcast import set_speed
+from src.storage import AudioStore
+from src.examples import EXAMPLES, ExampleBundle
+from src.scheduler import Scheduler, Priority
+from src.singleflight import SingleFlight
+from src.jobs import Job, JobManager, JobRequest
+from src.jobqueue import GenerateMode, JobQueue
+from src.routing import RoutingConfig
+from src.worker import WorkerPool
+from src.api import create_router
 
 import gradio as gr
 
@@ -30,53 +43,382 @@ DEFAULT_MODELS = [
     "https://hub.aivis-project.com/aivm-models/71e72188-2726-4739-9aa9-39567396fb2a",  # ふみふみ
 ]
 AIVIS_ENDPOINT = "http://127.0.0.1:10101"
+SERVER_NAME = os.getenv("GRADIO_SERVER_NAME", "127.0.0.1")
+SERVER_PORT = int(os.getenv("GRADIO_SERVER_PORT", "7860"))
+
+AUDIO_DIR = os.getenv(
+    "PODCASTVOX_AUDIO_DIR",
+    os.path.join(tempfile.gettempdir(), "podcastvox", "audio"),
+)
+AUDIO_MAX_BYTES = int(os.getenv("PODCASTVOX_AUDIO_MAX_BYTES", str(2 * 1024**3)))
+AUDIO_TTL = float(os.getenv("PODCASTVOX_AUDIO_TTL", str(24 * 60 * 60)))
+
+ENGINE_CONCURRENCY = int(os.getenv("PODCASTVOX_ENGINE_CONCURRENCY", "2"))
+LLM_CONCURRENCY = int(os.getenv("PODCASTVOX_LLM_CONCURRENCY", "4"))
+# bytes of audio being synthesized at once in this process, finished lines do not count
+INFLIGHT_AUDIO_BUDGET = int(
+    os.getenv("PODCASTVOX_INFLIGHT_AUDIO_BUDGET", str(512 * 1024**2))
+)
+
+QUEUE_PATH = os.getenv(
+    "PODCASTVOX_QUEUE_PATH",
+    os.path.join(tempfile.gettempdir(), "podcastvox", "jobs.db"),
+)
+QUEUE_JOURNAL_MODE = os.getenv("PODCASTVOX_QUEUE_JOURNAL_MODE", "WAL")
+# finished jobs are deleted with their audio after this many seconds, or beyond this count
+JOB_TTL = float(os.getenv("PODCASTVOX_JOB_TTL", str(24 * 60 * 60)))
+MAX_JOBS = int(os.getenv("PODCASTVOX_MAX_JOBS", "1000"))
+# worker processes started next to the server, set to 0 when workers run on other machines
+LOCAL_WORKERS = int(os.getenv("PODCASTVOX_LOCAL_WORKERS", "1"))
+JOBS_PER_WORKER = int(os.getenv("PODCASTVOX_JOBS_PER_WORKER", "4"))
+SYNTHESIS_BATCH_SIZE = int(os.getenv("PODCASTVOX_SYNTHESIS_BATCH_SIZE", "1"))
+SECTION_PARALLEL = os.getenv("PODCASTVOX_SECTION_PARALLEL", "0") == "1"
+# JSON file with the models to use per agent, see routing.example.json
+ROUTING_PATH = os.getenv("PODCASTVOX_ROUTING")
+
+# examples rendered ahead of time by build_examples.py
+EXAMPLES_DIR = os.getenv(
+    "PODCASTVOX_EXAMPLES_DIR", os.path.join(os.path.dirname(__file__), "examples")
+)
+
+MAIN_SPEAKER_NAME = "Anneli (テンション高め)"
+SUPPORTER_SPEAKER_NAME = "まい (ノーマル)"
+
+job_queue = JobQueue(QUEUE_PATH, journal_mode=QUEUE_JOURNAL_MODE)
+audio_store = AudioStore(
+    AUDIO_DIR,
+    max_bytes=AUDIO_MAX_BYTES,
+    ttl=AUDIO_TTL,
+    # the audio of jobs is kept until they are pruned from the queue
+    pinned=job_queue.artifact_files,
+)
+# serve rendered audio straight from the store instead of copying it into the Gradio cache
+gr.set_static_paths([str(audio_store.root)])
+
+example_bundle = ExampleBundle.load(EXAMPLES_DIR)
+if example_bundle is not None:
+    gr.set_static_paths([EXAMPLES_DIR])
+
+# previews run in this process, podcasts run in the workers with their own scheduler: the
+# priority of previews over podcasts and ENGINE_CONCURRENCY hold within each process only
+scheduler = Scheduler(
+    limits={"engine": ENGINE_CONCURRENCY, "llm": LLM_CONCURRENCY},
+    inflight_memory_budget=INFLIGHT_AUDIO_BUDGET,
+)
+
+# generation and re-recording are queued and run by the worker processes
+job_manager = JobManager(
+    queue=job_queue, audio_store=audio_store, job_ttl=JOB_TTL, max_jobs=MAX_JOBS
+)
 
 NAVIGATOR_SAMPLE = "こんにちは！私の名前は {nickname} です。今回は私がポッドキャストをナビゲートします。よろしくお願いします！"
 ASSISTANT_SAMPLE = "こんにちは！私の名前は {nickname} です。私はサポーターとして、ナビゲーターと一緒にポッドキャストを盛り上げていきます。頑張ります！"
 
 
+def report_queue_position(progress: gr.Progress):
+    def _report(position: int):
+        if position > 0:
+            progress(0, desc=f"順番待ち: {position} 番目")
+        else:
+            progress(0, desc="処理中...")
+
+    return _report
+
+
+# session -> the job its page is waiting for
+active_jobs: dict[str, str] = {}
+
+
+async def cancel_session_job(session: str):
+    job_id = active_jobs.pop(session, None)
+    if job_id is not None:
+        await job_manager.cancel(job_id)
+
+
+async def run_job(
+    job_request: JobRequest,
+    session: str,
+    progress: gr.Progress,
+    api_key: str | None = None,
+    on_audio: Callable[[str], None] | None = None,
+) -> Job:
+    """
+    Submits a job and follows it. Starting another job from the same page, pressing cancel
+    or closing the page cancels it, so the workers stop working on it.
+    """
+
+    await cancel_session_job(session)
+    job = await job_manager.submit(job_request, api_key=api_key)
+    active_jobs[session] = job.id
+    try:
+        return await watch_job(job, progress, on_audio=on_audio)
+    except asyncio.CancelledError:
+        await asyncio.shield(job_manager.cancel(job.id))
+        raise
+    finally:
+        if active_jobs.get(session) == job.id:
+            del active_jobs[session]
+
+
+STAGE_DESCRIPTIONS = {
+    "fetch": "情報源を取得中...",
+    "blog": "解説記事を作成中...",
+    "dialogue": "台本を作成中...",
+    "structure": "会話を整形中...",
+    "recording": "音声を合成中...",
+}
+
+
+def describe_progress(stage: str, eta: float | None) -> str:
+    desc = STAGE_DESCRIPTIONS.get(stage, "処理中...")
+    if eta is None:
+        return desc
+    if eta < 60:
+        return f"{desc} (残り約 {max(int(eta), 1)} 秒)"
+    return f"{desc} (残り約 {round(eta / 60)} 分)"
+
+
+async def watch_job(
+    job: Job,
+    progress: gr.Progress,
+    on_audio: Callable[[str], None] | None = None,
+) -> Job:
+    """
+    Follows a queued job, showing its queue position and recording progress. `on_audio` is
+    called with the job id once its episode is saved, which may be before it finishes.
+    """
+
+    report_position = report_queue_position(progress)
+    while (position := await job_manager.position(job.id)) is not None:
+        report_position(position)
+        await asyncio.sleep(job_manager.poll_interval)
+    report_position(0)
+
+    async for event in job_manager.events(job.id):
+        if event.type == "progress" and event.data.get("background"):
+            # e.g. the blog of a fast job, the user waits for the other stages
+            continue
+        if event.type == "progress":
+            desc = describe_progress(event.data["stage"], event.data.get("eta"))
+            if event.data["stage"] == "fetch" and event.data["total"] > 1:
+                progress(
+                    (event.data["done"], event.data["total"]),
+                    desc=desc,
+                    unit="sources",
+                )
+            elif event.data["status"] == "started":
+                progress(0, desc=desc)
+        elif event.type == "segment":
+            progress(
+                (event.data["lines_done"], event.data["lines_total"]),
+                desc=describe_progress("recording", event.data.get("eta")),
+                unit="lines",
+            )
+        elif event.type == "audio" and on_audio is not None:
+            on_audio(job.id)
+        elif event.type == "status" and event.data.get("status") == "queued":
+            report_position(await job_manager.position(job.id) or 0)
+
+    job = await job_manager.get(job.id)
+    assert job is not None
+    if job.status == "cancelled":
+        raise gr.Error("キャンセルされました")
+    if job.status != "succeeded":
+        raise gr.Error(f"Podcast の生成に失敗しました: {job.error or job.status}")
+    return job
+
+
+def parse_urls(text: str) -> list[str]:
+    # one per line (or separated by spaces or ", ")
+    urls = [url.rstrip(",") for url in text.split()]
+    urls = [url for url in urls if url != ""]
+    if len(urls) == 0:
+        raise gr.Error("URL を入力してください")
+    return urls
+
+
+GENERATE_MODES = [("品質優先", "quality"), ("速度優先", "fast")]
+
+# what `generate_podcast` yields
+PodcastOutputs = tuple[
+    str, str, list[list[str]], Conversation, str, dict, dict, str | None
+]
+
+
+def podcast_outputs(
+    audio_path: str,
+    blog: str,
+    conversation: Conversation,
+    time_elapsed_text: str,
+    job_id: str | None,
+) -> PodcastOutputs:
+    return (
+        audio_path,
+        blog,
+        conversation_rows(conversation),
+        conversation,
+        time_elapsed_text,
+        gr.update(visible=True),
+        gr.update(visible=True),
+        job_id,
+    )
+
+
+async def job_outputs(
+    job_id: str, time_elapsed_text: str, finished: bool = True
+) -> PodcastOutputs:
+    blog = await job_manager.artifact(job_id, "blog.md")
+    if blog is None:
+        # a fast job writes the blog after the audio, and keeps the audio if it fails
+        blog = (
+            "解説記事を作成できませんでした。"
+            if finished
+            else "解説記事を作成中です..."
+        )
+    conversation_json = await job_manager.artifact(job_id, "conversation.json")
+    audio_path = await job_manager.artifact_path(job_id, "podcast.wav")
+    assert conversation_json is not None and audio_path is not None
+    return podcast_outputs(
+        audio_path,
+        blog,
+        Conversation.model_validate_json(conversation_json),
+        time_elapsed_text,
+        job_id,
+    )
+
+
 async def generate_podcast(
     voicevox_endpoint: str,
     llm_api_key: str,
     pdf_url: str,
     speaker_name: str,
     supporter_name: str,
+    mode: GenerateMode,
     speaker2id: dict[str, int],
-) -> tuple[str, str, object, Conversation, str, dict]:
-    client = VoiceVoxClient(voicevox_endpoint)
+    request: gr.Request,
+    progress: gr.Progress = gr.Progress(),
+) -> AsyncIterator[PodcastOutputs]:
+    """
+    Yields the episode as soon as its audio is ready, and again with the blog if it was
+    still being written (fast mode).
+    """
 
     speaker_id = speaker2id[speaker_name]
     supporter_id = speaker2id[supporter_name]
-
-    podcast_studio = PodcastStudio(
-        api_key=llm_api_key,
-        logging_level=logging.DEBUG,
+    urls = parse_urls(pdf_url)
+    example = (
+        example_bundle.find(urls[0])
+        if example_bundle is not None and len(urls) == 1
+        else None
     )
 
     start_time = time.time()
 
-    blog, _dialogue, conversation = await podcast_studio.create_conversation(pdf_url)
-    podcast_audio = await podcast_studio.record_podcast(
-        conversation=conversation,
-        voicevox_client=client,
-        speaker_id=speaker_id,
-        supporter_id=supporter_id,
+    if example is not None:
+        if (example.speaker_name, example.supporter_name) == (
+            speaker_name,
+            supporter_name,
+        ) and (example.speaker_id, example.supporter_id) == (speaker_id, supporter_id):
+            # rendered with these voices already
+            audio_path = str(Path(EXAMPLES_DIR) / example.audio)
+            job_id = None
+        else:
+            # the script is ready, only the voices change
+            job = await run_job(
+                JobRequest(
+                    kind="record",
+                    conversation=example.conversation,
+                    speaker_id=speaker_id,
+                    supporter_id=supporter_id,
+                    voicevox_endpoint=voicevox_endpoint,
+                ),
+                session=request.session_hash or "anonymous",
+                progress=progress,
+            )
+            audio_path = await job_manager.artifact_path(job.id, "podcast.wav")
+            assert audio_path is not None
+            job_id = job.id
+
+        elapsed_time = time.time() - start_time
+        yield podcast_outputs(
+            audio_path,
+            example.blog,
+            example.conversation,
+            f"処理時間: {elapsed_time:.2f} 秒",
+            job_id,
+        )
+        return
+
+    # resolved with the job id once its episode is saved
+    audio_ready: asyncio.Future[str] = asyncio.get_running_loop().create_future()
+    running = asyncio.create_task(
+        run_job(
+            JobRequest(
+                kind="generate",
+                urls=urls,
+                mode=mode,
+                speaker_id=speaker_id,
+                supporter_id=supporter_id,
+                voicevox_endpoint=voicevox_endpoint,
+            ),
+            session=request.session_hash or "anonymous",
+            progress=progress,
+            # the workers fall back to their own key when none is given
+            api_key=llm_api_key if llm_api_key != GEMINI_API_KEY else None,
+            on_audio=lambda job_id: (
+                audio_ready.done() or audio_ready.set_result(job_id)
+            ),
+        )
     )
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-        temp_file.write(podcast_audio.wav)
-        temp_file_path = temp_file.name
+    time_to_audio: float | None = None
+    try:
+        await asyncio.wait([running, audio_ready], return_when=asyncio.FIRST_COMPLETED)
+        if audio_ready.done():
+            time_to_audio = time.time() - start_time
+            if not running.done():
+                # the blog may still be being written, play the episode meanwhile
+                yield await job_outputs(
+                    audio_ready.result(),
+                    f"音声までの時間: {time_to_audio:.2f} 秒",
+                    finished=False,
+                )
+        job = await running
+    finally:
+        running.cancel()
+        audio_ready.cancel()
 
     elapsed_time = time.time() - start_time
     time_elapsed_text = f"処理時間: {elapsed_time:.2f} 秒"
-
-    return (
-        temp_file_path,
-        blog,
-        conversation.model_dump(),
-        conversation,
-        time_elapsed_text,
-        gr.update(visible=True),
+    if time_to_audio is not None:
+        time_elapsed_text += f" (音声まで {time_to_audio:.2f} 秒)"
+    yield await job_outputs(job.id, time_elapsed_text)
+
+
+def conversation_rows(conversation: Conversation) -> list[list[str]]:
+    return [[dialogue.role, dialogue.content] for dialogue in conversation.conversation]
+
+
+def edit_conversation(
+    conversation: Conversation, rows: list[list[str]]
+) -> Conversation:
+    # only the lines can be edited, adding or removing rows needs a new episode
+    if len(rows) != len(conversation.conversation):
+        raise gr.Error("台詞の追加・削除はできません。編集は各行の台詞のみです")
+    changed = [
+        i + 1
+        for i, (dialogue, row) in enumerate(zip(conversation.conversation, rows))
+        if str(row[0]).strip() != dialogue.role
+    ]
+    if len(changed) > 0:
+        raise gr.Error(
+            f"話者 (role) は変更できません ({', '.join(map(str, changed))} 行目)。"
+            "編集は各行の台詞のみです"
+        )
+    return Conversation(
+        conversation=[
+            Dialogue(role=dialogue.role, content=str(row[1]).strip())
+            for dialogue, row in zip(conversation.conversation, rows)
+        ]
     )
 
 
@@ -86,30 +428,74 @@ async def change_speaker(
     supporter_name: str,
     speaker2id: dict[str, int],
     conversation_cache: Conversation,
-) -> tuple[str, str]:
-    client = VoiceVoxClient(voicevox_endpoint)
-
+    request: gr.Request,
+    progress: gr.Progress = gr.Progress(),
+) -> tuple[str, str, str]:
     speaker_id = speaker2id[speaker_name]
     supporter_id = speaker2id[supporter_name]
 
-    podcast_studio = PodcastStudio(api_key="")  # only voice synthesis
+    start_time = time.time()
 
+    job = await run_job(
+        JobRequest(
+            kind="record",
+            conversation=conversation_cache,
+            speaker_id=speaker_id,
+            supporter_id=supporter_id,
+            voicevox_endpoint=voicevox_endpoint,
+        ),
+        session=request.session_hash or "anonymous",
+        progress=progress,
+    )
+
+    audio_path = await job_manager.artifact_path(job.id, "podcast.wav")
+    assert audio_path is not None
+
+    elapsed_time = time.time() - start_time
+    time_elapsed_text = f"処理時間: {elapsed_time:.2f} 秒"
+
+    return audio_path, time_elapsed_text, job.id
+
+
+async def rerecord_edited_lines(
+    voicevox_endpoint: str,
+    speaker_name: str,
+    supporter_name: str,
+    speaker2id: dict[str, int],
+    conversation_cache: Conversation,
+    rows: list[list[str]],
+    last_job_id: str | None,
+    request: gr.Request,
+    progress: gr.Progress = gr.Progress(),
+) -> tuple[str, Conversation, str, str]:
+    """
+    Records only the lines edited in the table and splices them into the last episode.
+    """
+
+    conversation = edit_conversation(conversation_cache, rows)
     start_time = time.time()
-    podcast_audio = await podcast_studio.record_podcast(
-        conversation=conversation_cache,
-        voicevox_client=client,
-        speaker_id=speaker_id,
-        supporter_id=supporter_id,
+
+    job = await run_job(
+        JobRequest(
+            kind="record",
+            conversation=conversation,
+            # falls back to recording every line if the speakers changed since
+            base_job=last_job_id,
+            speaker_id=speaker2id[speaker_name],
+            supporter_id=speaker2id[supporter_name],
+            voicevox_endpoint=voicevox_endpoint,
+        ),
+        session=request.session_hash or "anonymous",
+        progress=progress,
     )
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-        temp_file.write(podcast_audio.wav)
-        temp_file_path = temp_file.name
+    audio_path = await job_manager.artifact_path(job.id, "podcast.wav")
+    assert audio_path is not None
 
     elapsed_time = time.time() - start_time
     time_elapsed_text = f"処理時間: {elapsed_time:.2f} 秒"
 
-    return temp_file_path, time_elapsed_text
+    return audio_path, conversation, time_elapsed_text, job.id
 
 
 async def get_speakers(endpoint: str):
@@ -160,25 +546,188 @@ async def preview_speaker_voice(
     else:
         sample_text = ASSISTANT_SAMPLE.format(nickname=speaker_nickname)
 
-    audio_query = await client.post_audio_query(
-        text=sample_text,
-        speaker=speaker_id,
-    )
-    if audio_query.tempoDynamicsScale is not None:
-        audio_query.tempoDynamicsScale = 1.1
-    else:
-        audio_query.speedScale = 1.1
+    capabilities = await client.probe()
+    async with scheduler.slot("engine"):
+        audio_query = await client.post_audio_query(
+            text=sample_text,
+            speaker=speaker_id,
+        )
+        set_speed(audio_query, 1.1, capabilities.tempo_dynamics)
 
-    audio = await client.post_synthesis(
-        speaker=speaker_id,
-        audio_query=audio_query,
-    )
+        audio = await client.post_synthesis(
+            speaker=speaker_id,
+            audio_query=audio_query,
+        )
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-        temp_file.write(audio.wav)
-        temp_file_path = temp_file.name
+    audio_path = audio_store.put(audio.wav)
+
+    return audio_path
+
+
+class StartupState:
+    """
+    Engine discovery and preview warm-up that run in the background after the server is up.
+
+    Discovery is retried with backoff until the engine answers, without holding back
+    readiness. The last `max_previews` previews rendered are remembered.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        main_speaker_name: str,
+        supporter_speaker_name: str,
+        max_previews: int = 64,
+        max_retry_interval: float = 60.0,
+    ):
+        self.endpoint = endpoint
+        self.main_speaker_name = main_speaker_name
+        self.supporter_speaker_name = supporter_speaker_name
+        self.max_previews = max_previews
+        self.max_retry_interval = max_retry_interval
+
+        self.started_at = time.time()
+        self.speakers: list[str] = []
+        self.speaker2id: dict[str, int] = {}
+        self.capabilities: EngineCapabilities | None = None
+        # least recently used first
+        self.previews: OrderedDict[tuple[str, str, bool], str] = OrderedDict()
+        self.errors: dict[str, str] = {}
+        self.flights = SingleFlight()
+        self.discovery_attempts = 0
+
+        self.speakers_task: asyncio.Task | None = None
+        self.previews_task: asyncio.Task | None = None
+        # set after the first discovery attempt, whether it succeeded or not
+        self.first_attempt = asyncio.Event()
+
+    def start(self):
+        self.speakers_task = asyncio.create_task(self._discover())
+        self.previews_task = asyncio.create_task(self._warm_previews())
+
+    async def _discover(self):
+        interval = min(1.0, self.max_retry_interval)
+        while True:
+            self.discovery_attempts += 1
+            try:
+                self.capabilities = await VoiceVoxClient(self.endpoint).probe()
+                self.speakers, self.speaker2id = await get_speakers(self.endpoint)
+            except Exception as e:
+                self.errors["speakers"] = repr(e)
+            else:
+                self.errors.pop("speakers", None)
+            finally:
+                self.first_attempt.set()
+            if len(self.speakers) > 0:
+                return
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_retry_interval)
+
+    async def _warm_previews(self):
+        assert self.speakers_task is not None
+        await self.speakers_task
+
+        async def _warm(speaker_name: str, is_main_speaker: bool):
+            if speaker_name not in self.speaker2id:
+                return
+            try:
+                with scheduler.context("startup", Priority.PREVIEW):
+                    await self.get_preview(
+                        voicevox_endpoint=self.endpoint,
+                        speaker_name=speaker_name,
+                        speaker_id=self.speaker2id[speaker_name],
+                        is_main_speaker=is_main_speaker,
+                    )
+            except Exception as e:
+                self.errors[f"preview:{speaker_name}"] = repr(e)
+
+        await asyncio.gather(
+            _warm(self.main_speaker_name, True),
+            _warm(self.supporter_speaker_name, False),
+        )
 
-    return temp_file_path
+    async def wait_speakers(self) -> tuple[list[str], dict[str, int]]:
+        """
+        The speakers, waiting for the first discovery attempt only: empty while the engine
+        is down.
+        """
+
+        if self.speakers_task is not None:
+            await self.first_attempt.wait()
+        return self.speakers, self.speaker2id
+
+    async def get_preview(
+        self,
+        voicevox_endpoint: str,
+        speaker_name: str,
+        speaker_id: int,
+        is_main_speaker: bool,
+    ) -> str:
+        key = (voicevox_endpoint, speaker_name, is_main_speaker)
+        if key in self.previews and audio_store.get(self.previews[key]) is None:
+            # evicted from the audio store
+            del self.previews[key]
+        if key in self.previews:
+            self.previews.move_to_end(key)
+            return self.previews[key]
+
+        # everyone opening the page at once waits on the same rendering
+        path = await self.flights.do(
+            key,
+            lambda: preview_speaker_voice(
+                voicevox_endpoint=voicevox_endpoint,
+                speaker_name=speaker_name,
+                speaker_id=speaker_id,
+                is_main_speaker=is_main_speaker,
+            ),
+        )
+        self.previews[key] = path
+        self.previews.move_to_end(key)
+        while len(self.previews) > self.max_previews:
+            self.previews.popitem(last=False)
+        return path
+
+    def status(self) -> dict:
+        def _task_state(task: asyncio.Task | None) -> str:
+            if task is None:
+                return "pending"
+            if not task.done():
+                return "running"
+            return "done"
+
+        return {
+            # serving is enough, the engine may come up later
+            "ready": True,
+            "engine_ready": len(self.speakers) > 0,
+            "uptime": time.time() - self.started_at,
+            "endpoint": self.endpoint,
+            "engine": (
+                None if self.capabilities is None else self.capabilities.model_dump()
+            ),
+            "speakers": {
+                "state": _task_state(self.speakers_task),
+                "count": len(self.speakers),
+                "attempts": self.discovery_attempts,
+            },
+            "previews": {
+                "state": _task_state(self.previews_task),
+                "warm": [
+                    name
+                    for (endpoint, name, _), _path in self.previews.items()
+                    if endpoint == self.endpoint
+                ],
+            },
+            "examples": (0 if example_bundle is None else len(example_bundle.examples)),
+            "errors": self.errors,
+            "scheduler": scheduler.stats(),
+        }
+
+
+startup_state = StartupState(
+    endpoint=AIVIS_ENDPOINT,
+    main_speaker_name=MAIN_SPEAKER_NAME,
+    supporter_speaker_name=SUPPORTER_SPEAKER_NAME,
+)
 
 
 async def on_change_speaker(
@@ -186,43 +735,71 @@ async def on_change_speaker(
     speaker_name: str,
     speaker2id: dict[str, int],
     is_main_speaker: bool,
+    request: gr.Request,
+    progress: gr.Progress = gr.Progress(),
 ):
     speaker_id = speaker2id[speaker_name]
-    return await preview_speaker_voice(
-        voicevox_endpoint=voicevox_endpoint,
-        speaker_name=speaker_name,
-        speaker_id=speaker_id,
-        is_main_speaker=is_main_speaker,
+    with scheduler.context(
+        session=request.session_hash or "anonymous",
+        priority=Priority.PREVIEW,
+        on_position=report_queue_position(progress),
+    ):
+        return await startup_state.get_preview(
+            voicevox_endpoint=voicevox_endpoint,
+            speaker_name=speaker_name,
+            speaker_id=speaker_id,
+            is_main_speaker=is_main_speaker,
+        )
+
+
+async def on_unload(request: gr.Request):
+    await cancel_session_job(request.session_hash or "anonymous")
+
+
+async def on_load():
+    speakers, speaker2id = await startup_state.wait_speakers()
+    if len(speakers) == 0:
+        return gr.update(), gr.update(), speaker2id
+
+    main_speaker_name = (
+        MAIN_SPEAKER_NAME if MAIN_SPEAKER_NAME in speaker2id else speakers[0]
+    )
+    supporter_speaker_name = (
+        SUPPORTER_SPEAKER_NAME
+        if SUPPORTER_SPEAKER_NAME in speaker2id
+        else speakers[min(1, len(speakers) - 1)]
+    )
+    return (
+        gr.update(choices=speakers, value=main_speaker_name),
+        gr.update(choices=speakers, value=supporter_speaker_name),
+        speaker2id,
+    )
+
+
+def create_app(demo: gr.Blocks) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.get("/readyz")
+    async def readyz():
+        return startup_state.status()
+
+    app.include_router(create_router(job_manager), prefix="/api")
+
+    return gr.mount_gradio_app(
+        app,
+        demo,
+        path="/",
+        server_name=SERVER_NAME,
+        server_port=SERVER_PORT,
     )
 
 
 async def main():
-    initial_endpoint = AIVIS_ENDPOINT
-    try:
-        speakers, spaker2id = await get_speakers(initial_endpoint)
-    except Exception as _e:
-        speakers = []
-        spaker2id = {}
-
-    main_speaker_name = "Anneli (テンション高め)"
-    supporter_speaker_name = "まい (ノーマル)"
-
-    main_speaker_preview = None
-    supporter_speaker_preview = None
-    if main_speaker_name is not None:
-        main_speaker_preview = await preview_speaker_voice(
-            voicevox_endpoint=initial_endpoint,
-            speaker_name=main_speaker_name,
-            speaker_id=spaker2id.get(main_speaker_name, 0),
-            is_main_speaker=True,
-        )
-    if supporter_speaker_name is not None:
-        supporter_speaker_preview = await preview_speaker_voice(
-            voicevox_endpoint=initial_endpoint,
-            speaker_name=supporter_speaker_name,
-            speaker_id=spaker2id.get(supporter_speaker_name, 0),
-            is_main_speaker=False,
-        )
+    initial_endpoint = startup_state.endpoint
 
     with gr.Blocks() as demo:
         gr.Markdown(
@@ -252,30 +829,28 @@ Gemini Flash 2.5 と Aivis Speech を利用して、Web サイトを情報源と
                         with gr.Column():
                             speakers_dropdown = gr.Dropdown(
                                 label="メイン話者",
-                                choices=speakers,
-                                value=main_speaker_name,
+                                choices=[],
+                                value=None,
                                 multiselect=False,
                             )
                             speaker_preview_audio = gr.Audio(
                                 label="メイン話者音声プレビュー",
                                 type="filepath",
-                                value=main_speaker_preview,
                             )
 
                         with gr.Column():
                             supporter_dropdown = gr.Dropdown(
                                 label="サポーター話者",
-                                choices=speakers,
-                                value=supporter_speaker_name,
+                                choices=[],
+                                value=None,
                                 multiselect=False,
                             )
                             supporter_preview_audio = gr.Audio(
                                 label="サポーター音声プレビュー",
                                 type="filepath",
-                                value=supporter_speaker_preview,
                             )
 
-                    spaker2id_map = gr.State(value=spaker2id)
+                    spaker2id_map = gr.State(value={})
 
                     change_speaker_button = gr.Button(
                         "この話者で再生成",
@@ -301,14 +876,21 @@ Gemini Flash 2.5 と Aivis Speech を利用して、Web サイトを情報源と
                         visible=False,
                     )
                     pdf_url_text = gr.Textbox(
-                        label="情報源となる Web サイト の URL (1つのみ)",
-                        placeholder="例) https://arxiv.org/pdf/2308.06721, https://example.com/index.html",
-                        lines=1,
-                        info="Podcast のテーマとなる Web サイト の URL を入力してください。HTML、PDF に対応しています。",
+                        label="情報源となる Web サイト の URL (改行区切りで複数可)",
+                        placeholder="例) https://arxiv.org/pdf/2308.06721\nhttps://example.com/index.html",
+                        lines=3,
+                        info="Podcast のテーマとなる Web サイト の URL を入力してください。論文とプロジェクトページなど、複数の情報源をまとめて 1 つの Podcast にできます。HTML、PDF に対応しています。",
+                    )
+                    mode_radio = gr.Radio(
+                        label="生成モード",
+                        choices=GENERATE_MODES,
+                        value="quality",
+                        info="速度優先では、解説記事を待たずに台本を作成するので、音声が早く届きます (解説記事は後から表示されます)。",
                     )
                     submit_button = gr.Button(
                         "生成 (約 5 分程度かかります)", variant="primary"
                     )
+                    cancel_button = gr.Button("キャンセル", variant="stop")
 
                 time_elapsed_text = gr.Markdown(
                     value="",
@@ -320,6 +902,8 @@ Gemini Flash 2.5 と Aivis Speech を利用して、Web サイトを情報源と
                     autoplay=True,
                 )
                 conversation_cache = gr.State(value=None)
+                # the job that rendered `output_audio`, edits are spliced into it
+                last_job_id = gr.State(value=None)
 
                 with gr.Accordion("生成されたブログ", open=False):
                     blog_output = gr.Markdown(
@@ -328,54 +912,35 @@ Gemini Flash 2.5 と Aivis Speech を利用して、Web サイトを情報源と
                     )
 
                 with gr.Accordion("生成された会話", open=False):
-                    conversation_output = gr.JSON(label="Conversation Output", value={})
+                    conversation_output = gr.Dataframe(
+                        label="Conversation Output",
+                        headers=["role", "content"],
+                        datatype=["str", "str"],
+                        type="array",
+                        interactive=True,
+                        # only the lines can be edited, see `edit_conversation`
+                        static_columns=[0],
+                        wrap=True,
+                    )
+                    rerecord_button = gr.Button(
+                        "編集した台詞だけ再収録",
+                        variant="secondary",
+                        visible=False,
+                    )
 
         gr.Examples(
-            examples=[
-                [
-                    "LoRA: Low-Rank Adaptation of Large Language Models",
-                    "https://arxiv.org/pdf/2106.09685",
-                ],  # LoRA
-                [
-                    "Cosmos World Foundation Model Platform for Physical AI",
-                    "https://arxiv.org/pdf/2501.03575",
-                ],  # Cosmos
-                [
-                    "Inductive Moment Matching (IMM)",
-                    "https://arxiv.org/pdf/2503.07565",
-                ],  # Inductive Moment Matching
-                [
-                    "Sigmoid Loss for Language Image Pre-Training (SigLIP)",
-                    "https://arxiv.org/pdf/2303.15343",
-                ],  # SigLIP
-                [
-                    "Scalable Diffusion Models with Transformers (DiT)",
-                    "https://arxiv.org/pdf/2212.09748",
-                ],  # DiT
-                [
-                    "TAID: Temporally Adaptive Interpolated Distillation for Efficient Knowledge Transfer in Language Models",
-                    "https://arxiv.org/pdf/2501.16937",
-                ],  # TAID
-                [
-                    "Contrastive Representation Learning",
-                    "https://lilianweng.github.io/posts/2021-05-31-contrastive/",
-                ],  # Contrastive Learning
-                [
-                    "羅生門 | 青空文庫",
-                    "https://www.aozora.gr.jp/cards/000879/files/127_15260.html",
-                ],  # 羅生門
-                [
-                    "双曲空間でのMachine Learningの最近の進展",
-                    "https://tech-blog.abeja.asia/entry/hyperbolic_ml_2019",
-                ],  # 双曲空間
-                [
-                    "Asagi VLM: 合成データセットを活用した大規模日本語 VLM",
-                    "https://uehara-mech.github.io/assets/nlp2025-asagi-vlm.pdf",
-                ],  # Asagi VLM
-            ],
+            examples=[list(example) for example in EXAMPLES],
             inputs=[website_title, pdf_url_text],
         )
 
+        demo.load(
+            fn=on_load,
+            outputs=[
+                speakers_dropdown,
+                supporter_dropdown,
+                spaker2id_map,
+            ],
+        )
         gr.on(
             triggers=[endpoint_text.change],
             fn=on_endpoint_change,
@@ -385,9 +950,9 @@ Gemini Flash 2.5 と Aivis Speech を利用して、Web サイトを情報源と
                 supporter_dropdown,
                 spaker2id_map,
             ],
-            concurrency_limit=10,
+            concurrency_limit=None,  # admission is done by the scheduler
         )
-        gr.on(
+        generate_event = gr.on(
             triggers=[submit_button.click],
             fn=generate_podcast,
             inputs=[
@@ -396,6 +961,7 @@ Gemini Flash 2.5 と Aivis Speech を利用して、Web サイトを情報源と
                 pdf_url_text,
                 speakers_dropdown,
                 supporter_dropdown,
+                mode_radio,
                 spaker2id_map,
             ],
             outputs=[
@@ -405,10 +971,12 @@ Gemini Flash 2.5 と Aivis Speech を利用して、Web サイトを情報源と
                 conversation_cache,
                 time_elapsed_text,
                 change_speaker_button,  # make visible after generation
+                rerecord_button,
+                last_job_id,
             ],
-            concurrency_limit=10,
+            concurrency_limit=None,  # admission is done by the scheduler
         )
-        gr.on(
+        change_speaker_event = gr.on(
             triggers=[change_speaker_button.click],
             fn=change_speaker,
             inputs=[
@@ -421,8 +989,29 @@ Gemini Flash 2.5 と Aivis Speech を利用して、Web サイトを情報源と
             outputs=[
                 output_audio,
                 time_elapsed_text,
+                last_job_id,
+            ],
+            concurrency_limit=None,  # admission is done by the scheduler
+        )
+        rerecord_event = gr.on(
+            triggers=[rerecord_button.click],
+            fn=rerecord_edited_lines,
+            inputs=[
+                endpoint_text,
+                speakers_dropdown,
+                supporter_dropdown,
+                spaker2id_map,
+                conversation_cache,
+                conversation_output,
+                last_job_id,
+            ],
+            outputs=[
+                output_audio,
+                conversation_cache,
+                time_elapsed_text,
+                last_job_id,
             ],
-            concurrency_limit=10,
+            concurrency_limit=None,  # admission is done by the scheduler
         )
         gr.on(
             triggers=[
@@ -436,7 +1025,7 @@ Gemini Flash 2.5 と Aivis Speech を利用して、Web サイトを情報源と
                 gr.State(value=True),
             ],
             outputs=[speaker_preview_audio],
-            concurrency_limit=10,
+            concurrency_limit=None,  # admission is done by the scheduler
         )
         gr.on(
             triggers=[
@@ -450,10 +1039,49 @@ Gemini Flash 2.5 と Aivis Speech を利用して、Web サイトを情報源と
                 gr.State(value=False),
             ],
             outputs=[supporter_preview_audio],
-            concurrency_limit=10,
+            concurrency_limit=None,  # admission is done by the scheduler
+        )
+        # cancelling the handler cancels its job, and so does leaving the page
+        cancel_button.click(
+            fn=None,
+            cancels=[generate_event, change_speaker_event, rerecord_event],
         )
+        demo.unload(on_unload)
+
+    app = create_app(demo)
+    server = uvicorn.Server(
+        uvicorn.Config(app, host=SERVER_NAME, port=SERVER_PORT),
+    )
 
-    demo.launch()
+    pool = None
+    if LOCAL_WORKERS > 0:
+        pool = WorkerPool(
+            num_workers=LOCAL_WORKERS,
+            queue_path=QUEUE_PATH,
+            audio_dir=AUDIO_DIR,
+            api_key=GEMINI_API_KEY,
+            voicevox_endpoint=AIVIS_ENDPOINT,
+            engine_concurrency=ENGINE_CONCURRENCY,
+            llm_concurrency=LLM_CONCURRENCY,
+            journal_mode=QUEUE_JOURNAL_MODE,
+            jobs_per_worker=JOBS_PER_WORKER,
+            studio_options={
+                "synthesis_batch_size": SYNTHESIS_BATCH_SIZE,
+                "section_parallel": SECTION_PARALLEL,
+            },
+            routing=RoutingConfig.load(ROUTING_PATH) if ROUTING_PATH else None,
+        )
+        pool.start()
+        supervisor = asyncio.create_task(pool.supervise())
+
+    # the server comes up immediately, engine discovery and previews warm up behind it
+    startup_state.start()
+    try:
+        await server.serve()
+    finally:
+        if pool is not None:
+            supervisor.cancel()
+            pool.stop()
 
 
 async def runner():
@@ -0,0 +1,110 @@
+import argparse
+import dotenv
+import logging
+import os
+import tempfile
+
+from src.routing import RoutingConfig
+from src.worker import WorkerPool
+
+dotenv.load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run PodcastVox workers that take jobs from the shared queue."
+    )
+    parser.add_argument(
+        "--queue",
+        default=os.getenv(
+            "PODCASTVOX_QUEUE_PATH",
+            os.path.join(tempfile.gettempdir(), "podcastvox", "jobs.db"),
+        ),
+        help="path to the SQLite queue file (may be on a network mount)",
+    )
+    parser.add_argument(
+        "--journal-mode",
+        default=os.getenv("PODCASTVOX_QUEUE_JOURNAL_MODE", "WAL"),
+        help="SQLite journal mode, use DELETE on network mounts",
+    )
+    parser.add_argument(
+        "--audio-dir",
+        default=os.getenv(
+            "PODCASTVOX_AUDIO_DIR",
+            os.path.join(tempfile.gettempdir(), "podcastvox", "audio"),
+        ),
+        help="audio store directory shared with the web server",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("PODCASTVOX_WORKERS", "2")),
+        help="number of worker processes on this machine",
+    )
+    parser.add_argument(
+        "--jobs-per-worker",
+        type=int,
+        default=int(os.getenv("PODCASTVOX_JOBS_PER_WORKER", "4")),
+        help="jobs each worker process runs at once",
+    )
+    parser.add_argument(
+        "--synthesis-batch-size",
+        type=int,
+        default=int(os.getenv("PODCASTVOX_SYNTHESIS_BATCH_SIZE", "1")),
+        help="lines per /multi_synthesis request, 1 synthesizes line by line",
+    )
+    parser.add_argument(
+        "--endpoint",
+        default=os.getenv("PODCASTVOX_VOICEVOX_ENDPOINT", "http://127.0.0.1:10101"),
+        help="VOICEVOX compatible engine endpoint",
+    )
+    parser.add_argument(
+        "--engine-concurrency",
+        type=int,
+        default=int(os.getenv("PODCASTVOX_ENGINE_CONCURRENCY", "2")),
+        help="engine requests at once, split between the worker processes",
+    )
+    parser.add_argument(
+        "--llm-concurrency",
+        type=int,
+        default=int(os.getenv("PODCASTVOX_LLM_CONCURRENCY", "4")),
+        help="LLM requests at once, split between the worker processes",
+    )
+    parser.add_argument(
+        "--section-parallel",
+        action=argparse.BooleanOptionalAction,
+        default=os.getenv("PODCASTVOX_SECTION_PARALLEL", "0") == "1",
+        help="write the script's sections concurrently",
+    )
+    parser.add_argument(
+        "--routing",
+        default=os.getenv("PODCASTVOX_ROUTING"),
+        help="JSON file with the models to use per agent (see routing.example.json)",
+    )
+    parser.add_argument("--lease", type=float, default=30.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    pool = WorkerPool(
+        num_workers=args.workers,
+        queue_path=args.queue,
+        audio_dir=args.audio_dir,
+        api_key=os.getenv("GEMINI_API_KEY", ""),
+        voicevox_endpoint=args.endpoint,
+        engine_concurrency=args.engine_concurrency,
+        llm_concurrency=args.llm_concurrency,
+        lease=args.lease,
+        journal_mode=args.journal_mode,
+        jobs_per_worker=args.jobs_per_worker,
+        studio_options={
+            "synthesis_batch_size": args.synthesis_batch_size,
+            "section_parallel": args.section_parallel,
+        },
+        routing=RoutingConfig.load(args.routing) if args.routing else None,
+    )
+    pool.run_forever()
+
+
+if __name__ == "__main__":
+    main()